@@ -0,0 +1,319 @@
+'''
+This file takes care of the per-user response cache of List and Read.
+
+Dashboards poll the report list far more often than reports change, so
+the JSON body of those GET responses is kept in a cache, keyed by
+    report:<user_id>:<version>:<path and query>
+The version is a counter per user. Handlers that change the reports of
+a user call invalidate() inside their transaction and the counter is
+bumped once it commits, so every older entry of the user stops being
+used at once, without being looked up or deleted; the backend evicts it
+later. The version is read before the database, so a response that races
+with a write is stored under the old version and never served.
+
+A replica that lags behind would still return the reports from before
+the change, and its response would be cached under the new version. So
+for PRIMARY_WINDOW seconds after a change, the cached views of the user
+read from the primary; the mark of the change is kept in the backend,
+next to the version, so every worker sees it.
+
+Two backends implement the same interface:
+    - LRUBackend: in the worker process, bounded by the total size of the
+      cached bodies. Only safe with a single worker process, as the
+      other processes would not see the invalidations.
+    - RedisBackend: shared by every worker and node; needs the optional
+      redis package, or any client with the same get/set/incr methods.
+
+Cached responses carry `X-Cache: HIT`, the others `X-Cache: MISS`.
+stats() returns the hit and miss counts of the worker.
+'''
+import time
+import threading
+from functools import wraps
+from urllib.parse import urlencode
+from collections import OrderedDict
+from flask import request, current_app
+from flask_security import current_user
+from sqlalchemy import event
+from api.conf.database import db_session
+from api import routing
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+
+class LRUBackend():
+    '''
+    In-process cache that evicts the least recently used entries once
+    the cached values exceed max_bytes.
+    Version counters are kept apart and never evicted.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Return the value of a key, or None if it is missing or expired.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self._counters.get(key)
+            value, expires = entry
+            if expires < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        '''
+        Store a value for ttl seconds. Values larger than the whole
+        cache are not stored.
+        '''
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def add(self, key, value):
+        '''
+        Set a counter unless it exists.
+        '''
+        with self._lock:
+            self._counters.setdefault(key, value)
+
+    def incr(self, key):
+        '''
+        Increment a counter and return its new value.
+        '''
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        '''
+        Size of the cache.
+        '''
+        return {'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions}
+
+    def _discard(self, key):
+        value, _ = self._entries.pop(key)
+        self.bytes -= len(value)
+
+
+class RedisBackend():
+    '''
+    Cache shared by every worker, stored in Redis.
+    Entries expire after their ttl; counters have no expiry.
+    '''
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        '''
+        Connect to the Redis server at url, e.g. redis://localhost:6379/0.
+        '''
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE=redis needs the redis package.')
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        '''
+        Return the value of a key, or None if it is missing.
+        '''
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        '''
+        Store a value for ttl seconds.
+        '''
+        self.client.set(key, value, ex=ttl)
+
+    def add(self, key, value):
+        '''
+        Set a counter unless it exists.
+        '''
+        self.client.set(key, value, nx=True)
+
+    def incr(self, key):
+        '''
+        Increment a counter and return its new value.
+        '''
+        return self.client.incr(key)
+
+    def stats(self):
+        '''
+        The size of a shared cache is reported by the server itself.
+        '''
+        return {}
+
+
+class ResponseCache():
+    '''
+    Cache of response bodies, partitioned by user and version.
+    '''
+
+    def __init__(self, backend, ttl, primary_window=0):
+        self.backend = backend
+        self.ttl = ttl
+        self.primary_window = primary_window
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id):
+        '''
+        Current version of the cached responses of a user.
+        A missing counter, e.g. after a restart or a flush of the
+        backend, starts from the clock, so it never repeats a version
+        that older entries may still be stored under.
+        '''
+        key = f'report:{user_id}:version'
+        version = self.backend.get(key)
+        if version is None:
+            self.backend.add(key, time.time_ns())
+            version = self.backend.get(key)
+        return int(version)
+
+    def bump(self, user_id):
+        '''
+        Move a user to a new version, which drops the cached responses.
+        '''
+        if self.primary_window:
+            # marked first, so the new version is never read without it
+            self.backend.set(f'report:{user_id}:changed', b'1',
+                             self.primary_window)
+        key = f'report:{user_id}:version'
+        if self.backend.get(key) is None:
+            self.backend.add(key, time.time_ns())
+        self.backend.incr(key)
+
+    def changed_recently(self, user_id):
+        '''
+        Whether the reports of a user changed in the last primary_window
+        seconds.
+        '''
+        return (bool(self.primary_window) and
+                self.backend.get(f'report:{user_id}:changed') is not None)
+
+    def get(self, key):
+        '''
+        Return a cached body, or None, and count the hit or miss.
+        '''
+        body = self.backend.get(key)
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def set(self, key, body):
+        '''
+        Cache a body for ttl seconds.
+        '''
+        self.backend.set(key, body, self.ttl)
+
+    def stats(self):
+        '''
+        Hit and miss counts of this worker, and the size of the backend.
+        '''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                **self.backend.stats()}
+
+
+def invalidate(user_id):
+    '''
+    Drop the cached responses of a user once the current transaction
+    commits. Nothing changes if it rolls back.
+    '''
+    db_session.info.setdefault('cache_users', set()).add(user_id)
+
+
+@event.listens_for(db_session, 'after_commit')
+def _bump_versions(session):
+    user_ids = session.info.pop('cache_users', ())
+    cache = current_app.extensions.get('cache') if user_ids else None
+    if cache is not None:
+        for user_id in user_ids:
+            cache.bump(user_id)
+
+
+@event.listens_for(db_session, 'after_rollback')
+def _keep_versions(session):
+    session.info.pop('cache_users', None)
+
+
+def cached(view):
+    '''
+    Serve the JSON body of a GET view from the cache of the logged in
+    user, and cache it on a miss. Streamed responses are not cached.
+    Goes below auth_required(), which sets current_user, and above
+    replica_reads(), whose reads go to the primary after a change.
+    '''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('cache')
+        if cache is None:
+            return view(*args, **kwargs)
+        version = cache.version(current_user.id)
+        # the Accept header can choose a streamed response in List
+        key = (f'report:{current_user.id}:{version}:{request.path}?'
+               f'{urlencode(sorted(request.args.items(multi=True)))}:'
+               f'{request.headers.get("Accept", "")}')
+        body = cache.get(key)
+        if body is not None:
+            response = current_app.response_class(
+                body, mimetype='application/json')
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        if cache.changed_recently(current_user.id):
+            routing.use_primary(db_session)
+        response = view(*args, **kwargs)
+        if response.status_code == 200 and not response.is_streamed:
+            cache.set(key, response.get_data())
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+def init_app(app):
+    '''
+    Create the response cache of the app from its RESPONSE_CACHE_*
+    settings; there is none when RESPONSE_CACHE is empty.
+    '''
+    backend = app.config['RESPONSE_CACHE']
+    if not backend:
+        app.extensions['cache'] = None
+        return None
+    if backend == 'memory':
+        backend = LRUBackend(app.config['RESPONSE_CACHE_MAX_BYTES'])
+    elif backend == 'redis':
+        backend = RedisBackend.from_url(app.config['RESPONSE_CACHE_URL'])
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE {backend!r}.')
+    cache = ResponseCache(backend, app.config['RESPONSE_CACHE_TTL'],
+                          app.config['RESPONSE_CACHE_PRIMARY_WINDOW'])
+    app.extensions['cache'] = cache
+    return cache
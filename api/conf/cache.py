@@ -0,0 +1,50 @@
+'''
+This file takes care of response and hot file cache settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export RESPONSE_CACHE=memory`
+'''
+import os
+
+
+class CacheConfig():
+    '''
+    CacheConfig class that contains the cache configuration.
+    Applied to all evironments.
+    '''
+    # Cache of the report list and read responses, see api/cache.py.
+    # '' (off), 'memory' (in the worker process, for a single worker)
+    # or 'redis' (shared by every worker).
+    RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", '')
+
+    # Largest total size of the cached responses of the 'memory' cache,
+    # in bytes.
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES",
+                                                  64 * 1024 * 1024))
+
+    # Time a cached response is kept, in seconds. Changes to the reports
+    # drop it at once, this only bounds the memory of idle users.
+    RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 300))
+
+    # Time the cached responses of a user are read from the primary after
+    # a change of their reports, in seconds, so that a read replica that
+    # lags behind is not cached under the new version. Keep it above the
+    # lag of the replicas, see api/routing.py.
+    RESPONSE_CACHE_PRIMARY_WINDOW = int(os.environ.get(
+        "RESPONSE_CACHE_PRIMARY_WINDOW", 10))
+
+    # Server of the 'redis' cache.
+    RESPONSE_CACHE_URL = os.environ.get("RESPONSE_CACHE_URL",
+                                        'redis://localhost:6379/0')
+
+    # Cache of frequently downloaded files in the worker process, see
+    # api/storage/hot.py. Largest total size of the cached files, in
+    # bytes; 0 turns it off.
+    HOT_CACHE_MAX_BYTES = int(os.environ.get("HOT_CACHE_MAX_BYTES", 0))
+
+    # Largest file kept in the hot file cache, in bytes.
+    HOT_CACHE_MAX_FILE_SIZE = int(os.environ.get("HOT_CACHE_MAX_FILE_SIZE",
+                                                 8 * 1024 * 1024))
+
+    # Which file is evicted once the cache is full: 'lru' (least recently
+    # downloaded) or 'lfu' (least downloaded).
+    HOT_CACHE_POLICY = os.environ.get("HOT_CACHE_POLICY", 'lru')
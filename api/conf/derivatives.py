@@ -0,0 +1,29 @@
+'''
+This file takes care of image derivative settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export DERIVATIVE_SIZES=thumbnail:128,preview:512`
+'''
+import os
+
+
+class DerivativeConfig():
+    '''
+    DerivativeConfig class that contains the image derivative
+    configuration. Applied to all evironments.
+    '''
+    # Sizes of the resized copies of image reports, as name:edge pairs;
+    # a copy fits in a square of edge pixels.
+    # See api/storage/derivatives.py.
+    DERIVATIVE_SIZES = os.environ.get("DERIVATIVE_SIZES",
+                                      'thumbnail:128,preview:512')
+
+    # 1 makes the copies of every size when an image is uploaded,
+    # 0 on their first request.
+    DERIVATIVE_PREGENERATE = int(os.environ.get("DERIVATIVE_PREGENERATE", 0))
+
+    # Number of images resized at the same time by a worker process.
+    DERIVATIVE_MAX_CONCURRENCY = int(os.environ.get(
+        "DERIVATIVE_MAX_CONCURRENCY", 2))
+
+    # Time a request waits for a free slot before it gets 503, in seconds.
+    DERIVATIVE_WAIT = float(os.environ.get("DERIVATIVE_WAIT", 10))
@@ -0,0 +1,31 @@
+'''
+This file takes care of background job settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export JOB_WORKERS=8`
+'''
+import os
+
+
+class JobConfig():
+    '''
+    JobConfig class that contains the background job configuration.
+    Applied to all evironments.
+    '''
+    # Pool that runs the jobs, see api/jobs/queue.py.
+    # 'thread', 'process' (for CPU heavy tasks) or 'inline', which runs
+    # the jobs in the committing thread and is meant for debugging.
+    JOB_EXECUTOR = os.environ.get("JOB_EXECUTOR", 'thread')
+
+    # Number of jobs that run at the same time.
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+
+    # Number of times a job is tried before it is marked as failed.
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+    # Delay before the first retry, in seconds. Doubled for each retry.
+    JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 5))
+
+    # A job running for this many seconds is taken as abandoned by a
+    # worker that stopped, and queued again. Keep it above the longest
+    # run of a task, as the other workers of the app may be running it.
+    JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", 600))
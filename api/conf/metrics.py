@@ -0,0 +1,29 @@
+'''
+This file takes care of metrics and SQL instrumentation settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export METRICS_TOKEN=$(openssl rand -hex 32)`
+'''
+import os
+
+
+class MetricsConfig():
+    '''
+    MetricsConfig class that contains the metrics configuration.
+    Applied to all evironments.
+    '''
+    # Bearer token of GET /api/v1/metrics, see api/handlers/metrics.py.
+    # The endpoint answers 404 while it is empty.
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", '')
+
+    # Server-Timing header of the SQL statements of each response, see
+    # api/queries.py. 'auto' (on outside of production), '1' or '0'.
+    QUERY_SERVER_TIMING = os.environ.get("QUERY_SERVER_TIMING", 'auto')
+
+    # Requests that run more statements, or spend more milliseconds in
+    # them, are logged as warnings; 0 turns a limit off.
+    QUERY_BUDGET = int(os.environ.get("QUERY_BUDGET", 20))
+    QUERY_BUDGET_MS = int(os.environ.get("QUERY_BUDGET_MS", 200))
+
+    # A SELECT of the same shape that runs this many times in a request
+    # is logged as a warning (N+1); 0 turns it off.
+    QUERY_REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", 5))
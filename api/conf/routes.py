@@ -9,12 +9,24 @@ from api.handlers.auth import (Index,
                                Logout,
                                DeleteUser)
 from api.handlers.report import (List,
+                                 Search,
                                  Upload,
+                                 BulkUpload,
+                                 CreateUpload,
+                                 ResumeUpload,
+                                 FinishUpload,
                                  Read,
                                  UpdateData,
                                  UpdateFile,
+                                 BulkUpdate,
                                  Download,
-                                 Delete)
+                                 Derivative,
+                                 Archive,
+                                 Delete,
+                                 BulkDelete,
+                                 JobStatus,
+                                 Usage)
+from api.handlers.metrics import Metrics
 
 
 def generate_routes(app):
@@ -35,9 +47,25 @@ def generate_routes(app):
 
     # report microservice
     api.add_resource(List, '/api/v1/report/list')
+    api.add_resource(Search, '/api/v1/report/search')
     api.add_resource(Upload, '/api/v1/report/upload')
+    api.add_resource(BulkUpload, '/api/v1/report/bulk_upload')
+    api.add_resource(CreateUpload, '/api/v1/report/uploads')
+    api.add_resource(ResumeUpload, '/api/v1/report/uploads/<upload_id>')
+    api.add_resource(FinishUpload,
+                     '/api/v1/report/uploads/<upload_id>/finalize')
     api.add_resource(Read, '/api/v1/report/read/<int:report_id>')
     api.add_resource(UpdateData, '/api/v1/report/update_data/<int:report_id>')
     api.add_resource(UpdateFile, '/api/v1/report/update_file/<int:report_id>')
+    api.add_resource(BulkUpdate, '/api/v1/report/bulk_update')
     api.add_resource(Download, '/api/v1/report/download/<int:report_id>')
+    api.add_resource(Derivative,
+                     '/api/v1/report/derivative/<int:report_id>/<size>')
+    api.add_resource(Archive, '/api/v1/report/archive')
     api.add_resource(Delete, '/api/v1/report/delete/<int:report_id>')
+    api.add_resource(BulkDelete, '/api/v1/report/bulk_delete')
+    api.add_resource(JobStatus, '/api/v1/report/jobs/<int:job_id>')
+    api.add_resource(Usage, '/api/v1/report/usage')
+
+    # operations
+    api.add_resource(Metrics, '/api/v1/metrics')
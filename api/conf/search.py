@@ -0,0 +1,17 @@
+'''
+This file takes care of search settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export SEARCH_BACKEND=inverted`
+'''
+import os
+
+
+class SearchConfig():
+    '''
+    SearchConfig class that contains the search index configuration.
+    Applied to all evironments.
+    '''
+    # Index behind /api/v1/report/search, see api/search.py.
+    # 'fulltext' (MySQL FULLTEXT indexes), 'inverted' (a posting table
+    # that works on any database) or 'auto' to pick fulltext on MySQL.
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", 'auto')
@@ -0,0 +1,90 @@
+'''
+This file takes care of file storage settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export UPLOAD_MAX_SIZE=104857600`
+'''
+import os
+from pathlib import Path
+
+
+class StorageConfig():
+    '''
+    StorageConfig class that contains the file storage configuration.
+    Applied to all evironments.
+    '''
+    # Directory that the uploaded report files are written to.
+    UPLOAD_FOLDER = os.environ.get(
+        "UPLOAD_FOLDER",
+        os.path.abspath(
+            os.path.join(
+                Path(__file__).parent.parent.parent,
+                'static',
+                'uploads')))
+
+    # Where the report files are kept: 'local' (UPLOAD_FOLDER), 's3' or
+    # 'memory' (tests only), see api/storage/backends.py.
+    # UPLOAD_FOLDER still receives the uploads in progress with any backend.
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", 'local')
+
+    # Bucket and key prefix of the 's3' backend.
+    S3_BUCKET = os.environ.get("S3_BUCKET", '')
+    S3_PREFIX = os.environ.get("S3_PREFIX", '')
+
+    # Endpoint of an S3-compatible server, e.g. http://127.0.0.1:9000 for
+    # MinIO, and its region; '' for the defaults of AWS.
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", '')
+    S3_REGION = os.environ.get("S3_REGION", '')
+
+    # HTTP connections kept open to S3, shared by every thread of a worker.
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS",
+                                                 32))
+
+    # Files over this size are uploaded to S3 in parts of
+    # S3_MULTIPART_CHUNK_SIZE bytes, S3_MAX_CONCURRENCY parts at a time.
+    S3_MULTIPART_THRESHOLD = int(os.environ.get("S3_MULTIPART_THRESHOLD",
+                                                16 * 1024 * 1024))
+    S3_MULTIPART_CHUNK_SIZE = int(os.environ.get("S3_MULTIPART_CHUNK_SIZE",
+                                                 16 * 1024 * 1024))
+    S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", 4))
+
+    # Largest report file accepted, in bytes.
+    # The upload is aborted with 413 as soon as this many bytes are read.
+    UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE",
+                                         256 * 1024 * 1024))
+
+    # Size of the blocks that files are copied and read in, in bytes.
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 64 * 1024))
+
+    # Time a resumable upload may stay idle before it is removed,
+    # in seconds, see api/storage/resumable.py.
+    UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL",
+                                            24 * 60 * 60))
+
+    # Files of UPLOAD_FOLDER that no report uses are only removed by
+    # `flask gc-files` once unmodified for this long, in seconds, so
+    # uploads in progress are kept, see api/storage/gc.py.
+    GC_GRACE_PERIOD = float(os.environ.get("GC_GRACE_PERIOD", 60 * 60))
+
+    # Number of directories `flask gc-files` walks in parallel.
+    GC_WORKERS = int(os.environ.get("GC_WORKERS", 4))
+
+    # Compress report files at rest: '' (off), 'gzip' or 'zstd'.
+    # Images are always stored as is, see api/storage/codec.py.
+    STORAGE_CODEC = os.environ.get("STORAGE_CODEC", '')
+
+    # Cache-Control policy of downloads whose report does not set one.
+    # One of 'private', 'public' or 'no-store', see api/storage/serve.py.
+    DOWNLOAD_CACHE_POLICY = os.environ.get("DOWNLOAD_CACHE_POLICY",
+                                           'private')
+
+    # max-age of the 'public' policy, in seconds.
+    DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", 24 * 60 * 60))
+
+    # Let the front web server send download bodies instead of the worker.
+    # '' (send from Python), 'x-sendfile' (Apache, lighttpd)
+    # or 'x-accel-redirect' (nginx), see api/storage/serve.py.
+    DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", '')
+
+    # nginx internal location that maps to UPLOAD_FOLDER.
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX",
+                                           '/protected-uploads/')
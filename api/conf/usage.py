@@ -0,0 +1,22 @@
+'''
+This file takes care of storage usage settings.
+Every value can be overridden by an env variable of the same name,
+e.g. `export USAGE_MAX_BYTES=10737418240`
+'''
+import os
+
+
+class UsageConfig():
+    '''
+    UsageConfig class that contains the storage quota configuration.
+    Applied to all evironments.
+    '''
+    # Largest number of reports a user can have, 0 for no limit.
+    # See api/usage.py.
+    USAGE_MAX_REPORTS = int(os.environ.get("USAGE_MAX_REPORTS", 0))
+
+    # Largest total size of the files of a user, in bytes, 0 for no limit.
+    USAGE_MAX_BYTES = int(os.environ.get("USAGE_MAX_BYTES", 0))
+
+    # Number of parallel workers of `flask rebuild-usage`.
+    USAGE_REBUILD_WORKERS = int(os.environ.get("USAGE_REBUILD_WORKERS", 4))
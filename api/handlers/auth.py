@@ -4,7 +4,7 @@ Auth microservice is responsible for user authentication such as
 register user, login, logout, change password, and delete user.
 '''
 import uuid
-from flask import request
+from flask import request, current_app
 from flask_restful import Resource
 from flask_security import verify_password, hash_password, \
                            SQLAlchemySessionUserDatastore, \
@@ -13,8 +13,13 @@ from flask_security import verify_password, hash_password, \
 from flask_security.utils import login_user, current_user
 from flask_security.core import UserMixin
 from api.conf.database import db_session
-from api.models import User, Role
-from api.utils import render_json, is_password_safe
+from api.models import User, Role, Report
+from api.utils import render_json, is_password_safe, iter_batches
+from api.cache import invalidate
+from api.storage import blobstore
+
+# Number of reports removed per statement when a user is deleted.
+DELETE_BATCH = 1000
 
 user_datastore = SQLAlchemySessionUserDatastore(db_session, User, Role)
 
@@ -275,6 +280,18 @@ class DeleteUser(Resource):
         This method is used for user deletion.
         '''
         user = current_user
+        # the reports go with the user, and their files once unused
+        reports = (db_session.query(Report.id, Report.blob_sha256).
+                   filter(Report.user_id == user.id).
+                   all())
+        for batch in iter_batches(reports, DELETE_BATCH):
+            batch = [report.id for report in batch]
+            current_app.extensions['search'].remove(db_session, batch)
+            (db_session.query(Report).
+             filter(Report.id.in_(batch)).
+             delete(synchronize_session=False))
+        blobstore.release_many(report.blob_sha256 for report in reports)
+        invalidate(user.id)
         db_session.delete(user)
         db_session.commit()
         return render_json({'message': 'User deleted.'}, 200)
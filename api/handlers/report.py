@@ -3,27 +3,84 @@ This file represents the report microservice.
 Report microservice is responsible for report management, including
     - Listing all reports
     - Uploading a report
+    - Uploading many reports at once
+    - Uploading a large report in chunks, resumably
     - Reading a report
     - Downloading a report
+    - Downloading many reports as one archive
+    - Downloading resized copies of image reports
+    - Updating and deleting many reports at once
+    - Polling the background jobs of a report
+    - Searching reports
+    - Reading the storage usage of the logged in user
 '''
 import os
-from pathlib import Path
-from flask import request, send_from_directory
+import mimetypes
+import secrets
+from datetime import datetime
+from flask import request, send_from_directory, current_app
 from werkzeug.utils import secure_filename
+from werkzeug.http import parse_content_range_header
+from werkzeug.datastructures import FileStorage
+from werkzeug.wrappers import Response
+from werkzeug.exceptions import RequestEntityTooLarge, Conflict
 from flask_restful import Resource
 from flask_security import auth_required, current_user
-from api.utils import render_json
-from api.models import Report, ReportSchema
+from api.utils import (render_json,
+                       render_json_stream,
+                       render_ndjson_stream,
+                       encode_cursor,
+                       decode_cursor,
+                       iter_batches)
+from api.models import Report, Blob, Job, JobSchema, UploadSession
+from api.serializers import report_serializer
 from api.conf.database import db_session
+from api.routing import replica_reads
+from api import routing
+from api.storage import blobstore, resumable, derivatives
+from api.storage.stream import upload_stream
+from api.storage.serve import send_stored_file, CACHE_POLICIES
+from api.storage.archive import iter_archive
+from api.storage.backends import LocalStorage
+from api.jobs.queue import enqueue
+from api.cache import cached, invalidate
+from api import usage
+from api.usage import QuotaExceeded
 
-# Upload Folder
-UPLOAD_FOLDER = os.path.abspath(
-                    os.path.join(
-                        Path(__file__).parent.parent.parent,
-                        'static',
-                        'uploads'))
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
 
+# Background tasks run on every uploaded file, see api/jobs/tasks.py.
+UPLOAD_TASKS = ('inspect_file', 'extract_text')
+
+# Page size of the report list, and the largest one a client can ask for.
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+# Number of reports fetched and written at a time by streamed listings.
+LIST_STREAM_BATCH = 500
+# Largest number of files accepted by one bulk upload.
+BULK_MAX_FILES = 1000
+# Largest number of ids accepted by one bulk update or delete.
+BULK_MAX_IDS = 1000
+# Filters that select the reports of a bulk update or delete.
+BULK_FILTERS = {
+    'created_before':
+        lambda value: Report.created_at < datetime.fromisoformat(value),
+    'created_after':
+        lambda value: Report.created_at > datetime.fromisoformat(value),
+    'updated_before':
+        lambda value: Report.updated_at < datetime.fromisoformat(value),
+    'updated_after':
+        lambda value: Report.updated_at > datetime.fromisoformat(value),
+    'file_name': lambda value: Report.file_name == str(value),
+    'cache_policy': lambda value: Report.cache_policy == str(value),
+}
+# Page size of search results, and the largest one a client can ask for.
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Fields that can be selected with fields=.
+LIST_FIELDS = ('id', 'name', 'description', 'file_name', 'url', 'user',
+               'blob', 'cache_policy', 'size', 'created_at', 'updated_at')
+
 
 def allowed_file(filename):
     '''
@@ -33,6 +90,107 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def bulk_selection(body):
+    '''
+    Parse the reports selected by a bulk request, either
+        ids: list of report ids
+    or
+        filter: object of BULK_FILTERS, e.g. {"created_before": "2022-01-01"}
+    and return the requested ids (None for a filter) and the criteria.
+    Raises ValueError on invalid input.
+    '''
+    ids, filters = body.get('ids'), body.get('filter')
+    if (ids is None) == (filters is None):
+        raise ValueError('Either ids or filter is required.')
+    if ids is not None:
+        if (not isinstance(ids, list) or not 0 < len(ids) <= BULK_MAX_IDS
+                or not all(isinstance(report_id, int) and
+                           not isinstance(report_id, bool)
+                           for report_id in ids)):
+            raise ValueError('Invalid ids.')
+        return ids, [Report.id.in_(ids)]
+    if (not isinstance(filters, dict) or not filters
+            or not set(filters) <= set(BULK_FILTERS)):
+        raise ValueError('Invalid filter.')
+    try:
+        return None, [BULK_FILTERS[key](value)
+                      for key, value in filters.items()]
+    except TypeError as error:
+        raise ValueError('Invalid filter.') from error
+
+
+def archive_name(name, file_name, used):
+    '''
+    Name of a report's file in an archive: the report name with the
+    extension of the file. Only the last path component of the name is
+    kept, so that extracting the archive never writes outside of its
+    folder, and a name already in used (lower case, updated) gets a
+    number, e.g. 'a (2).txt'.
+    '''
+    name = name.replace('\\', '/').rstrip('/').rsplit('/', 1)[-1].strip()
+    if name in ('', '.', '..'):
+        name = 'report'
+    extension = os.path.splitext(file_name)[1]
+    if extension and name.lower().endswith(extension.lower()):
+        name = name[:-len(extension)]
+    candidate, number = name + extension, 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = f'{name} ({number}){extension}'
+    used.add(candidate.lower())
+    return candidate
+
+
+def bulk_results(ids, found, status):
+    '''
+    Per-id outcomes of a bulk request, in the order of the request.
+    '''
+    found = set(found)
+    return [{'id': report_id, 'status': status} if report_id in found else
+            {'id': report_id, 'error': 'Report not found or invalid.'}
+            for report_id in (sorted(found) if ids is None else ids)]
+
+
+def enqueue_upload_tasks(report, blob):
+    '''
+    Queue the UPLOAD_TASKS of a report's file and return the job ids.
+    blob holds the encoding and mime_type of the report's blob.
+    The report must have been flushed; the jobs start, and the
+    derivatives of an image are made, once the session commits.
+    '''
+    name = blobstore.blob_name(report.blob_sha256)
+    derivatives.pregenerate(name, blob.encoding, blob.mime_type)
+    return [enqueue(task, report.user_id, report_id=report.id,
+                    name=name,
+                    file_name=report.file_name,
+                    encoding=blob.encoding).id
+            for task in UPLOAD_TASKS]
+
+
+def add_report(name, description, filename, upload):
+    '''
+    Add a report of the logged in user for a finished UploadStream to the
+    session: count it in the user's usage, store the file, index the
+    report and queue its UPLOAD_TASKS. Returns the job ids; the caller
+    commits. Raises QuotaExceeded before anything is stored.
+    '''
+    usage.charge(current_user.id, 1, upload.size)
+    sha256 = blobstore.acquire(upload)
+    report = Report(name=name,
+                    description=description,
+                    url=blobstore.blob_path(sha256),
+                    user_id=current_user.id,
+                    file_name=filename,
+                    blob_sha256=sha256,
+                    size=upload.size
+                    )
+    db_session.add(report)
+    db_session.flush()
+    current_app.extensions['search'].index_fields(db_session, [report])
+    invalidate(current_user.id)
+    return enqueue_upload_tasks(report, db_session.get(Blob, sha256))
+
+
 class List(Resource):
     '''
     This class represents the list of all reports of logged in user.
@@ -40,15 +198,29 @@ class List(Resource):
 
     method: GET
     url: /api/v1/report/list
+    optional query parameters:
+        limit: page size, 100 by default and 1000 at most
+        cursor: meta.next of the previous page
+        fields: comma separated fields to return, e.g. fields=id,name
+        stream: json or ndjson, to stream every report at once instead
+                of a page. Also chosen by Accept: application/x-ndjson
 
     example httpie request:
         http GET http://127.0.0.1:5000/api/v1/report/list \
-             Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            limit==50 fields==id,name,file_name
+
+    example httpie request for an export:
+        http --stream GET http://127.0.0.1:5000/api/v1/report/list \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            Accept:application/x-ndjson
 
     response:
+        meta.next is the cursor of the next page, or null on the last page.
         {
             "meta": {
-                "code": 200
+                "code": 200,
+                "next": "eyJpZCI6NTB9.Wq1vEu2iJ6aZ..."
             },
             "response": [
                 {
@@ -59,6 +231,8 @@ class List(Resource):
                     "name": "This is report name",
                     "updated_at": "2022-02-23T02:10:56",
                     "url": "/path/to/file/example.pdf",
+                    "blob": "9f86d081884c7d659a2feaa0c55ad015...",
+                    "cache_policy": "private",
                     "user": 1
                 }
             ]
@@ -66,16 +240,139 @@ class List(Resource):
     '''
     @staticmethod
     @auth_required()
+    @cached
+    @replica_reads(db_session)
     def get():
         '''
         This method is used for listing all reports of logged in user.
         '''
-        # Get the user's reports
-        reports = Report.query.filter_by(user_id=current_user.id).all()
+        try:
+            limit = min(int(request.args.get('limit', LIST_DEFAULT_LIMIT)),
+                        LIST_MAX_LIMIT)
+            after = 0
+            if request.args.get('cursor'):
+                after = int(decode_cursor(request.args['cursor']))
+            fields = LIST_FIELDS
+            if request.args.get('fields'):
+                fields = request.args['fields'].split(',')
+        except ValueError:
+            return render_json({'error': 'Invalid input.'}, 422)
+        if limit < 1 or not set(fields) <= set(LIST_FIELDS):
+            return render_json({'error': 'Invalid input.'}, 422)
+
+        serialize = report_serializer(tuple(fields))
+        # Only the requested columns are selected, as plain rows.
+        columns = [getattr(Report, attribute)
+                   for attribute in ('id',) + serialize.attributes]
+        query = (db_session.query(*columns).
+                 filter(Report.user_id == current_user.id,
+                        Report.id > after).
+                 order_by(Report.id))
+
+        stream = request.args.get('stream')
+        accept = request.accept_mimetypes.best_match(
+            ['application/json', 'application/x-ndjson'])
+        if stream is None and accept == 'application/x-ndjson':
+            stream = 'ndjson'
+        if stream in ('json', 'ndjson'):
+            # Every report, fetched through a server-side cursor and
+            # written out batch by batch.
+            rows = (serialize(report) for report in
+                    query.yield_per(LIST_STREAM_BATCH))
+            if stream == 'ndjson':
+                return render_ndjson_stream(rows, 200, LIST_STREAM_BATCH)
+            return render_json_stream(rows, 200, LIST_STREAM_BATCH)
+        if stream is not None:
+            return render_json({'error': 'Invalid input.'}, 422)
+
+        # Get one page of the user's reports, keyset on (user_id, id).
+        reports = query.limit(limit + 1).all()
+        cursor = None
+        if len(reports) > limit:
+            reports = reports[:limit]
+            cursor = encode_cursor(reports[-1].id)
         # Serialize the reports
-        report_schema = ReportSchema(many=True)
-        payload = report_schema.dump(reports)
-        return render_json(payload, 200)
+        payload = [serialize(report) for report in reports]
+        return render_json(payload, 200, next=cursor)
+
+
+class Search(Resource):
+    '''
+    This class represents the full-text search of the reports of logged
+    in user, by the words of their name, description and file text.
+    auth_token is necessary.
+
+    method: GET
+    url: /api/v1/report/search
+    required query parameters:
+        q: words to search for; reports that contain any of them match
+    optional query parameters:
+        limit: page size, 20 by default and 100 at most
+        cursor: meta.next of the previous page
+
+    The text of a file is searchable once its extract_text job is done.
+
+    example httpie request:
+        http GET http://127.0.0.1:5000/api/v1/report/search \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            q=='quarterly revenue'
+
+    response:
+        Hits are ordered by relevance, best first.
+        {
+            "meta": {
+                "code": 200,
+                "next": null
+            },
+            "response": [
+                {
+                    "score": 4.8283,
+                    "created_at": "2022-02-23T02:10:56",
+                    "description": "This is description",
+                    "file_name": "example.pdf",
+                    "id": 1,
+                    "name": "quarterly_revenue",
+                    "updated_at": "2022-02-23T02:10:56",
+                    "url": "/path/to/file/example.pdf",
+                    "blob": "9f86d081884c7d659a2feaa0c55ad015...",
+                    "cache_policy": null,
+                    "user": 1
+                }
+            ]
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def get():
+        '''
+        This method is used for searching the reports of logged in user.
+        '''
+        try:
+            query = request.args['q']
+            limit = min(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)),
+                        SEARCH_MAX_LIMIT)
+            offset = 0
+            if request.args.get('cursor'):
+                offset = int(decode_cursor(request.args['cursor']))
+        except (KeyError, ValueError):
+            return render_json({'error': 'Invalid input.'}, 422)
+        if limit < 1 or offset < 0 or not query.strip():
+            return render_json({'error': 'Invalid input.'}, 422)
+
+        hits = current_app.extensions['search'].search(
+            db_session, current_user.id, query, offset, limit + 1)
+        cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            cursor = encode_cursor(offset + limit)
+        reports = {report.id: report for report in
+                   Report.query.filter(Report.id.in_(
+                       [report_id for report_id, _ in hits]))}
+        serialize = report_serializer()
+        payload = [dict(serialize(reports[report_id]),
+                        score=round(float(score), 4))
+                   for report_id, score in hits if report_id in reports]
+        return render_json(payload, 200, next=cursor)
 
 
 class Upload(Resource):
@@ -105,6 +402,10 @@ class Upload(Resource):
             "response": {
                 "message": "Report uploaded successfully",
                 "filename": "example.pdf",
+                "size": 1024,
+                "sha256": "9f86d081884c7d659a2feaa0c55ad015...",
+                "mime_type": "application/pdf",
+                "jobs": [1, 2],
                 "reportname": "This is report name",
                 "user": example@example.com
             }
@@ -122,6 +423,8 @@ class Upload(Resource):
                     request.form['description'].strip(),
                     request.files['file'],
             )
+        except RequestEntityTooLarge:
+            return render_json({'error': 'File too large.'}, 413)
         except (KeyError, ValueError, AttributeError):
             return render_json({'error': 'Invalid input.'}, 422)
         if name is None or description is None or file is None:
@@ -131,27 +434,489 @@ class Upload(Resource):
             filename = secure_filename(file.filename)
             name = secure_filename(name)
             description = secure_filename(description)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            report = Report(name=name,
-                            description=description,
-                            url=file_path,
-                            user_id=current_user.id,
-                            file_name=filename
-                            )
-            db_session.add(report)
+            upload = upload_stream(file)
+            try:
+                jobs = add_report(name, description, filename, upload)
+            except QuotaExceeded:
+                db_session.rollback()
+                return render_json({'error': 'Storage quota exceeded.'}, 403)
             db_session.commit()
-            file.save(os.path.join(UPLOAD_FOLDER, filename))
             payload = {
                         "message": "Upload successful.",
                         "filename": filename,
                         "reportname": name,
                         "description": description,
+                        "size": upload.size,
+                        "sha256": upload.sha256,
+                        "mime_type": upload.mime_type,
+                        "jobs": jobs,
                         "user": current_user.email
                         }
             return render_json(payload, 200)
         return render_json({"error": "Invalid file."}, 422)
 
 
+class BulkUpload(Resource):
+    '''
+    This class represents the upload of many reports in one request.
+    auth_token is necessary.
+
+    method: POST
+    url: /api/v1/report/bulk_upload
+    required input parameters, repeated once per report and matched
+    by position:
+        name: report name
+        description: report description
+        file: report file
+
+    Every file is validated and stored, then all the valid reports are
+    inserted with one INSERT and one commit. Invalid items are reported
+    in the results and do not stop the others.
+
+    example httpie request:
+        http -f POST http://127.0.0.1:5000/api/v1/report/bulk_upload \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            name='First report' description='First description' \
+            file@./first.pdf \
+            name='Second report' description='Second description' \
+            file@./second.png
+
+    response:
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "message": "Upload successful.",
+                "uploaded": 1,
+                "failed": 1,
+                "results": [
+                    {
+                        "index": 0,
+                        "id": 1,
+                        "filename": "first.pdf",
+                        "reportname": "First_report",
+                        "size": 1024,
+                        "sha256": "9f86d081884c7d659a2feaa0c55ad015...",
+                        "mime_type": "application/pdf",
+                        "jobs": [1, 2]
+                    },
+                    {
+                        "index": 1,
+                        "filename": "second.exe",
+                        "error": "Invalid file."
+                    }
+                ]
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def post():
+        '''
+        This method is used for uploading many reports.
+        '''
+        try:
+            names, descriptions, files = (
+                request.form.getlist('name'),
+                request.form.getlist('description'),
+                request.files.getlist('file'),
+            )
+        except RequestEntityTooLarge:
+            return render_json({'error': 'File too large.'}, 413)
+        if (not files or len(files) > BULK_MAX_FILES or
+                not len(names) == len(descriptions) == len(files)):
+            return render_json({'error': 'Invalid input.'}, 422)
+
+        names = [secure_filename(name.strip()) for name in names]
+        taken = {name for (name,) in
+                 db_session.query(Report.name).
+                 filter(Report.name.in_(names))}
+        results, items = [], []
+        for index, (name, description, file) in enumerate(
+                zip(names, descriptions, files)):
+            description = secure_filename(description.strip())
+            result = {'index': index, 'filename': file.filename}
+            if not file or not allowed_file(file.filename):
+                result['error'] = 'Invalid file.'
+            elif not name or not description:
+                result['error'] = 'Invalid input.'
+            elif name in taken:
+                result['error'] = 'Already exists.'
+            else:
+                taken.add(name)
+                result['filename'] = secure_filename(file.filename)
+                result['reportname'] = name
+                items.append((result, description, upload_stream(file)))
+            results.append(result)
+
+        # as many reports as the quota allows, in order
+        report_count, used = usage.usage(current_user.id)
+        accepted = []
+        for result, description, upload in items:
+            if usage.within_quota(report_count + 1, used + upload.size):
+                report_count, used = report_count + 1, used + upload.size
+                accepted.append((result, description, upload))
+            else:
+                del result['reportname']
+                result['error'] = 'Storage quota exceeded.'
+        items = accepted
+        try:
+            usage.charge(current_user.id, len(items),
+                         sum(upload.size for _, _, upload in items))
+        except QuotaExceeded:
+            # another upload of the user took the room meanwhile
+            db_session.rollback()
+            return render_json({'error': 'Storage quota exceeded.'}, 403)
+        uploads = [upload for _, _, upload in items]
+        rows = []
+        for (result, description, upload), sha256 in zip(
+                items, blobstore.acquire_many(uploads)):
+            result.update(size=upload.size,
+                          sha256=sha256,
+                          mime_type=upload.mime_type)
+            rows.append({'name': result['reportname'],
+                         'description': description,
+                         'url': blobstore.blob_path(sha256),
+                         'user_id': current_user.id,
+                         'file_name': result['filename'],
+                         'blob_sha256': sha256,
+                         'size': upload.size})
+        if rows:
+            db_session.bulk_insert_mappings(Report, rows)
+            reports = (db_session.query(Report.id,
+                                        Report.user_id,
+                                        Report.name,
+                                        Report.description,
+                                        Report.file_name,
+                                        Report.blob_sha256).
+                       filter(Report.name.in_([row['name'] for row in rows])).
+                       all())
+            current_app.extensions['search'].index_fields(db_session,
+                                                          reports)
+            blobs = {blob.sha256: blob for blob in
+                     db_session.query(Blob.sha256,
+                                      Blob.encoding,
+                                      Blob.mime_type).
+                     filter(Blob.sha256.in_(
+                         {row['blob_sha256'] for row in rows}))}
+            reports = {report.name: report for report in reports}
+            for result, _, _ in items:
+                report = reports[result['reportname']]
+                result['id'] = report.id
+                result['jobs'] = enqueue_upload_tasks(
+                    report, blobs[report.blob_sha256])
+            invalidate(current_user.id)
+        db_session.commit()
+        payload = {
+                    "message": "Upload successful.",
+                    "uploaded": len(items),
+                    "failed": len(results) - len(items),
+                    "results": results
+                    }
+        return render_json(payload, 200)
+
+
+def upload_session(upload_id):
+    '''
+    Return the unexpired UploadSession of the logged in user, or None.
+    '''
+    return (UploadSession.query.
+            filter(UploadSession.id == upload_id,
+                   UploadSession.user_id == current_user.id,
+                   UploadSession.expires_at >= datetime.now()).
+            first())
+
+
+def upload_offset():
+    '''
+    Offset of the chunk in the request, from Upload-Offset or from the
+    start of Content-Range. Raises ValueError if there is none.
+    '''
+    content_range = parse_content_range_header(
+        request.headers.get('Content-Range'))
+    if 'Upload-Offset' in request.headers:
+        offset = int(request.headers['Upload-Offset'])
+    elif content_range is not None and content_range.start is not None:
+        offset = content_range.start
+    else:
+        raise ValueError('Missing offset.')
+    if offset < 0:
+        raise ValueError('Invalid offset.')
+    return offset
+
+
+class CreateUpload(Resource):
+    '''
+    This class represents the start of a resumable upload, for files too
+    large to send in one request; see api/storage/resumable.py.
+    auth_token is necessary.
+
+    method: POST
+    url: /api/v1/report/uploads
+    required input parameters (json):
+        name: report name
+        description: report description
+        file_name: name of the file
+        length: size of the file in bytes
+
+    example httpie request:
+        http POST http://127.0.0.1:5000/api/v1/report/uploads \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            name='This is report name' \
+            description='This is report description' \
+            file_name=example.pdf length:=1073741824
+
+    response:
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "upload_id": "3f1c2a9b8e7d4c6f5a4b3c2d1e0f9a8b",
+                "offset": 0,
+                "length": 1073741824,
+                "expires_at": "2022-02-24T02:10:56"
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def post():
+        '''
+        This method is used for starting a resumable upload.
+        '''
+        body = request.get_json(silent=True)
+        try:
+            name, description, file_name, length = (
+                body['name'].strip(),
+                body['description'].strip(),
+                body['file_name'],
+                body['length'],
+            )
+        except (KeyError, TypeError, AttributeError):
+            return render_json({'error': 'Invalid input.'}, 422)
+        if (not isinstance(length, int) or isinstance(length, bool) or
+                length < 0 or not name or not description):
+            return render_json({'error': 'Invalid input.'}, 422)
+        if not isinstance(file_name, str) or not allowed_file(file_name):
+            return render_json({'error': 'Invalid file.'}, 422)
+        if length > current_app.config['UPLOAD_MAX_SIZE']:
+            return render_json({'error': 'File too large.'}, 413)
+        report_count, used = usage.usage(current_user.id)
+        if not usage.within_quota(report_count + 1, used + length):
+            return render_json({'error': 'Storage quota exceeded.'}, 403)
+        name = secure_filename(name)
+        if Report.query.filter_by(name=name).first() is not None:
+            return render_json({'error': 'Already exists.'}, 409)
+
+        resumable.collect_expired()
+        session = UploadSession(id=secrets.token_hex(16),
+                                user_id=current_user.id,
+                                name=name,
+                                description=secure_filename(description),
+                                file_name=secure_filename(file_name),
+                                length=length,
+                                expires_at=resumable.expiry())
+        db_session.add(session)
+        db_session.flush()
+        resumable.create_partial(session.id)
+        db_session.commit()
+        payload = {
+                    "upload_id": session.id,
+                    "offset": 0,
+                    "length": session.length,
+                    "expires_at": session.expires_at.isoformat()
+                    }
+        return render_json(payload, 200)
+
+
+class ResumeUpload(Resource):
+    '''
+    This class represents a resumable upload in progress.
+    auth_token is necessary.
+
+    method: HEAD
+    url: /api/v1/report/uploads/<upload_id>
+    The Upload-Offset header of the response is the number of bytes
+    received so far; the next chunk starts there.
+
+    method: PATCH (or PUT)
+    url: /api/v1/report/uploads/<upload_id>
+    required headers:
+        Upload-Offset: offset of the chunk, or
+        Content-Range: bytes <first>-<last>/<length>
+    The body is the chunk; any size, as long as the file does not grow
+    past the declared length. A chunk cut short still counts for the
+    bytes that arrived. Returns 409 if the offset is not the number of
+    bytes received so far.
+
+    method: DELETE
+    url: /api/v1/report/uploads/<upload_id>
+    Aborts the upload.
+
+    example httpie request:
+        http PATCH http://127.0.0.1:5000/api/v1/report/uploads/3f1c... \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            Upload-Offset:0 < ./chunk-0
+
+    response:
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "upload_id": "3f1c2a9b8e7d4c6f5a4b3c2d1e0f9a8b",
+                "offset": 8388608,
+                "length": 1073741824,
+                "expires_at": "2022-02-24T02:10:56"
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def head(upload_id):
+        '''
+        This method is used for asking where to resume an upload.
+        '''
+        session = upload_session(upload_id)
+        if session is None:
+            response = render_json({'error': 'Upload not found or invalid.'},
+                                   404)
+            # a HEAD response has no body to carry the code
+            response.status_code = 404
+            return response
+        response = render_json({}, 200)
+        response.headers['Upload-Offset'] = str(
+            resumable.committed_offset(session.id))
+        response.headers['Upload-Length'] = str(session.length)
+        response.headers['Upload-Expires'] = session.expires_at.isoformat()
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @staticmethod
+    @auth_required()
+    def patch(upload_id):
+        '''
+        This method is used for sending a chunk of an upload.
+        '''
+        session = upload_session(upload_id)
+        if session is None:
+            return render_json({'error': 'Upload not found or invalid.'},
+                               404)
+        try:
+            offset = upload_offset()
+        except ValueError:
+            return render_json({'error': 'Invalid input.'}, 422)
+        try:
+            offset = resumable.append(session.id, offset, request.stream,
+                                      session.length)
+        except Conflict as error:
+            return render_json({'error': error.description}, 409)
+        except RequestEntityTooLarge:
+            return render_json({'error': 'File too large.'}, 413)
+        session.expires_at = resumable.expiry()
+        db_session.commit()
+        payload = {
+                    "upload_id": session.id,
+                    "offset": offset,
+                    "length": session.length,
+                    "expires_at": session.expires_at.isoformat()
+                    }
+        response = render_json(payload, 200)
+        response.headers['Upload-Offset'] = str(offset)
+        return response
+
+    put = patch
+
+    @staticmethod
+    @auth_required()
+    def delete(upload_id):
+        '''
+        This method is used for aborting an upload.
+        '''
+        deleted = (db_session.query(UploadSession).
+                   filter_by(id=upload_id, user_id=current_user.id).
+                   delete(synchronize_session=False))
+        if not deleted:
+            return render_json({'error': 'Upload not found or invalid.'},
+                               404)
+        blobstore.unlink_after_commit(resumable.partial_path(upload_id))
+        db_session.commit()
+        return render_json({'message': 'Upload aborted.'}, 200)
+
+
+class FinishUpload(Resource):
+    '''
+    This class represents the end of a resumable upload, which turns the
+    complete file into a report.
+    auth_token is necessary.
+
+    method: POST
+    url: /api/v1/report/uploads/<upload_id>/finalize
+
+    example httpie request:
+        http POST \
+            http://127.0.0.1:5000/api/v1/report/uploads/3f1c.../finalize \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE
+
+    response:
+        Same as the upload of a report.
+    '''
+    @staticmethod
+    @auth_required()
+    def post(upload_id):
+        '''
+        This method is used for finishing a resumable upload.
+        '''
+        session = upload_session(upload_id)
+        if session is None:
+            return render_json({'error': 'Upload not found or invalid.'},
+                               404)
+        if resumable.committed_offset(session.id) != session.length:
+            return render_json({'error': 'Upload incomplete.'}, 409)
+        if Report.query.filter_by(name=session.name).first() is not None:
+            return render_json({'error': 'Already exists.'}, 409)
+        # deleting the row claims the session, so two finalize requests
+        # never make two reports
+        claimed = (db_session.query(UploadSession).
+                   filter_by(id=session.id).
+                   delete(synchronize_session=False))
+        if not claimed:
+            return render_json({'error': 'Upload not found or invalid.'},
+                               404)
+        name, description, filename = (session.name,
+                                       session.description,
+                                       session.file_name)
+        path = resumable.partial_path(session.id)
+        with open(path, 'rb') as partial:
+            upload = upload_stream(FileStorage(stream=partial,
+                                               filename=filename))
+        try:
+            jobs = add_report(name, description, filename, upload)
+        except QuotaExceeded:
+            # the session is claimed again, the client can delete reports
+            # and retry
+            db_session.rollback()
+            return render_json({'error': 'Storage quota exceeded.'}, 403)
+        finally:
+            upload.close()
+        blobstore.unlink_after_commit(path)
+        db_session.commit()
+        payload = {
+                    "message": "Upload successful.",
+                    "filename": filename,
+                    "reportname": name,
+                    "description": description,
+                    "size": upload.size,
+                    "sha256": upload.sha256,
+                    "mime_type": upload.mime_type,
+                    "jobs": jobs,
+                    "user": current_user.email
+                    }
+        return render_json(payload, 200)
+
+
 class Read(Resource):
     '''
     This class represents the reading of a report.
@@ -177,23 +942,26 @@ class Read(Resource):
                 "name": "This is report name",
                 "updated_at": "2022-02-23T02:10:56",
                 "url": "/path/to/file/example.pdf",
+                "blob": "9f86d081884c7d659a2feaa0c55ad015...",
+                "cache_policy": "private",
                 "user": 1
             }
         }
     '''
     @staticmethod
     @auth_required()
+    @cached
+    @replica_reads(db_session)
     def get(report_id):
         '''
         This method is used for reading a report.
         '''
-        report = (Report.query.
-                  filter_by(id=report_id, user_id=current_user.id).
-                  first())
-        print(report)
+        report = routing.first(db_session, Report.query.
+                               filter_by(id=report_id,
+                                         user_id=current_user.id))
         if report is None:
             return render_json({'error': 'Report not found or invalid.'}, 404)
-        payload = ReportSchema().dump(report)
+        payload = report_serializer()(report)
         return render_json(payload, 200)
 
 
@@ -207,6 +975,9 @@ class UpdateData(Resource):
     required input parameters:
         name: report name
         description: report description
+    optional input parameters:
+        cache_policy: Cache-Control policy of downloads,
+                      one of private, public or no-store
 
     example httpie request:
         http PUT http://127.0.0.1:5000/api/v1/report/update/1 \
@@ -239,6 +1010,9 @@ class UpdateData(Resource):
             )
         except KeyError:
             return render_json({"error": "Invalid input."}, 422)
+        cache_policy = request.json.get('cache_policy')
+        if cache_policy is not None and cache_policy not in CACHE_POLICIES:
+            return render_json({"error": "Invalid input."}, 422)
 
         report = (Report.query.
                   filter_by(id=report_id, user_id=current_user.id).
@@ -247,6 +1021,10 @@ class UpdateData(Resource):
             report.name = name
         if description:
             report.description = description
+        if cache_policy:
+            report.cache_policy = cache_policy
+        current_app.extensions['search'].index_fields(db_session, [report])
+        invalidate(current_user.id)
         db_session.commit()
         payload = {
             "message": "Upload successful.",
@@ -280,6 +1058,10 @@ class UpdateFile(Resource):
             "response": {
                 "message": "Report uploaded successfully",
                 "filename": "example.pdf",
+                "size": 1024,
+                "sha256": "9f86d081884c7d659a2feaa0c55ad015...",
+                "mime_type": "application/pdf",
+                "jobs": [3, 4],
                 "user": example@example.com
             }
         }
@@ -290,29 +1072,143 @@ class UpdateFile(Resource):
         '''
         This method is used for updating a report.
         '''
-        file = (
-            request.files['file']
-        )
+        try:
+            file = (
+                request.files['file']
+            )
+        except RequestEntityTooLarge:
+            return render_json({'error': 'File too large.'}, 413)
+        except KeyError:
+            return render_json({'error': 'Invalid input.'}, 422)
 
         report = (Report.query.
                   filter_by(id=report_id, user_id=current_user.id).
                   first())
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            report.url = file_path
+            upload = upload_stream(file)
+            try:
+                usage.charge(current_user.id, 0,
+                             upload.size - (report.size or 0))
+            except QuotaExceeded:
+                db_session.rollback()
+                return render_json({'error': 'Storage quota exceeded.'}, 403)
+            report.size = upload.size
+            old_sha256 = report.blob_sha256
+            report.blob_sha256 = blobstore.acquire(upload)
+            report.url = blobstore.blob_path(report.blob_sha256)
             report.file_name = filename
+            blobstore.release(old_sha256)
+            jobs = enqueue_upload_tasks(
+                report, db_session.get(Blob, report.blob_sha256))
+            invalidate(current_user.id)
             db_session.commit()
-            file.save(os.path.join(UPLOAD_FOLDER, filename))
             payload = {
                         "message": "Upload successful.",
                         "filename": filename,
+                        "size": upload.size,
+                        "sha256": upload.sha256,
+                        "mime_type": upload.mime_type,
+                        "jobs": jobs,
                         "user": current_user.email
                         }
             return render_json(payload, 200)
         return render_json({"error": "Invalid file."}, 422)
 
 
+class BulkUpdate(Resource):
+    '''
+    This class represents the updating of many reports at once.
+    auth_token is necessary.
+
+    method: PUT
+    url: /api/v1/report/bulk_update
+    required input parameters:
+        ids: list of report ids, at most 1000
+        or
+        filter: created_before, created_after, updated_before,
+                updated_after (ISO 8601), file_name or cache_policy
+    optional input parameters, at least one:
+        description: report description
+        cache_policy: Cache-Control policy of downloads,
+                      one of private, public or no-store
+
+    The reports are changed with one UPDATE statement that is scoped to
+    the logged in user, and committed once.
+
+    example httpie request:
+        http PUT http://127.0.0.1:5000/api/v1/report/bulk_update \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            ids:='[1, 2, 3]' \
+            cache_policy=public
+
+    response:
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "message": "Update successful.",
+                "updated": 2,
+                "results": [
+                    {"id": 1, "status": "updated"},
+                    {"id": 2, "status": "updated"},
+                    {"id": 3, "error": "Report not found or invalid."}
+                ]
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def put():
+        '''
+        This method is used for updating many reports.
+        '''
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return render_json({"error": "Invalid input."}, 422)
+        try:
+            ids, criteria = bulk_selection(body)
+        except ValueError:
+            return render_json({"error": "Invalid input."}, 422)
+        values = {}
+        description = body.get('description')
+        if isinstance(description, str) and description.strip():
+            values[Report.description] = description.strip()
+        cache_policy = body.get('cache_policy')
+        if cache_policy is not None:
+            if cache_policy not in CACHE_POLICIES:
+                return render_json({"error": "Invalid input."}, 422)
+            values[Report.cache_policy] = cache_policy
+        if not values:
+            return render_json({"error": "Invalid input."}, 422)
+
+        criteria.append(Report.user_id == current_user.id)
+        found = [report_id for (report_id,) in
+                 db_session.query(Report.id).filter(*criteria)]
+        # one statement per BULK_MAX_IDS reports, a single one for ids
+        for batch in iter_batches(found, BULK_MAX_IDS):
+            (db_session.query(Report).
+             filter(Report.id.in_(batch), *criteria).
+             update(values, synchronize_session=False))
+            if Report.description in values:
+                current_app.extensions['search'].index_fields(
+                    db_session,
+                    db_session.query(Report.id,
+                                     Report.user_id,
+                                     Report.name,
+                                     Report.description).
+                    filter(Report.id.in_(batch)))
+        invalidate(current_user.id)
+        db_session.commit()
+        payload = {
+            "message": "Update successful.",
+            "updated": len(found),
+            "results": bulk_results(ids, found, 'updated')
+            }
+        return render_json(payload, 200)
+
+
 class Download(Resource):
     '''
     This class represents the downloading of a report.
@@ -339,19 +1235,215 @@ class Download(Resource):
     Warning: curl to output it to your terminal anyway, or consider "--output
     Warning: <FILE>" to save to a file.
     ```
+
+    The response carries a strong ETag (the SHA-256 of the file),
+    Last-Modified and the Cache-Control policy of the report.
+    Files stored compressed are sent with Content-Encoding to clients
+    that accept the codec, e.g. `curl --compressed`, and decompressed
+    for the others.
+    Conditional requests (If-None-Match, If-Modified-Since) are answered
+    with 304, and byte ranges with 206, e.g. to resume a download:
+
+        curl -H  "Authentication-Token: \
+            GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE" \
+            http://127.0.0.1:5000/api/v1/report/download/1 \
+            -C - -o FILENAME_THAT_YOU_SPECIFY
     '''
     @staticmethod
     @auth_required()
+    @replica_reads(db_session)
     def get(report_id):
         '''
         This method is used for downloading a report.
         '''
+        query = Report.query.filter_by(id=report_id, user_id=current_user.id)
+        report = routing.first(db_session, query)
+        storage = current_app.extensions['storage']
+        if (report is not None and report.blob_sha256 is not None and
+                routing.on_replica(db_session) and
+                not storage.exists(blobstore.blob_name(report.blob_sha256))):
+            # a replica that lags can still have the blob of a replaced
+            # file, which is gone
+            routing.use_primary(db_session)
+            report = query.populate_existing().first()
+        if report is None:
+            return render_json({'error': 'Report not found or invalid.'}, 404)
+        if report.blob_sha256 is None:
+            # reports uploaded before the blob store, always on local disk
+            return send_from_directory(current_app.config['UPLOAD_FOLDER'],
+                                       report.file_name,
+                                       as_attachment=True)
+        mimetype = (mimetypes.guess_type(report.file_name)[0] or
+                    report.blob.mime_type)
+        return send_stored_file(
+            storage,
+            blobstore.blob_name(report.blob_sha256),
+            etag=report.blob_sha256,
+            download_name=report.file_name,
+            mimetype=mimetype,
+            last_modified=report.updated_at,
+            policy=(report.cache_policy or
+                    current_app.config['DOWNLOAD_CACHE_POLICY']),
+            encoding=report.blob.encoding,
+            size=report.blob.size,
+            stored_size=report.blob.stored_size)
+
+
+class Derivative(Resource):
+    '''
+    This class represents the download of a resized copy of an image
+    report; see api/storage/derivatives.py.
+    auth_token is necessary.
+
+    method: GET
+    url: /api/v1/report/derivative/<report_id>/<size>
+    size: a name of DERIVATIVE_SIZES, e.g. thumbnail or preview
+
+    The copy is made on the first request and kept. It is sent like a
+    download, with a strong ETag of the source content and the size.
+    503 with Retry-After means that too many images are being resized;
+    try again.
+
+    example curl request:
+        curl -H  "Authentication-Token: \
+            GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE" \
+            http://127.0.0.1:5000/api/v1/report/derivative/1/thumbnail \
+            -o thumbnail.png
+    '''
+    @staticmethod
+    @auth_required()
+    def get(report_id, size):
+        '''
+        This method is used for downloading a resized image report.
+        '''
         report = (Report.query.
                   filter_by(id=report_id, user_id=current_user.id).
                   first())
-        return send_from_directory('./static/uploads',
-                                   report.file_name,
-                                   as_attachment=True)
+        if report is None:
+            return render_json({'error': 'Report not found or invalid.'}, 404)
+        edges = derivatives.parse_sizes(current_app.config['DERIVATIVE_SIZES'])
+        if size not in edges:
+            return render_json({'error': 'Unknown size.'}, 404)
+        if (report.blob_sha256 is None or
+                report.blob.mime_type not in derivatives.DERIVATIVE_FORMATS):
+            return render_json({'error': 'Report is not an image.'}, 422)
+        if derivatives.Image is None:
+            return render_json({'error': 'Image resizing is not available.'},
+                               501)
+        storage = current_app.extensions['storage']
+        generator = current_app.extensions['derivatives']
+        try:
+            name = generator.ensure(storage,
+                                    blobstore.blob_name(report.blob_sha256),
+                                    report.blob.encoding,
+                                    report.blob.mime_type,
+                                    edges[size],
+                                    generator.wait)
+        except (OSError, ValueError, derivatives.Image.DecompressionBombError):
+            return render_json({'error': 'Image cannot be read.'}, 422)
+        if name is None:
+            response = render_json(
+                {'error': 'Too many images are being resized.'}, 503)
+            response.headers['Retry-After'] = '1'
+            return response
+        _, extension, mimetype = \
+            derivatives.DERIVATIVE_FORMATS[report.blob.mime_type]
+        return send_stored_file(
+            storage,
+            name,
+            etag=f'{report.blob_sha256}-{edges[size]}',
+            download_name=(f'{os.path.splitext(report.file_name)[0]}-'
+                           f'{size}.{extension}'),
+            mimetype=mimetype,
+            last_modified=report.updated_at,
+            policy=(report.cache_policy or
+                    current_app.config['DOWNLOAD_CACHE_POLICY']))
+
+
+class Archive(Resource):
+    '''
+    This class represents the download of many reports as one ZIP
+    archive, which is built while it is sent; see api/storage/archive.py.
+    auth_token is necessary.
+
+    method: POST
+    url: /api/v1/report/archive
+    required input parameters:
+        ids: list of report ids, at most 1000
+        or
+        filter: created_before, created_after, updated_before,
+                updated_after (ISO 8601), file_name or cache_policy
+
+    The reports are checked with one query that is scoped to the logged
+    in user. Each file is named after its report in the archive, with a
+    number when two reports get the same name, e.g. 'a (2).txt'.
+
+    example httpie request:
+        http POST http://127.0.0.1:5000/api/v1/report/archive \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            ids:='[1, 2, 3]' > reports.zip
+
+    response:
+        application/zip, or when a report is not found:
+        {
+            "meta": {
+                "code": 404
+            },
+            "response": {
+                "error": "Report not found or invalid.",
+                "missing": [3]
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def post():
+        '''
+        This method is used for downloading many reports at once.
+        '''
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return render_json({"error": "Invalid input."}, 422)
+        try:
+            ids, criteria = bulk_selection(body)
+        except ValueError:
+            return render_json({"error": "Invalid input."}, 422)
+
+        reports = (db_session.query(Report.id,
+                                    Report.name,
+                                    Report.file_name,
+                                    Report.blob_sha256,
+                                    Report.updated_at,
+                                    Blob.encoding,
+                                    Blob.size).
+                   outerjoin(Blob, Blob.sha256 == Report.blob_sha256).
+                   filter(Report.user_id == current_user.id, *criteria).
+                   order_by(Report.id).
+                   all())
+        missing = sorted(set(ids or ()) - {report.id for report in reports})
+        if missing or not reports:
+            return render_json({'error': 'Report not found or invalid.',
+                                'missing': missing}, 404)
+        storage = current_app.extensions['storage']
+        # reports uploaded before the blob store are always on local disk
+        legacy = LocalStorage(current_app.config['UPLOAD_FOLDER'])
+        used = set()
+        entries = [(archive_name(report.name, report.file_name, used),
+                    *((legacy, report.file_name)
+                      if report.blob_sha256 is None else
+                      (storage, blobstore.blob_name(report.blob_sha256))),
+                    report.encoding,
+                    report.size,
+                    report.updated_at)
+                   for report in reports]
+        response = Response(
+            iter_archive(entries, current_app.config['UPLOAD_CHUNK_SIZE']),
+            mimetype='application/zip',
+            direct_passthrough=True)
+        response.headers['Content-Disposition'] = \
+            'attachment; filename="reports.zip"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
 
 class Delete(Resource):
@@ -386,9 +1478,187 @@ class Delete(Resource):
         report = (Report.query.
                   filter_by(id=report_id, user_id=current_user.id).
                   first())
+        current_app.extensions['search'].remove(db_session, [report.id])
+        usage.charge(current_user.id, -1, -(report.size or 0))
         db_session.delete(report)
+        blobstore.release(report.blob_sha256)
+        invalidate(current_user.id)
         db_session.commit()
         payload = {
                     "message": "Report deleted successfully"
                     }
         return render_json(payload, 200)
+
+
+class BulkDelete(Resource):
+    '''
+    This class represents the deleting of many reports at once.
+    auth_token is necessary.
+
+    method: DELETE
+    url: /api/v1/report/bulk_delete
+    required input parameters:
+        ids: list of report ids, at most 1000
+        or
+        filter: created_before, created_after, updated_before,
+                updated_after (ISO 8601), file_name or cache_policy
+
+    The reports are removed with one DELETE statement that is scoped to
+    the logged in user. Files that are no longer used by any report are
+    removed together once the deletion has been committed.
+
+    example httpie request:
+        http DELETE http://127.0.0.1:5000/api/v1/report/bulk_delete \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE \
+            filter:='{"created_before": "2022-01-01T00:00:00"}'
+
+    response:
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "message": "Reports deleted successfully",
+                "deleted": 2,
+                "results": [
+                    {"id": 1, "status": "deleted"},
+                    {"id": 2, "status": "deleted"}
+                ]
+            }
+        }
+    '''
+
+    @staticmethod
+    @auth_required()
+    def delete():
+        '''
+        This method is used for deleting many reports.
+        '''
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return render_json({"error": "Invalid input."}, 422)
+        try:
+            ids, criteria = bulk_selection(body)
+        except ValueError:
+            return render_json({"error": "Invalid input."}, 422)
+
+        criteria.append(Report.user_id == current_user.id)
+        found = (db_session.query(Report.id,
+                                  Report.blob_sha256,
+                                  Report.size).
+                 filter(*criteria).
+                 all())
+        usage.charge(current_user.id, -len(found),
+                     -sum(row.size or 0 for row in found))
+        # one statement per BULK_MAX_IDS reports, a single one for ids
+        for batch in iter_batches(found, BULK_MAX_IDS):
+            batch = [row.id for row in batch]
+            current_app.extensions['search'].remove(db_session, batch)
+            (db_session.query(Report).
+             filter(Report.id.in_(batch), *criteria).
+             delete(synchronize_session=False))
+        blobstore.release_many(row.blob_sha256 for row in found)
+        invalidate(current_user.id)
+        db_session.commit()
+        payload = {
+            "message": "Reports deleted successfully",
+            "deleted": len(found),
+            "results": bulk_results(ids, [row.id for row in found],
+                                    'deleted')
+            }
+        return render_json(payload, 200)
+
+
+class JobStatus(Resource):
+    '''
+    This class represents the status of a background job, e.g. one of
+    the jobs returned by the upload of a report.
+    auth_token is necessary.
+
+    method: GET
+    url: /api/v1/report/jobs/<job_id>
+
+    example httpie request:
+        http GET http://127.0.0.1:5000/api/v1/report/jobs/1 \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE
+
+    response:
+        status is one of queued, running, succeeded or failed.
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "id": 1,
+                "task": "inspect_file",
+                "status": "succeeded",
+                "attempts": 1,
+                "result": {
+                    "mime_type": "application/pdf",
+                    "matches_extension": true,
+                    "pages": 12
+                },
+                "error": null,
+                "report": 1,
+                "user": 1,
+                "created_at": "2022-02-23T02:10:56",
+                "updated_at": "2022-02-23T02:10:57"
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def get(job_id):
+        '''
+        This method is used for polling a background job.
+        '''
+        job = (Job.query.
+               filter_by(id=job_id, user_id=current_user.id).
+               first())
+        if job is None:
+            return render_json({'error': 'Job not found or invalid.'}, 404)
+        return render_json(JobSchema().dump(job), 200)
+
+
+class Usage(Resource):
+    '''
+    This class represents the storage usage of logged in user.
+    auth_token is necessary.
+
+    method: GET
+    url: /api/v1/report/usage
+
+    example httpie request:
+        http GET http://127.0.0.1:5000/api/v1/report/usage \
+            Authentication-Token:GET_AUTH_TOKEN_WITH_LOGIN_API_AND_PASTE_HERE
+
+    response:
+        max_reports and max_bytes are null when there is no limit.
+        {
+            "meta": {
+                "code": 200
+            },
+            "response": {
+                "reports": 12,
+                "bytes": 10485760,
+                "max_reports": null,
+                "max_bytes": 1073741824
+            }
+        }
+    '''
+    @staticmethod
+    @auth_required()
+    def get():
+        '''
+        This method is used for reading the storage usage.
+        '''
+        report_count, used = usage.usage(current_user.id)
+        max_reports = current_app.config['USAGE_MAX_REPORTS']
+        max_bytes = current_app.config['USAGE_MAX_BYTES']
+        payload = {
+                    "reports": report_count,
+                    "bytes": used,
+                    "max_reports": max_reports or None,
+                    "max_bytes": max_bytes or None
+                    }
+        return render_json(payload, 200)
@@ -0,0 +1,290 @@
+'''
+This file takes care of the background job queue.
+
+Work that does not have to happen inside a request, e.g. inspecting an
+uploaded file, is recorded as a Job row and run by a bounded pool of
+workers once the request has committed:
+
+    job = enqueue('inspect_file', current_user.id, report_id=report.id,
+                  name=blob_name(sha256), file_name=filename)
+    db_session.commit()  # the job is handed to the pool here
+
+The Job row is written in the same transaction as the change that asked
+for it, so a rolled back request leaves no job behind, and the pool only
+sees jobs that exist. A worker claims a job with an atomic UPDATE from
+queued to running, so a job is never run twice at the same time.
+A failed attempt is retried after JOB_RETRY_DELAY seconds, doubled for
+each retry, until JOB_MAX_ATTEMPTS is reached. Jobs still queued when the
+app starts, e.g. after a restart, are handed to the pool again, and so
+are jobs left running by a worker that stopped: a job that has been
+running for JOB_STALE_AFTER seconds is taken as abandoned, queued again
+if it has attempts left and failed otherwise. Running jobs are checked
+again whenever one of them would turn stale.
+
+Tasks run without the database (see tasks.py) and read local files:
+a `name` argument names a file of the storage backend, which the worker
+hands to the task as the `path` of a local copy, or of the file itself
+with the local backend. A task whose result has to be stored somewhere
+registers a handler with JobQueue.on_result(); the worker calls it with
+its own session before the job is committed.
+
+Clients poll GET /api/v1/report/jobs/<job_id> for the status and result.
+'''
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from api.conf.database import db_session, engine
+from api.models import Job
+from api.jobs.tasks import TASKS
+
+# Error of a job whose worker stopped while it was running.
+ABANDONED_ERROR = 'Abandoned: the worker stopped while it was running.'
+
+
+def enqueue(task, user_id, report_id=None, **args):
+    '''
+    Add a job to the current transaction and return it.
+    It is handed to the pool once the session commits.
+    input:
+        task = name of a function in TASKS
+        user_id = owner of the job
+        report_id = id of the report the job works on, if any
+        args = keyword arguments of the task
+    '''
+    if task not in TASKS:
+        raise KeyError(task)
+    job = Job(task=task, user_id=user_id, report_id=report_id, args=args)
+    db_session.add(job)
+    # the id is needed to hand the job over after commit
+    db_session.flush()
+    db_session.info.setdefault('jobs', []).append(job.id)
+    return job
+
+
+@event.listens_for(db_session, 'after_commit')
+def _submit_jobs(session):
+    job_ids = session.info.pop('jobs', ())
+    if job_ids:
+        queue = current_app.extensions['jobs']
+        for job_id in job_ids:
+            queue.submit(job_id)
+
+
+@event.listens_for(db_session, 'after_rollback')
+def _drop_jobs(session):
+    session.info.pop('jobs', None)
+
+
+class JobQueue():
+    '''
+    Bounded pool of workers that runs jobs by id.
+    Workers use their own database sessions; in process mode the task
+    itself runs in a child process and only the result comes back.
+    '''
+
+    def __init__(self, executor='thread', workers=4, max_attempts=3,
+                 retry_delay=5.0, storage=None, stale_after=600.0):
+        # pylint: disable=too-many-arguments
+        self.executor = executor
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stale_after = stale_after
+        self._threads = None
+        self._processes = None
+        if executor != 'inline':
+            self._threads = ThreadPoolExecutor(workers,
+                                               thread_name_prefix='job')
+        if executor == 'process':
+            self._processes = ProcessPoolExecutor(workers)
+        self._pending = 0
+        self._idle = threading.Condition()
+        # retries waiting for their delay, by job id
+        self._timers = {}
+        # next check for abandoned jobs
+        self._recovery = None
+        # result handlers, by task name
+        self._handlers = {}
+
+    def on_result(self, task, handler):
+        '''
+        Register handler(session, job, result) to be called with the
+        result of every successful run of a task, in the worker's
+        session. Its return value is stored as the job result.
+        '''
+        self._handlers[task] = handler
+
+    def submit(self, job_id, delay=0):
+        '''
+        Run a queued job, after delay seconds if given.
+        '''
+        with self._idle:
+            self._pending += 1
+            if delay:
+                timer = threading.Timer(delay, self._retry, [job_id])
+                timer.daemon = True
+                self._timers[job_id] = timer
+                timer.start()
+                return
+        self._dispatch(job_id)
+
+    def resume(self):
+        '''
+        Hand the jobs that are still queued, e.g. after a restart, to
+        the pool, with those that a stopped worker left running.
+        '''
+        self.recover(submit=False)
+        with Session(engine) as session:
+            job_ids = [job_id for (job_id,) in
+                       session.query(Job.id).
+                       filter(Job.status == 'queued').
+                       order_by(Job.id)]
+        for job_id in job_ids:
+            self.submit(job_id)
+
+    def recover(self, submit=True):
+        '''
+        Queue the jobs that have been running for stale_after seconds
+        again, or fail them once they used up their attempts, and check
+        again when the next running job would turn stale. Returns the
+        ids of the queued jobs, which are handed to the pool if submit.
+        '''
+        now = datetime.now()
+        stale = (Job.status == 'running',
+                 Job.updated_at < now - timedelta(seconds=self.stale_after))
+        with Session(engine) as session:
+            (session.query(Job).
+             filter(*stale, Job.attempts >= self.max_attempts).
+             update({Job.status: 'failed', Job.error: ABANDONED_ERROR},
+                    synchronize_session=False))
+            job_ids = [job_id for (job_id,) in
+                       session.query(Job.id).filter(*stale).order_by(Job.id)]
+            if job_ids:
+                (session.query(Job).
+                 filter(Job.id.in_(job_ids), *stale).
+                 update({Job.status: 'queued', Job.error: ABANDONED_ERROR},
+                        synchronize_session=False))
+            oldest = (session.query(func.min(Job.updated_at)).
+                      filter(Job.status == 'running').
+                      scalar())
+            session.commit()
+        if oldest is not None:
+            delay = (oldest - now).total_seconds() + self.stale_after
+            with self._idle:
+                if self._recovery is not None:
+                    self._recovery.cancel()
+                self._recovery = threading.Timer(max(delay, 0) + 1,
+                                                 self.recover)
+                self._recovery.daemon = True
+                self._recovery.start()
+        if submit:
+            for job_id in job_ids:
+                self.submit(job_id)
+        return job_ids
+
+    def wait(self, timeout=None):
+        '''
+        Block until every submitted job, retries included, has finished.
+        Returns False if the timeout expired first.
+        '''
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self):
+        '''
+        Stop the workers once the running jobs are done.
+        Retries that are still waiting stay queued in the database and
+        are resumed at the next start.
+        '''
+        with self._idle:
+            if self._recovery is not None:
+                self._recovery.cancel()
+            for timer in self._timers.values():
+                timer.cancel()
+            self._pending -= len(self._timers)
+            self._timers.clear()
+            self._idle.notify_all()
+        if self._threads is not None:
+            self._threads.shutdown()
+        if self._processes is not None:
+            self._processes.shutdown()
+
+    def _retry(self, job_id):
+        with self._idle:
+            if self._timers.pop(job_id, None) is None:
+                # cancelled by shutdown()
+                return
+        self._dispatch(job_id)
+
+    def _dispatch(self, job_id):
+        if self._threads is None:
+            self._run(job_id)
+        else:
+            self._threads.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            self._execute(job_id)
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _call(self, task, args):
+        if 'name' in args:
+            args = dict(args)
+            with self.storage.local_copy(args.pop('name')) as path:
+                return self._call(task, dict(args, path=path))
+        if self._processes is not None:
+            return self._processes.submit(TASKS[task], **args).result()
+        return TASKS[task](**args)
+
+    def _execute(self, job_id):
+        with Session(engine) as session:
+            claimed = (session.query(Job).
+                       filter_by(id=job_id, status='queued').
+                       update({Job.status: 'running',
+                               Job.attempts: Job.attempts + 1},
+                              synchronize_session=False))
+            session.commit()
+            if not claimed:
+                return
+            job = session.get(Job, job_id)
+            try:
+                result = self._call(job.task, job.args)
+                if job.task in self._handlers:
+                    result = self._handlers[job.task](session, job, result)
+            except Exception as error:  # pylint: disable=broad-except
+                # drop whatever a result handler wrote
+                session.rollback()
+                job.error = f'{type(error).__name__}: {error}'
+                if job.attempts < self.max_attempts:
+                    job.status = 'queued'
+                    session.commit()
+                    self.submit(job_id, self.retry_delay *
+                                2 ** (job.attempts - 1))
+                    return
+                job.status = 'failed'
+            else:
+                job.status = 'succeeded'
+                job.result = result
+                job.error = None
+            session.commit()
+
+
+def init_app(app):
+    '''
+    Create the job queue of the app from its JOB_* settings.
+    Call resume() once the result handlers are registered.
+    '''
+    queue = JobQueue(app.config['JOB_EXECUTOR'],
+                     app.config['JOB_WORKERS'],
+                     app.config['JOB_MAX_ATTEMPTS'],
+                     app.config['JOB_RETRY_DELAY'],
+                     app.extensions['storage'],
+                     app.config['JOB_STALE_AFTER'])
+    app.extensions['jobs'] = queue
+    return queue
@@ -0,0 +1,155 @@
+'''
+This file takes care of the tasks that background jobs run.
+
+A task is a plain module-level function that takes JSON-serializable
+keyword arguments and returns a JSON-serializable result. It must not
+use the database or the Flask app: with JOB_EXECUTOR=process it runs in
+another process. Tasks are looked up by name in TASKS.
+'''
+import io
+import re
+import struct
+import mimetypes
+from api.storage.codec import open_stored
+from api.storage.stream import SNIFF_LENGTH, sniff_mime
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - optional dependency
+    pypdf = None
+
+# Size of the blocks that files are scanned in, in bytes.
+SCAN_CHUNK_SIZE = 64 * 1024
+
+# Most bytes of text extracted from one file for the search index.
+TEXT_MAX_SIZE = 1024 * 1024
+
+# A page object of a PDF, not the /Pages tree node.
+PDF_PAGE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+# Longest match of PDF_PAGE that can span two chunks.
+PDF_PAGE_OVERLAP = 32
+
+# JPEG start-of-frame markers, which carry the image size.
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                    0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+
+
+def count_pdf_pages(path, encoding=None):
+    '''
+    Count the page objects of a PDF file.
+    '''
+    pages, tail = 0, b''
+    with open_stored(path, encoding) as file:
+        chunk = file.read(SCAN_CHUNK_SIZE)
+        while chunk:
+            data = tail + chunk
+            # matches that start in the overlap are counted with the
+            # next chunk, when the bytes after them are known
+            limit = len(data) - PDF_PAGE_OVERLAP
+            pages += sum(1 for match in PDF_PAGE.finditer(data)
+                         if match.start() < limit)
+            tail = data[max(limit, 0):]
+            chunk = file.read(SCAN_CHUNK_SIZE)
+    return pages + len(PDF_PAGE.findall(tail))
+
+
+def jpeg_size(file):
+    '''
+    Read the (width, height) of a JPEG file from its start-of-frame
+    segment, or None if there is none.
+    '''
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        length = file.read(2)
+        if len(length) < 2:
+            return None
+        if marker[1] in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>xHH', file.read(5))
+            return width, height
+        file.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+def image_size(path, mime_type, encoding=None):
+    '''
+    Read the (width, height) of a PNG, GIF or JPEG file from its header,
+    or None if the header is truncated.
+    '''
+    with open_stored(path, encoding) as file:
+        try:
+            if mime_type == 'image/png':
+                file.seek(16)
+                return struct.unpack('>II', file.read(8))
+            if mime_type == 'image/gif':
+                file.seek(6)
+                return struct.unpack('<HH', file.read(4))
+            return jpeg_size(file)
+        except struct.error:
+            return None
+
+
+def inspect_file(path, file_name, encoding=None):
+    '''
+    Verify the MIME type of an uploaded file against its extension and
+    extract its metadata: the page count of a PDF, the size of an image.
+    encoding is the codec the file is stored with, if any.
+    '''
+    with open_stored(path, encoding) as file:
+        mime_type = sniff_mime(file.read(SNIFF_LENGTH))
+    expected = mimetypes.guess_type(file_name)[0]
+    result = {'mime_type': mime_type,
+              'matches_extension': mime_type == expected}
+    if mime_type == 'application/pdf':
+        result['pages'] = count_pdf_pages(path, encoding)
+    elif mime_type.startswith('image/'):
+        size = image_size(path, mime_type, encoding)
+        if size is not None:
+            result['width'], result['height'] = size
+    return result
+
+
+def pdf_text(path, encoding=None):
+    '''
+    Extract the text of a PDF with the optional pypdf package, or return
+    an empty string without it.
+    '''
+    if pypdf is None:
+        return ''
+    with open_stored(path, encoding) as file:
+        # the reader seeks from the end, which a codec cannot do
+        data = file if encoding is None else io.BytesIO(file.read())
+        text, size = [], 0
+        for page in pypdf.PdfReader(data).pages:
+            text.append(page.extract_text() or '')
+            size += len(text[-1])
+            if size >= TEXT_MAX_SIZE:
+                break
+    return '\n'.join(text)[:TEXT_MAX_SIZE]
+
+
+def extract_text(path, file_name, encoding=None):
+    '''
+    Extract the text of an uploaded file for the search index: the
+    first TEXT_MAX_SIZE bytes of a text file, the text of a PDF, and
+    nothing for an image. See api/search.py for the result handler.
+    The content decides, file_name is ignored.
+    '''
+    del file_name
+    with open_stored(path, encoding) as file:
+        head = file.read(SNIFF_LENGTH)
+        mime_type = sniff_mime(head)
+        if mime_type == 'text/plain':
+            data = head + file.read(TEXT_MAX_SIZE - len(head))
+            return {'text': data.decode('utf-8', errors='ignore')}
+    if mime_type == 'application/pdf':
+        return {'text': pdf_text(path, encoding)}
+    return {'text': ''}
+
+
+# Tasks that jobs can run, by name.
+TASKS = {
+    'inspect_file': inspect_file,
+    'extract_text': extract_text,
+}
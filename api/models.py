@@ -3,7 +3,13 @@ This Python file takes care of models that contain the following:
     - User
     - Role
     - UserRoles
+    - Blob
     - Report
+    - UserUsage
+    - Job
+    - UploadSession
+    - ReportText
+    - SearchPosting
 
 Also Marshmallow is used to serialize and deserialize the models.
 By this library, we can easily create a JSON object from the models.
@@ -12,8 +18,11 @@ By this library, we can easily create a JSON object from the models.
 from datetime import datetime
 from flask_security import UserMixin, RoleMixin
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy import Boolean, DateTime, Column, Integer, \
-                       String, ForeignKey
+from sqlalchemy import Boolean, DateTime, Column, Integer, Float, \
+                       BigInteger, String, Text, JSON, ForeignKey, \
+                       DDL, Index, event
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
+from marshmallow import fields
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from api.conf.database import Base
 
@@ -73,6 +82,31 @@ class User(Base, UserMixin):
                          backref=backref('users', lazy='dynamic'))
 
 
+class Blob(Base):
+    '''
+    Blob class that contains a stored file, including:
+        - sha256
+            : hex digest of the content, the key of the blob store
+        - size
+        - mime_type
+        - ref_count
+            : number of reports that point at this blob
+        - encoding
+            : codec the file is compressed with, see api/storage/codec.py
+        - stored_size
+            : size of the file on disk
+        - created_at
+    '''
+    __tablename__ = 'blob'
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(255))
+    ref_count = Column(Integer, nullable=False, default=0)
+    encoding = Column(String(20))
+    stored_size = Column(BigInteger)
+    created_at = Column(DateTime(), default=datetime.now)
+
+
 class Report(Base):
     '''
     Report class that contains the Report information, including:
@@ -84,8 +118,21 @@ class Report(Base):
         - updated_at
         - url
         - file_name
+        - blob_sha256
+            : the stored file, see api/storage/blobstore.py
+        - cache_policy
+            : Cache-Control policy of downloads, see api/storage/serve.py
+        - size
+            : size of the file, counted in the owner's UserUsage
+    Every lookup is scoped to the owner, so the indexes start with user_id:
+    (user_id, id) for reading a report and the keyset pages of List, and
+    (user_id, updated_at) for the updated_before/after bulk filters.
     '''
     __tablename__ = 'report'
+    __table_args__ = (
+        Index('ix_report_user_id_id', 'user_id', 'id'),
+        Index('ix_report_user_id_updated_at', 'user_id', 'updated_at'),
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(255), unique=True, nullable=False)
     description = Column(String(255), nullable=False)
@@ -97,12 +144,157 @@ class Report(Base):
     user = relationship('User', backref=backref('reports', lazy='dynamic'))
     url = Column(String(255))
     file_name = Column(String(255), nullable=False)
+    blob_sha256 = Column(String(64), ForeignKey('blob.sha256'))
+    blob = relationship('Blob')
+    cache_policy = Column(String(20))
+    size = Column(BigInteger)
+
+
+class UserUsage(Base):
+    '''
+    UserUsage class that contains the storage used by a user, kept up to
+    date by every change to their reports, see api/usage.py, including:
+        - user_id
+        - report_count
+        - bytes
+            : sum of the sizes of the user's reports
+        - updated_at
+    '''
+    __tablename__ = 'user_usage'
+    user_id = Column(Integer,
+                     ForeignKey('user.id', ondelete='CASCADE'),
+                     primary_key=True)
+    report_count = Column(Integer, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(),
+                        default=datetime.now,
+                        onupdate=datetime.now)
+
+
+class Job(Base):
+    '''
+    Job class that contains a background job, including:
+        - id
+        - user_id
+        - report_id
+            : the report the job works on, if any
+        - task
+            : name of the function in api/jobs/tasks.py
+        - args
+            : keyword arguments of the task
+        - status
+            : queued, running, succeeded or failed
+        - attempts
+        - result
+            : return value of the task
+        - error
+            : error of the last failed attempt
+        - created_at
+        - updated_at
+    '''
+    __tablename__ = 'job'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'))
+    user = relationship('User')
+    report_id = Column(Integer, ForeignKey('report.id', ondelete='SET NULL'))
+    report = relationship('Report')
+    task = Column(String(64), nullable=False)
+    args = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    result = Column(JSON)
+    error = Column(Text)
+    created_at = Column(DateTime(), default=datetime.now)
+    updated_at = Column(DateTime(),
+                        default=datetime.now,
+                        onupdate=datetime.now)
+
+
+class UploadSession(Base):
+    '''
+    UploadSession class that contains a resumable upload in progress,
+    see api/storage/resumable.py, including:
+        - id
+            : random token, also the name of the partial file
+        - user_id
+        - name
+        - description
+        - file_name
+        - length
+            : size of the whole file, declared when the session starts
+        - created_at
+        - expires_at
+            : the session and its partial file are removed after this
+    The committed offset is the size of the partial file.
+    '''
+    __tablename__ = 'upload_session'
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'))
+    name = Column(String(255), nullable=False)
+    description = Column(String(255), nullable=False)
+    file_name = Column(String(255), nullable=False)
+    length = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(), default=datetime.now)
+    expires_at = Column(DateTime(), nullable=False, index=True)
+
+
+class ReportText(Base):
+    '''
+    ReportText class that contains the text extracted from the file of
+    a report, for the MySQL FULLTEXT search backend, including:
+        - report_id
+        - user_id
+        - content
+    '''
+    __tablename__ = 'report_text'
+    report_id = Column(Integer,
+                       ForeignKey('report.id', ondelete='CASCADE'),
+                       primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'))
+    # up to TEXT_MAX_SIZE of api/jobs/tasks.py, more than a MySQL TEXT
+    content = Column(Text().with_variant(MEDIUMTEXT(), 'mysql'))
+
+
+class SearchPosting(Base):
+    '''
+    SearchPosting class that contains an entry of the inverted search
+    index: one term of one field of one report, including:
+        - user_id
+            : owner of the report, first so every lookup is owner-scoped
+        - term
+        - report_id
+        - field
+            : name, description or text
+        - tf
+            : 1 + log(number of occurrences of the term in the field)
+    '''
+    __tablename__ = 'search_posting'
+    user_id = Column(Integer, primary_key=True)
+    term = Column(String(64), primary_key=True)
+    report_id = Column(Integer,
+                       ForeignKey('report.id', ondelete='CASCADE'),
+                       primary_key=True,
+                       index=True)
+    field = Column(String(16), primary_key=True)
+    tf = Column(Float, nullable=False)
+
+
+# FULLTEXT indexes of the MySQL search backend.
+event.listen(Report.__table__, 'after_create', DDL(
+    'ALTER TABLE report ADD FULLTEXT INDEX ft_report (name, description)'
+).execute_if(dialect='mysql'))
+event.listen(ReportText.__table__, 'after_create', DDL(
+    'ALTER TABLE report_text ADD FULLTEXT INDEX ft_report_text (content)'
+).execute_if(dialect='mysql'))
 
 
 class ReportSchema(SQLAlchemyAutoSchema):
     '''
     ReportSchema class for serializing the Report model.
+    The blob is dumped from the foreign key, so no Blob row is loaded.
     '''
+    blob = fields.String(attribute='blob_sha256')
+
     class Meta:
         '''
         configuration of the ReportSchema class.
@@ -123,3 +315,18 @@ class UserSchema(SQLAlchemyAutoSchema):
         model = User
         include_relationships = True
         load_instance = True
+
+
+class JobSchema(SQLAlchemyAutoSchema):
+    '''
+    JobSchema class for serializing the Job model.
+    The arguments are left out, they hold server paths.
+    '''
+    class Meta:
+        '''
+        configuration of the JobSchema class.
+        '''
+        model = Job
+        include_relationships = True
+        load_instance = True
+        exclude = ('args',)
@@ -0,0 +1,163 @@
+'''
+This file takes care of the connection pool of the database engine.
+
+engine_options() turns the DATABASE_POOL_* settings of an environment
+(see api/conf/database.py) into create_engine() arguments:
+    - 'queue': QueuePool, DATABASE_POOL_SIZE connections kept open plus
+      up to DATABASE_MAX_OVERFLOW more under load; a checkout waits at
+      most DATABASE_POOL_TIMEOUT seconds for one, then fails with
+      "QueuePool limit ... reached"
+    - 'null': NullPool, a new connection per checkout, e.g. for tests
+Connections older than DATABASE_POOL_RECYCLE seconds are replaced before
+MySQL's wait_timeout closes them, and DATABASE_POOL_PRE_PING tests each
+connection on checkout, so a connection dropped by the server is
+replaced instead of failing the request.
+
+PoolMetrics counts what the pool does, per worker process:
+    - checked_out, and overflow for a QueuePool: connections in use now
+    - created and invalidated connections, checkouts and timeouts
+    - a histogram of the time a checkout takes, which is the wait for a
+      free connection plus connecting and pinging, in seconds
+stats() returns them, e.g. for GET /api/v1/metrics.
+'''
+import time
+import threading
+from bisect import bisect_left
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool, NullPool
+
+# Pool classes that DATABASE_POOL_CLASS can choose from.
+POOL_CLASSES = {'queue': QueuePool, 'null': NullPool}
+
+# Upper bounds of the buckets of the checkout time histogram, in seconds.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class MeteredPool():
+    '''
+    Mixin of a pool class that times every checkout into its metrics.
+    The metrics are a class attribute, as a pool that is recreated, e.g.
+    by engine.dispose(), only keeps its class.
+    '''
+    metrics = None
+
+    def connect(self):
+        '''
+        Check out a connection, counting how long it took.
+        '''
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeout:
+            self.metrics.count('timeouts')
+            raise
+        finally:
+            self.metrics.observe_wait(time.perf_counter() - started)
+
+
+class PoolMetrics():
+    '''
+    Counters and checkout time histogram of the pools of an engine.
+    '''
+
+    def __init__(self):
+        self.counters = {'created': 0,
+                         'invalidated': 0,
+                         'checkouts': 0,
+                         'checked_out': 0,
+                         'timeouts': 0}
+        # one more bucket for the checkouts over the last bound
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def pool_class(self, base):
+        '''
+        Subclass of a pool class whose checkouts are timed into these
+        metrics.
+        '''
+        return type(f'Metered{base.__name__}', (MeteredPool, base),
+                    {'metrics': self})
+
+    def engine_options(self, pool_class, size, max_overflow, timeout,
+                       recycle, pre_ping):
+        '''
+        Return the create_engine() arguments of a pool configuration.
+        '''
+        if pool_class not in POOL_CLASSES:
+            raise ValueError(f'Unknown DATABASE_POOL_CLASS {pool_class!r}.')
+        options = {'poolclass': self.pool_class(POOL_CLASSES[pool_class]),
+                   'pool_recycle': recycle,
+                   'pool_pre_ping': pre_ping}
+        if pool_class == 'queue':
+            options.update(pool_size=size,
+                           max_overflow=max_overflow,
+                           pool_timeout=timeout)
+        return options
+
+    def watch(self, engine):
+        '''
+        Count the connections of the pools of an engine.
+        '''
+        event.listen(engine, 'connect',
+                     lambda *args: self.count('created'))
+        event.listen(engine, 'invalidate',
+                     lambda *args: self.count('invalidated'))
+        event.listen(engine, 'soft_invalidate',
+                     lambda *args: self.count('invalidated'))
+        event.listen(engine, 'checkout', self._checkout)
+        event.listen(engine, 'checkin', self._checkin)
+
+    def count(self, counter, value=1):
+        '''
+        Add value to a counter.
+        '''
+        with self._lock:
+            self.counters[counter] += value
+
+    def observe_wait(self, seconds):
+        '''
+        Add the time of a checkout to the histogram.
+        '''
+        with self._lock:
+            self.wait_counts[bisect_left(WAIT_BUCKETS, seconds)] += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self, pool):
+        '''
+        Current state of a pool and the counters of its engine.
+        The histogram buckets are cumulative: the number of checkouts
+        that took at most each bound.
+        '''
+        with self._lock:
+            stats = dict(self.counters)
+            wait_counts = list(self.wait_counts)
+            wait_sum, wait_max = self.wait_sum, self.wait_max
+        stats['pool'] = type(pool).__bases__[-1].__name__
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(),
+                         checked_in=pool.checkedin(),
+                         overflow=max(pool.overflow(), 0),
+                         timeout=pool.timeout())
+        buckets, total = {}, 0
+        for bound, count in zip(WAIT_BUCKETS + ('+Inf',), wait_counts):
+            total += count
+            buckets[str(bound)] = total
+        stats['wait_seconds'] = {'buckets': buckets,
+                                 'count': total,
+                                 'sum': round(wait_sum, 6),
+                                 'max': round(wait_max, 6)}
+        return stats
+
+    def _checkout(self, *args):
+        # pylint: disable=unused-argument
+        with self._lock:
+            self.counters['checkouts'] += 1
+            self.counters['checked_out'] += 1
+
+    def _checkin(self, *args):
+        # pylint: disable=unused-argument
+        self.count('checked_out', -1)
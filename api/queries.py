@@ -0,0 +1,206 @@
+'''
+This file takes care of counting and timing the SQL statements of each
+request, on the primary and on the replicas.
+
+Every statement that runs while a request is handled is recorded on
+flask.g, with its duration and its shape: the SQL with its literals and
+the values of IN (...) lists replaced by ?. Once the handler returned:
+    - the response carries `Server-Timing: db;dur=<ms>;desc="<n>
+      queries"`, which browser dev tools show next to the request, unless
+      QUERY_SERVER_TIMING is off (by default in production)
+    - a request that runs more than QUERY_BUDGET statements, or spends
+      more than QUERY_BUDGET_MS in them, is logged as a warning
+    - a SELECT of the same shape that runs QUERY_REPEAT_THRESHOLD times
+      or more is logged as a warning with the handler that ran it; it is
+      usually a relationship loaded row by row (N+1) in a loop
+Statements outside of requests, e.g. of the jobs or of the CLI, and
+those run after the handler, e.g. while a download is streamed or when
+the request is torn down, are not counted. stats() returns the counters
+of the worker, see api/handlers/metrics.py.
+'''
+import re
+import time
+import threading
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Parts of a statement that differ between the runs of the same query.
+SHAPE_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'(?:%s|%\(\w+\)s|:\w+)'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def shape_of(statement):
+    '''
+    The statement without the values it was run with.
+    '''
+    for pattern, replacement in SHAPE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def handler_name():
+    '''
+    Dotted name of the function that handles the current request, e.g.
+    api.handlers.report.List.get.
+    '''
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None:
+        return request.endpoint or '-'
+    view_class = getattr(view, 'view_class', None)
+    if view_class is not None:
+        return (f'{view_class.__module__}.{view_class.__qualname__}.'
+                f'{request.method.lower()}')
+    return f'{view.__module__}.{view.__qualname__}'
+
+
+class RequestQueries():
+    '''
+    The statements of one request.
+    '''
+
+    def __init__(self, current_request=None):
+        self.request = current_request
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def add(self, statement, seconds):
+        '''
+        Record a statement that took this many seconds.
+        '''
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape_of(statement)] += 1
+
+    def repeated(self, threshold):
+        '''
+        The SELECT shapes run threshold times or more, with their count.
+        '''
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= threshold and shape.upper().startswith('SELECT')]
+
+
+def request_queries():
+    '''
+    The statements of the current request so far. They are kept on g,
+    which outlives the request when the app context was pushed before,
+    so those of an earlier request are dropped.
+    '''
+    # pylint: disable=protected-access
+    current_request = request._get_current_object()
+    queries = g.get('queries')
+    if queries is None or queries.request is not current_request:
+        queries = g.queries = RequestQueries(current_request)
+    return queries
+
+
+class QueryMonitor():
+    '''
+    Checks the statements of every request of an app against its
+    QUERY_* settings.
+    '''
+
+    def __init__(self, budget, budget_ms, repeat_threshold, server_timing):
+        self.budget = budget
+        self.budget_ms = budget_ms
+        self.repeat_threshold = repeat_threshold
+        self.server_timing = server_timing
+        self.counters = {'requests': 0, 'statements': 0, 'seconds': 0.0,
+                         'over_budget': 0, 'repeated': 0}
+        self._lock = threading.Lock()
+
+    def finish(self, response):
+        '''
+        Report the statements of the current request, an after_request
+        handler.
+        '''
+        queries = request_queries()
+        milliseconds = queries.seconds * 1000
+        over_budget = ((self.budget and queries.count > self.budget) or
+                       (self.budget_ms and milliseconds > self.budget_ms))
+        repeated = (queries.repeated(self.repeat_threshold)
+                    if self.repeat_threshold else [])
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['statements'] += queries.count
+            self.counters['seconds'] += queries.seconds
+            self.counters['over_budget'] += bool(over_budget)
+            self.counters['repeated'] += bool(repeated)
+        if self.server_timing:
+            response.headers.add(
+                'Server-Timing',
+                f'db;dur={milliseconds:.2f};desc="{queries.count} queries"')
+        if over_budget or repeated:
+            where = f'{request.method} {request.path} ({handler_name()})'
+            logger = current_app.logger
+            if over_budget:
+                logger.warning(
+                    'Query budget exceeded: %s ran %d statements in %.1f ms, '
+                    'the budget is %d statements and %d ms.', where,
+                    queries.count, milliseconds, self.budget, self.budget_ms)
+            for shape, count in repeated:
+                logger.warning('Repeated query (N+1): %s ran %d times: %s',
+                               where, count, shape)
+        return response
+
+    def stats(self):
+        '''
+        Counters of the worker since it started.
+        '''
+        with self._lock:
+            return dict(self.counters,
+                        seconds=round(self.counters['seconds'], 6))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    '''
+    Start the clock of a statement run in a request.
+    '''
+    # pylint: disable=unused-argument,too-many-arguments
+    if has_request_context():
+        conn.info['query_started'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    '''
+    Record a statement run in a request.
+    '''
+    # pylint: disable=unused-argument,too-many-arguments
+    started = conn.info.pop('query_started', None)
+    if started is not None and has_request_context():
+        request_queries().add(statement, time.perf_counter() - started)
+
+
+def init_app(app, *engines):
+    '''
+    Count the statements that the engines run in the requests of the
+    app, and report them after each request.
+    '''
+    server_timing = app.config['QUERY_SERVER_TIMING']
+    if server_timing == 'auto':
+        server_timing = app.config.get('ENV') != 'production'
+    else:
+        server_timing = bool(int(server_timing))
+    monitor = QueryMonitor(app.config['QUERY_BUDGET'],
+                           app.config['QUERY_BUDGET_MS'],
+                           app.config['QUERY_REPEAT_THRESHOLD'],
+                           server_timing)
+    # engines outlive the apps, e.g. of the tests, so listen only once
+    for engine in engines:
+        for name, listener in (('before_cursor_execute',
+                                before_cursor_execute),
+                               ('after_cursor_execute',
+                                after_cursor_execute)):
+            if not event.contains(engine, name, listener):
+                event.listen(engine, name, listener)
+    app.after_request(monitor.finish)
+    app.extensions['queries'] = monitor
+    return monitor
@@ -0,0 +1,213 @@
+'''
+This file takes care of sending read-only queries to database replicas.
+
+The primary is the database that every write goes to. With replicas in
+DATABASE_REPLICA_URIS, queries that only read can be sent to one of
+them instead:
+    - the handlers decorated with replica_reads(db_session), e.g. List,
+      Read and Download
+    - the lookup of the user of an auth token, for every request, see
+      RoutingUserDatastore
+A request reads from one replica, chosen by DATABASE_REPLICA_POLICY:
+    - 'round_robin': each replica in turn
+    - 'least_loaded': the one with the fewest connections in use in this
+      worker, each in turn among equals
+
+Replicas lag behind the primary, so a request sticks to the primary for
+the rest of the request once it writes, i.e. flushes, runs an UPDATE or
+DELETE, or locks rows with SELECT ... FOR UPDATE. A row that is missing
+from a replica, e.g. a report uploaded a moment ago, is looked up again
+on the primary by first(), and so is the user of a new auth token, and
+a report whose blob on the replica has been replaced and removed since.
+Lists are served as the replica has them, and can miss the latest
+uploads for as long as it lags; cached lists and reads come from the
+primary for a moment after a change of the user, see api/cache.py.
+
+The replica's transaction is rolled back at the end of the request, so
+the next request of the worker does not read an old snapshot.
+'''
+import itertools
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from flask_security import SQLAlchemySessionUserDatastore
+from api.pool import PoolMetrics
+
+# Policies that DATABASE_REPLICA_POLICY can choose from.
+REPLICA_POLICIES = ('round_robin', 'least_loaded')
+
+
+def is_read(clause):
+    '''
+    Whether a statement only reads, and can run on a replica.
+    Raw SQL is taken as a write.
+    '''
+    return (getattr(clause, 'is_select', False) and
+            getattr(clause, '_for_update_arg', None) is None)
+
+
+class ReplicaSet():
+    '''
+    Engines of the replicas of the primary, with metrics of their pools.
+    '''
+
+    def __init__(self, policy='round_robin'):
+        if policy not in REPLICA_POLICIES:
+            raise ValueError(f'Unknown DATABASE_REPLICA_POLICY {policy!r}.')
+        self.policy = policy
+        # [engine, metrics, requests]
+        self.replicas = []
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def add(self, uri, *pool_settings):
+        '''
+        Create the engine of a replica; pool_settings are the arguments
+        of PoolMetrics.engine_options().
+        '''
+        metrics = PoolMetrics()
+        engine = create_engine(uri, **metrics.engine_options(*pool_settings))
+        metrics.watch(engine)
+        self.replicas.append([engine, metrics, 0])
+        return engine
+
+    def engines(self):
+        '''
+        The engines of the replicas.
+        '''
+        return [engine for engine, _, _ in self.replicas]
+
+    def pick(self):
+        '''
+        Choose the replica engine of a request.
+        '''
+        with self._lock:
+            turn = next(self._turn) % len(self.replicas)
+            # starting from this turn, so that equals take turns
+            order = self.replicas[turn:] + self.replicas[:turn]
+            if self.policy == 'least_loaded':
+                replica = min(order,
+                              key=lambda item: item[1].counters['checked_out'])
+            else:
+                replica = order[0]
+            replica[2] += 1
+        return replica[0]
+
+    def stats(self):
+        '''
+        Pool metrics and number of requests of each replica.
+        '''
+        return [dict(metrics.stats(engine.pool),
+                     url=engine.url.render_as_string(hide_password=True),
+                     requests=requests)
+                for engine, metrics, requests in self.replicas]
+
+
+class RoutingSession(Session):
+    '''
+    Session that runs the reads of replica_reads() on a replica, and
+    everything else on its bind, the primary.
+    '''
+
+    def __init__(self, replicas=None, **kwargs):
+        super().__init__(**kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        '''
+        Return the engine that runs a statement: a replica for the reads
+        of replica_reads(), the primary otherwise.
+        '''
+        # pylint: disable=arguments-differ
+        reads = (clause is not None and is_read(clause) and
+                 not self._flushing)
+        if not reads and (clause is not None or self._flushing):
+            # read your own writes from now on
+            self.info['primary'] = True
+        elif (reads and self.replicas and self.info.get('read_only') and
+              not self.info.get('primary')):
+            if self.info.get('replica') is None:
+                self.info['replica'] = self.replicas.pick()
+            return self.info['replica']
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+@contextmanager
+def replica_reads(session):
+    '''
+    Send the reads of session to a replica, unless the request wrote.
+    Also a decorator of handlers.
+    '''
+    session.info['read_only'] = session.info.get('read_only', 0) + 1
+    try:
+        yield
+    finally:
+        session.info['read_only'] -= 1
+
+
+def on_replica(session):
+    '''
+    Whether the reads of session go to a replica right now.
+    '''
+    return (session.info.get('read_only') and
+            session.info.get('replica') is not None and
+            not session.info.get('primary'))
+
+
+def use_primary(session):
+    '''
+    Send every further query of the request to the primary.
+    '''
+    session.info['primary'] = True
+
+
+def first(session, query):
+    '''
+    Return query.first(), looked up again on the primary if a replica
+    does not have the row (yet).
+    '''
+    row = query.first()
+    if row is None and on_replica(session):
+        use_primary(session)
+        row = query.first()
+    return row
+
+
+def end_request(session):
+    '''
+    End the replica's transaction of a request, and forget where the
+    request read from.
+    '''
+    replica = session.info.pop('replica', None)
+    session.info.pop('primary', None)
+    session.info.pop('read_only', None)
+    if replica is not None:
+        session.rollback()
+
+
+class RoutingUserDatastore(SQLAlchemySessionUserDatastore):
+    '''
+    User datastore that looks users up on a replica, and on the primary
+    if the replica does not have them (yet).
+    '''
+
+    def find_user(self, case_insensitive=False, **kwargs):
+        session = self.db.session
+        with replica_reads(session):
+            # find_user() pops the key of case insensitive lookups
+            user = super().find_user(case_insensitive, **dict(kwargs))
+            if user is None and on_replica(session):
+                use_primary(session)
+                user = super().find_user(case_insensitive, **kwargs)
+        return user
+
+
+def init_app(app, session):
+    '''
+    End the replica's transaction of every request.
+    '''
+    app.teardown_request(lambda error: end_request(session))
@@ -0,0 +1,66 @@
+'''
+This file takes care of the migrations of the database schema.
+
+The schema is versioned by alembic, through Flask-Migrate, with the
+revisions in migrations/versions:
+
+    FLASK_APP="app:create_app('prod')" python3 -m flask db upgrade
+    FLASK_APP="app:create_app('dev')" python3 -m flask db migrate -m "..."
+
+init_db() still creates missing tables from the models, so a new
+database, e.g. of the tests, has the schema of the latest revision and
+is stamped with it. A database made by init_db() before migrations has
+tables but no revision; it is stamped with BASELINE_REVISION, the
+schema of the app before its storage features, and `flask db upgrade`
+brings it up to date. The app logs a warning while
+the database is behind.
+'''
+import os
+from functools import lru_cache
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from flask_migrate import Migrate
+
+MIGRATIONS_FOLDER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'migrations')
+
+# Revision of the schema that init_db() made before migrations: the
+# users, their roles and the reports, before the storage features.
+BASELINE_REVISION = '0001'
+
+
+@lru_cache(maxsize=None)
+def scripts():
+    '''
+    The revisions of MIGRATIONS_FOLDER, read once.
+    '''
+    return ScriptDirectory(MIGRATIONS_FOLDER)
+
+
+def stamp(engine, created):
+    '''
+    Record the revision of a database whose tables init_db() just
+    created, or created before migrations existed. Returns the current
+    and the latest revision.
+    '''
+    head = scripts().get_current_head()
+    with engine.begin() as connection:
+        context = MigrationContext.configure(connection)
+        current = context.get_current_revision()
+        if created and current != head:
+            context.stamp(scripts(), head)
+            current = head
+        elif current is None:
+            context.stamp(scripts(), BASELINE_REVISION)
+            current = BASELINE_REVISION
+    return current, head
+
+
+def init_app(app):
+    '''
+    Register the `flask db` commands of the app.
+    '''
+    migrate = Migrate(directory=MIGRATIONS_FOLDER)
+    migrate.init_app(app)
+    return migrate
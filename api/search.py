@@ -0,0 +1,215 @@
+'''
+This file takes care of the full-text search index of reports.
+
+Reports are found by the words of their name, their description and the
+text of their file (see extract_text in api/jobs/tasks.py). Two backends
+implement the same interface:
+    - FulltextIndex: MySQL FULLTEXT indexes on report(name, description)
+      and report_text(content), ranked by MATCH ... AGAINST
+    - InvertedIndex: a search_posting table with one row per term, field
+      and report, ranked by tf-idf; works on any database, e.g. SQLite
+
+The index is kept up to date incrementally, in the transaction of each
+change: handlers call index_fields() after a report is created or its
+name or description changes, and remove() before reports are deleted.
+The file text arrives later, from the extract_text job, through
+store_text().
+
+Every lookup is scoped to the owner of the reports.
+'''
+import re
+from math import log
+from collections import Counter
+from sqlalchemy import func, case, or_
+from sqlalchemy.dialects.mysql import match
+from api.models import Report, ReportText, SearchPosting
+
+# Words are runs of letters and digits; '_' splits them, as report
+# names go through secure_filename.
+WORD = re.compile(r'[^\W_]+')
+# Terms longer than the term column are cut.
+TERM_MAX_LENGTH = 64
+# Query terms beyond this number are ignored.
+QUERY_MAX_TERMS = 16
+
+# Weight of a match in each field of the inverted index.
+FIELD_WEIGHTS = {'name': 3.0, 'description': 2.0, 'text': 1.0}
+# Weight of a name/description match against a text match in MySQL.
+FULLTEXT_META_WEIGHT = 2.0
+
+
+def tokenize(text):
+    '''
+    Split a text into lowercase terms.
+    '''
+    return [word[:TERM_MAX_LENGTH] for word in WORD.findall(text.lower())]
+
+
+def postings(report_id, user_id, field, text):
+    '''
+    Rows of the inverted index for one field of a report.
+    '''
+    return [{'user_id': user_id,
+             'term': term,
+             'report_id': report_id,
+             'field': field,
+             'tf': 1 + log(count)}
+            for term, count in Counter(tokenize(text or '')).items()]
+
+
+class InvertedIndex():
+    '''
+    Search index stored in the search_posting table.
+    '''
+
+    @staticmethod
+    def index_fields(session, reports):
+        '''
+        (Re)index the name and description of reports, given as objects
+        or rows with id, user_id, name and description.
+        '''
+        reports = list(reports)
+        if not reports:
+            return
+        (session.query(SearchPosting).
+         filter(SearchPosting.report_id.in_([r.id for r in reports]),
+                SearchPosting.field.in_(('name', 'description'))).
+         delete(synchronize_session=False))
+        rows = []
+        for report in reports:
+            rows += postings(report.id, report.user_id, 'name', report.name)
+            rows += postings(report.id, report.user_id, 'description',
+                             report.description)
+        session.bulk_insert_mappings(SearchPosting, rows)
+
+    @staticmethod
+    def store_text(session, job, result):
+        '''
+        Result handler of the extract_text job: (re)index the text of
+        the job's report. Returns a summary as the job result.
+        '''
+        (session.query(SearchPosting).
+         filter_by(report_id=job.report_id, field='text').
+         delete(synchronize_session=False))
+        if job.report_id is None or session.get(Report, job.report_id) is None:
+            # the report was deleted before its text arrived
+            return {'characters': 0, 'terms': 0}
+        rows = postings(job.report_id, job.user_id, 'text', result['text'])
+        session.bulk_insert_mappings(SearchPosting, rows)
+        return {'characters': len(result['text']), 'terms': len(rows)}
+
+    @staticmethod
+    def remove(session, report_ids):
+        '''
+        Remove reports from the index.
+        '''
+        (session.query(SearchPosting).
+         filter(SearchPosting.report_id.in_(list(report_ids))).
+         delete(synchronize_session=False))
+
+    @staticmethod
+    def search(session, user_id, query, offset, limit):
+        '''
+        Return (report_id, score) of the best matches of a query among
+        the reports of a user, best first.
+        A report matches when it contains any of the query terms; rarer
+        terms and matches in the name or description weigh more.
+        '''
+        terms = list(dict.fromkeys(tokenize(query)))[:QUERY_MAX_TERMS]
+        if not terms:
+            return []
+        total = (session.query(func.count(Report.id)).
+                 filter(Report.user_id == user_id).
+                 scalar())
+        frequencies = (session.query(
+                           SearchPosting.term,
+                           func.count(SearchPosting.report_id.distinct())).
+                       filter(SearchPosting.user_id == user_id,
+                              SearchPosting.term.in_(terms)).
+                       group_by(SearchPosting.term))
+        idf = {term: log(1 + total / count) for term, count in frequencies}
+        if not idf:
+            return []
+        score = func.sum(
+            SearchPosting.tf *
+            case(FIELD_WEIGHTS, value=SearchPosting.field) *
+            case(idf, value=SearchPosting.term)).label('score')
+        return (session.query(SearchPosting.report_id, score).
+                filter(SearchPosting.user_id == user_id,
+                       SearchPosting.term.in_(list(idf))).
+                group_by(SearchPosting.report_id).
+                order_by(score.desc(), SearchPosting.report_id).
+                offset(offset).
+                limit(limit).
+                all())
+
+
+class FulltextIndex():
+    '''
+    Search index made of MySQL FULLTEXT indexes, see api/models.py.
+    MySQL maintains the index of the name and description itself.
+    '''
+
+    @staticmethod
+    def index_fields(session, reports):
+        '''
+        Nothing to do, the FULLTEXT index of report is kept by MySQL.
+        '''
+
+    @staticmethod
+    def store_text(session, job, result):
+        '''
+        Result handler of the extract_text job: store the text of the
+        job's report. Returns a summary as the job result.
+        '''
+        if job.report_id is None or session.get(Report, job.report_id) is None:
+            # the report was deleted before its text arrived
+            return {'characters': 0}
+        session.merge(ReportText(report_id=job.report_id,
+                                 user_id=job.user_id,
+                                 content=result['text']))
+        return {'characters': len(result['text'])}
+
+    @staticmethod
+    def remove(session, report_ids):
+        '''
+        Remove the text of reports; their rows go with the reports.
+        '''
+        (session.query(ReportText).
+         filter(ReportText.report_id.in_(list(report_ids))).
+         delete(synchronize_session=False))
+
+    @staticmethod
+    def search(session, user_id, query, offset, limit):
+        '''
+        Return (report_id, score) of the best matches of a query among
+        the reports of a user, best first, in natural language mode.
+        '''
+        meta = match(Report.name, Report.description, against=query)
+        text = match(ReportText.content, against=query)
+        score = (meta * FULLTEXT_META_WEIGHT +
+                 func.coalesce(text, 0)).label('score')
+        return (session.query(Report.id, score).
+                outerjoin(ReportText, ReportText.report_id == Report.id).
+                filter(Report.user_id == user_id,
+                       or_(meta > 0, text > 0)).
+                order_by(score.desc(), Report.id).
+                offset(offset).
+                limit(limit).
+                all())
+
+
+def init_app(app, engine):
+    '''
+    Choose the search backend of the app from SEARCH_BACKEND and hook it
+    to the extract_text jobs. Needs the job queue, see api/jobs/queue.py.
+    '''
+    backend = app.config['SEARCH_BACKEND']
+    if backend == 'auto':
+        backend = 'fulltext' if engine.dialect.name == 'mysql' else 'inverted'
+    if backend not in ('fulltext', 'inverted'):
+        raise ValueError(f'Unknown SEARCH_BACKEND {backend!r}.')
+    index = FulltextIndex() if backend == 'fulltext' else InvertedIndex()
+    app.extensions['search'] = index
+    app.extensions['jobs'].on_result('extract_text', index.store_text)
+    return index
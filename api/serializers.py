@@ -0,0 +1,93 @@
+'''
+This file takes care of the precompiled serializers of the hot endpoints.
+
+Marshmallow resolves every field of every object through its field
+classes at dump time. For listing thousands of reports that reflection
+dominates the handler, so compile_serializer() inspects a schema once
+and returns a plain function that turns an object into the same dict:
+    - all attributes are fetched by one operator.attrgetter call
+    - DateTime fields keep the format function of the schema
+    - Related fields are read from their foreign key column, so no
+      related row is loaded
+    - any other field type falls back to the marshmallow field
+
+The serializer accepts ORM objects as well as Row tuples whose columns
+are labelled with the attribute names, e.g. db_session.query(Report.id,
+Report.user_id), which avoids building ORM objects altogether.
+'''
+from functools import lru_cache
+from operator import attrgetter
+from marshmallow import fields as ma_fields
+from marshmallow_sqlalchemy.fields import Related
+from api.models import Report, ReportSchema
+
+# Field types whose dumped value is the attribute value itself.
+PASSTHROUGH_FIELDS = (ma_fields.String, ma_fields.Integer, ma_fields.Boolean)
+
+
+def datetime_converter(field):
+    '''
+    Return the function that a DateTime field formats its values with.
+    '''
+    data_format = field.format or field.DEFAULT_FORMAT
+    format_func = field.SERIALIZATION_FUNCS.get(data_format)
+    if format_func:
+        return format_func
+    return lambda value: value.strftime(data_format)
+
+
+def field_converter(field):
+    '''
+    Return a function that serializes values through a marshmallow field.
+    '''
+    # pylint: disable=protected-access
+    return lambda value: field._serialize(value, None, None)
+
+
+def compile_serializer(schema, model):
+    '''
+    Compile a schema instance of the given model into a function that
+    serializes one object. The returned function has an `attributes`
+    member listing the model attributes it reads.
+    '''
+    relationships = model.__mapper__.relationships
+    keys, attributes, converters = [], [], []
+    for key, field in schema.dump_fields.items():
+        attribute = field.attribute or key
+        converter = None
+        if isinstance(field, Related):
+            # the primary key of the related row is the foreign key
+            (column,) = relationships[attribute].local_columns
+            attribute = model.__mapper__.get_property_by_column(column).key
+        elif isinstance(field, ma_fields.DateTime):
+            converter = datetime_converter(field)
+        elif not isinstance(field, PASSTHROUGH_FIELDS):
+            converter = field_converter(field)
+        keys.append(field.data_key or key)
+        attributes.append(attribute)
+        converters.append(converter)
+
+    converted = [(index, converter)
+                 for index, converter in enumerate(converters) if converter]
+    getter = attrgetter(*attributes)
+    single = len(attributes) == 1
+
+    def serialize(obj):
+        values = getter(obj)
+        values = [values] if single else list(values)
+        for index, converter in converted:
+            if values[index] is not None:
+                values[index] = converter(values[index])
+        return dict(zip(keys, values))
+
+    serialize.attributes = tuple(attributes)
+    return serialize
+
+
+@lru_cache(maxsize=64)
+def report_serializer(only=None):
+    '''
+    Serializer that produces the same output as ReportSchema(only=only).
+    only = tuple of field names, or None for every field
+    '''
+    return compile_serializer(ReportSchema(only=only), Report)
@@ -0,0 +1,73 @@
+'''
+This file takes care of the embedded SQLite backend.
+
+With DATABASE_BACKEND=sqlite (see api/conf/database.py) the reports are
+kept in a file of the instance folder instead of a MySQL server, which
+suits single node installs and the test suite. Every connection is set
+up by PRAGMAs when it is opened:
+    - journal_mode=WAL: readers do not block the writer, nor the writer
+      the readers, and a commit appends to the log instead of rewriting
+      pages
+    - synchronous=NORMAL: with WAL, a commit is durable once the log is
+      checkpointed, and the database can never be corrupted
+    - mmap_size and cache_size: pages are read through a memory map and
+      cached per connection
+    - busy_timeout: a writer waits this many milliseconds for the write
+      lock of another connection before "database is locked"
+    - foreign_keys=ON: references are enforced like InnoDB does
+
+SQLite allows one writer at a time, so it is for one node with a few
+worker threads. The connections are pooled like MySQL's, with
+DATABASE_POOL_*, and shared across threads, one thread at a time.
+'''
+from sqlalchemy import event
+
+# PRAGMAs run on every new connection, in this order; journal_mode is
+# kept by the database file, the others by the connection.
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout',
+                  'foreign_keys', 'mmap_size', 'cache_size', 'temp_store')
+
+
+def sqlite_uri(path):
+    '''
+    SQLAlchemy URL of a database file.
+    '''
+    return 'sqlite:///' + path
+
+
+def engine_options(busy_timeout):
+    '''
+    create_engine() arguments of a database file, on top of those of
+    the pool. busy_timeout is in milliseconds.
+    '''
+    # pooled connections move between the threads of the worker
+    return {'connect_args': {'check_same_thread': False,
+                             'timeout': busy_timeout / 1000}}
+
+
+def watch(engine, pragmas):
+    '''
+    Set the PRAGMAs of every connection of an engine, given as a dict of
+    name: value.
+    '''
+    statements = [f'PRAGMA {name}={pragmas[name]}'
+                  for name in SQLITE_PRAGMAS if name in pragmas]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # pylint: disable=unused-argument
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def pragmas_of(connection):
+    '''
+    Current value of every PRAGMA of a connection, e.g. to check them.
+    '''
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            for name in SQLITE_PRAGMAS}
@@ -0,0 +1,92 @@
+'''
+This file takes care of downloading many reports as one ZIP archive.
+
+The archive is built while it is sent: each file is read from its
+storage backend in UPLOAD_CHUNK_SIZE blocks and written to a
+zipfile.ZipFile whose output is an ArchiveSink, which only collects the
+bytes until the generator hands them on to the WSGI server. Nothing is
+written to a temporary file and only about one block at a time is held
+in memory.
+
+As the output cannot seek, every entry is written with a data descriptor
+after its data, which all unzip tools read. Files whose type is already
+compressed (see INCOMPRESSIBLE_EXTENSIONS in codec.py) are stored as
+they are; the others are deflated at the default zlib level. Files that
+are compressed at rest are decompressed first, as a ZIP entry needs the
+CRC of the original bytes.
+'''
+import zipfile
+from datetime import datetime
+from api.storage.codec import INCOMPRESSIBLE_EXTENSIONS, open_stored
+
+# Oldest timestamp a ZIP entry can hold.
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+
+class ArchiveSink():
+    '''
+    Write-only, unseekable file object that collects the output of a
+    ZipFile until it is drained.
+    '''
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        '''
+        Collect a chunk of the archive.
+        '''
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        '''
+        Nothing to flush, the chunks are drained by the generator.
+        '''
+
+    def drain(self):
+        '''
+        Return the chunks collected since the last call.
+        '''
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def compress_type(file_name):
+    '''
+    ZIP compression method of a file, from its extension.
+    '''
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_archive(entries, chunk_size):
+    '''
+    Yield the bytes of a ZIP archive of files.
+    input:
+        entries = iterable of
+            (name, storage, stored_name, encoding, size, modified):
+            the name in the archive, the storage backend and name of the
+            stored file with its codec, the size of the original content
+            and its datetime
+        chunk_size = size of the blocks that files are read in
+    '''
+    sink = ArchiveSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for name, storage, stored_name, encoding, size, modified in entries:
+            info = zipfile.ZipInfo(
+                name, max(modified or ZIP_EPOCH, ZIP_EPOCH).timetuple()[:6])
+            info.compress_type = compress_type(name)
+            # lets zipfile choose ZIP64 for files over 2 GiB
+            info.file_size = size or 0
+            with open_stored(storage.open(stored_name), encoding) as source, \
+                    archive.open(info, 'w') as target:
+                chunk = source.read(chunk_size)
+                while chunk:
+                    target.write(chunk)
+                    yield from sink.drain()
+                    chunk = source.read(chunk_size)
+            yield from sink.drain()
+    yield from sink.drain()
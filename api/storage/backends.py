@@ -0,0 +1,422 @@
+'''
+This file takes care of where the blobs are stored.
+
+The blob store (see blobstore.py) names every file, e.g. '9f/86/9f86...',
+and keeps it in the storage backend of the app, STORAGE_BACKEND:
+    - 'local': LocalStorage, files below UPLOAD_FOLDER. Only one node can
+      serve them, unless UPLOAD_FOLDER is a shared filesystem.
+    - 's3': S3Storage, objects in an S3-compatible bucket (AWS S3, MinIO,
+      Ceph...), shared by every node. Needs the optional boto3 package.
+    - 'memory': MemoryStorage, in the worker process, for tests.
+
+Every backend has the same interface:
+    exists(name), size(name), delete(name)
+    put(name, upload)   store a finished UploadStream and consume it
+    open(name)          binary file object of the stored bytes, which
+                        reads lazily and supports seek()
+    local_path(name)    path of the file on this node, or None
+    local_copy(name)    context manager that yields a local path
+    iter_objects()      (name, size, mtime) of every stored object, for
+                        the garbage collector of the remote backends
+Uploads are still received into a temporary file in UPLOAD_FOLDER, which
+is scratch space on each node, and put into the backend once complete.
+
+The S3 client is created once per app and shared by every thread, so
+its pool of HTTP connections (S3_MAX_POOL_CONNECTIONS) is reused across
+requests. Files over S3_MULTIPART_THRESHOLD are uploaded in parts of
+S3_MULTIPART_CHUNK_SIZE, S3_MAX_CONCURRENCY parts at a time, and reads
+stream the object body, with a ranged GET after every seek().
+'''
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = TransferConfig = Config = None
+
+    class ClientError(Exception):
+        '''
+        Stands in for the error of botocore, so that clients that mimic
+        it can be used without boto3.
+        '''
+
+        def __init__(self, error_response, operation_name):
+            super().__init__(error_response['Error'].get('Message', ''))
+            self.response = error_response
+            self.operation_name = operation_name
+
+# Error codes of S3 for a key that does not exist.
+S3_MISSING_CODES = {'404', 'NoSuchKey', 'NotFound'}
+
+# Most keys listed by one ListObjectsV2 request.
+S3_LIST_BATCH = 1000
+
+
+class Storage():
+    '''
+    Base class of the storage backends.
+    local is True when the stored files are files of this node.
+    '''
+    local = False
+
+    def local_path(self, name):
+        '''
+        Path of a stored file on this node, or None.
+        '''
+        del name
+
+    @contextmanager
+    def local_copy(self, name):
+        '''
+        Yield the path of a temporary local copy of a stored file, which
+        is removed afterwards.
+        '''
+        with tempfile.NamedTemporaryFile(prefix='.copy-') as copy:
+            with self.open(name) as source:
+                shutil.copyfileobj(source, copy)
+            copy.flush()
+            yield copy.name
+
+
+class LocalStorage(Storage):
+    '''
+    Files below a directory of this node.
+    '''
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, name):
+        '''
+        Absolute path of a stored file.
+        '''
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def local_copy(self, name):
+        '''
+        The stored file is local already.
+        '''
+        yield self.local_path(name)
+
+    def exists(self, name):
+        '''
+        Whether a file is stored under name.
+        '''
+        return os.path.exists(self.local_path(name))
+
+    def size(self, name):
+        '''
+        Size of a stored file.
+        '''
+        return os.stat(self.local_path(name)).st_size
+
+    def put(self, name, upload):
+        '''
+        Move a finished UploadStream into place, which is a rename.
+        '''
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        upload.commit(path)
+
+    def open(self, name):
+        '''
+        Open a stored file for reading.
+        '''
+        # pylint: disable=consider-using-with
+        return open(self.local_path(name), 'rb')
+
+    def delete(self, name):
+        '''
+        Remove a stored file, if it exists.
+        '''
+        try:
+            os.remove(self.local_path(name))
+        except FileNotFoundError:
+            pass
+
+
+class MemoryStorage(Storage):
+    '''
+    Files held in memory by the worker process.
+    '''
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def exists(self, name):
+        '''
+        Whether a file is stored under name.
+        '''
+        return name in self._objects
+
+    def size(self, name):
+        '''
+        Size of a stored file.
+        '''
+        return len(self._data(name))
+
+    def put(self, name, upload):
+        '''
+        Read a finished UploadStream into memory and discard it.
+        '''
+        upload.finish()
+        with open(upload.name, 'rb') as file:
+            data = file.read()
+        upload.close()
+        with self._lock:
+            self._objects[name] = (data, time.time())
+
+    def open(self, name):
+        '''
+        Open a stored file for reading.
+        '''
+        return io.BytesIO(self._data(name))
+
+    def delete(self, name):
+        '''
+        Remove a stored file, if it exists.
+        '''
+        with self._lock:
+            self._objects.pop(name, None)
+
+    def iter_objects(self):
+        '''
+        Yield (name, size, mtime) of every stored file.
+        '''
+        with self._lock:
+            objects = list(self._objects.items())
+        for name, (data, mtime) in objects:
+            yield name, len(data), mtime
+
+    def _data(self, name):
+        try:
+            return self._objects[name][0]
+        except KeyError as error:
+            raise FileNotFoundError(name) from error
+
+
+def s3_missing(error):
+    '''
+    Whether a ClientError means that the key does not exist.
+    '''
+    return error.response.get('Error', {}).get('Code') in S3_MISSING_CODES
+
+
+class S3Object(io.RawIOBase):
+    '''
+    Readable file object of an S3 object.
+    The body is streamed by one GET, from the current position to the
+    end; seek() only moves the position, and the next read() starts a
+    ranged GET from there.
+    '''
+
+    def __init__(self, client, bucket, key):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self._position = 0
+        self._length = None
+        self._body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size()
+        if offset < 0:
+            raise ValueError('Negative seek position.')
+        if offset != self._position:
+            self._close_body()
+            self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        if self._body is None and not self._open_body():
+            return 0
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+    def _size(self):
+        if self._length is None:
+            try:
+                self._length = self.client.head_object(
+                    Bucket=self.bucket, Key=self.key)['ContentLength']
+            except ClientError as error:
+                if s3_missing(error):
+                    raise FileNotFoundError(self.key) from error
+                raise
+        return self._length
+
+    def _open_body(self):
+        '''
+        GET the object from the current position; False past the end.
+        '''
+        arguments = {'Bucket': self.bucket, 'Key': self.key}
+        if self._position:
+            arguments['Range'] = f'bytes={self._position}-'
+        try:
+            self._body = self.client.get_object(**arguments)['Body']
+        except ClientError as error:
+            if s3_missing(error):
+                raise FileNotFoundError(self.key) from error
+            if error.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return False
+            raise
+        return True
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+
+class S3Storage(Storage):
+    '''
+    Objects below a key prefix of an S3 bucket.
+    input:
+        client = boto3 S3 client, or any client with the same methods
+        bucket = name of the bucket
+        prefix = prefix of the keys, e.g. 'reports/'
+        transfer = boto3 TransferConfig of the uploads
+    '''
+
+    def __init__(self, client, bucket, prefix='', transfer=None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.transfer = transfer
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Create the client and the storage from the S3_* settings.
+        The credentials are found by boto3 as usual, e.g. in
+        AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY.
+        '''
+        if boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND=s3 needs the boto3 package.')
+        client = boto3.session.Session().client(
+            's3',
+            endpoint_url=config['S3_ENDPOINT_URL'] or None,
+            region_name=config['S3_REGION'] or None,
+            config=Config(
+                max_pool_connections=config['S3_MAX_POOL_CONNECTIONS'],
+                retries={'mode': 'standard'}))
+        transfer = TransferConfig(
+            multipart_threshold=config['S3_MULTIPART_THRESHOLD'],
+            multipart_chunksize=config['S3_MULTIPART_CHUNK_SIZE'],
+            max_concurrency=config['S3_MAX_CONCURRENCY'])
+        return cls(client, config['S3_BUCKET'], config['S3_PREFIX'],
+                   transfer)
+
+    def key(self, name):
+        '''
+        Key of a stored file.
+        '''
+        return self.prefix + name.replace(os.sep, '/')
+
+    def exists(self, name):
+        '''
+        Whether an object is stored under name.
+        '''
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as error:
+            if s3_missing(error):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        '''
+        Size of a stored object.
+        '''
+        with self.open(name) as file:
+            return file.seek(0, io.SEEK_END)
+
+    def put(self, name, upload):
+        '''
+        Upload a finished UploadStream, in parts if it is large, and
+        discard it.
+        '''
+        upload.finish()
+        try:
+            arguments = {} if self.transfer is None else \
+                {'Config': self.transfer}
+            self.client.upload_file(upload.name, self.bucket, self.key(name),
+                                    **arguments)
+        finally:
+            upload.close()
+
+    def open(self, name):
+        '''
+        Open a stored object for reading.
+        '''
+        return S3Object(self.client, self.bucket, self.key(name))
+
+    def delete(self, name):
+        '''
+        Remove a stored object, if it exists.
+        '''
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def iter_objects(self):
+        '''
+        Yield (name, size, mtime) of every object below the prefix.
+        '''
+        arguments = {'Bucket': self.bucket, 'Prefix': self.prefix,
+                     'MaxKeys': S3_LIST_BATCH}
+        while True:
+            page = self.client.list_objects_v2(**arguments)
+            for item in page.get('Contents', ()):
+                yield (item['Key'][len(self.prefix):].replace('/', os.sep),
+                       item['Size'],
+                       item['LastModified'].timestamp())
+            if not page.get('IsTruncated'):
+                return
+            arguments['ContinuationToken'] = page['NextContinuationToken']
+
+
+def init_app(app):
+    '''
+    Create the storage backend of the app from its STORAGE_BACKEND.
+    '''
+    backend = app.config['STORAGE_BACKEND']
+    if backend == 'local':
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+    elif backend == 'memory':
+        storage = MemoryStorage()
+    elif backend == 's3':
+        storage = S3Storage.from_config(app.config)
+    else:
+        raise ValueError(f'Unknown STORAGE_BACKEND {backend!r}.')
+    app.extensions['storage'] = storage
+    return storage
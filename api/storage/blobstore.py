@@ -0,0 +1,225 @@
+'''
+This file takes care of the content-addressed blob store.
+
+Every uploaded file is stored once, under the SHA-256 digest of its
+content, and fanned out into prefix subdirectories:
+
+    9f/86/9f86d081884c7d659a2feaa0c55ad015...
+
+The files are kept by the storage backend of the app, below
+UPLOAD_FOLDER by default, see backends.py.
+
+A Blob row keeps the number of reports that point at the file.
+Handlers call acquire() when a report starts pointing at an upload and
+release() when it stops (acquire_many() and release_many() for a batch
+of reports), inside the same transaction as the report change.
+A file is deleted, and dropped from the hot file cache, only after the
+transaction that dropped its last reference has been committed.
+'''
+import os
+from collections import Counter
+from flask import current_app
+from sqlalchemy import event, case
+from sqlalchemy.exc import IntegrityError
+from api.conf.database import db_session
+from api.models import Blob
+from api.storage import hot, derivatives
+
+# Number of two-character prefix directories above each blob.
+FANOUT_LEVELS = 2
+
+
+def blob_name(sha256):
+    '''
+    Name of a blob in the storage backend, e.g. '9f/86/9f86d08...',
+    which is also its path relative to UPLOAD_FOLDER.
+    '''
+    prefixes = [sha256[i * 2:i * 2 + 2] for i in range(FANOUT_LEVELS)]
+    return os.path.join(*prefixes, sha256)
+
+
+def blob_path(sha256):
+    '''
+    Absolute path of a blob in UPLOAD_FOLDER, where the local backend
+    stores it.
+    '''
+    return os.path.join(current_app.config['UPLOAD_FOLDER'],
+                        blob_name(sha256))
+
+
+def add_reference(sha256):
+    '''
+    Add a reference to an existing blob; returns whether it exists.
+    '''
+    return (db_session.query(Blob).
+            filter_by(sha256=sha256).
+            update({Blob.ref_count: Blob.ref_count + 1},
+                   synchronize_session=False))
+
+
+def acquire(upload):
+    '''
+    Add a reference to the blob holding the content of an UploadStream
+    and return its digest.
+    The file is moved into the store if the content is new; otherwise
+    the upload is discarded and the existing blob is shared.
+    '''
+    storage = current_app.extensions['storage']
+    sha256 = upload.sha256
+    name = blob_name(sha256)
+    upload.finish()
+    updated = add_reference(sha256)
+    if not updated:
+        try:
+            with db_session.begin_nested():
+                db_session.add(Blob(sha256=sha256,
+                                    size=upload.size,
+                                    mime_type=upload.mime_type,
+                                    encoding=upload.encoding,
+                                    stored_size=upload.stored_size,
+                                    ref_count=1))
+        except IntegrityError:
+            # a concurrent upload of the same content created it first
+            updated = add_reference(sha256)
+    if updated:
+        if storage.exists(name):
+            upload.close()
+            return sha256
+        # the file has gone missing, this upload takes its place
+        hot.evict(name)
+        (db_session.query(Blob).
+         filter_by(sha256=sha256).
+         update({Blob.encoding: upload.encoding,
+                 Blob.stored_size: upload.stored_size},
+                synchronize_session=False))
+    storage.put(name, upload)
+    return sha256
+
+
+def acquire_many(uploads):
+    '''
+    Add one reference per UploadStream, with one SELECT, one INSERT and
+    one UPDATE for the whole batch, and return the digests in order.
+    Uploads that repeat content already in the store, or earlier in the
+    batch, are discarded.
+    '''
+    storage = current_app.extensions['storage']
+    counts = Counter(upload.sha256 for upload in uploads)
+    existing = {sha256 for (sha256,) in
+                db_session.query(Blob.sha256).
+                filter(Blob.sha256.in_(list(counts)))}
+    new_blobs, placed = [], set()
+    for upload in uploads:
+        name = blob_name(upload.sha256)
+        if upload.sha256 in placed or (upload.sha256 in existing and
+                                       storage.exists(name)):
+            upload.close()
+            continue
+        upload.finish()
+        if upload.sha256 in existing:
+            # the file has gone missing, this upload takes its place
+            hot.evict(name)
+            (db_session.query(Blob).
+             filter_by(sha256=upload.sha256).
+             update({Blob.encoding: upload.encoding,
+                     Blob.stored_size: upload.stored_size},
+                    synchronize_session=False))
+        else:
+            new_blobs.append({'sha256': upload.sha256,
+                              'size': upload.size,
+                              'mime_type': upload.mime_type,
+                              'encoding': upload.encoding,
+                              'stored_size': upload.stored_size,
+                              'ref_count': counts[upload.sha256]})
+        placed.add(upload.sha256)
+        storage.put(name, upload)
+    if new_blobs:
+        db_session.bulk_insert_mappings(Blob, new_blobs)
+    increments = {sha256: count for sha256, count in counts.items()
+                  if sha256 in existing}
+    if increments:
+        (db_session.query(Blob).
+         filter(Blob.sha256.in_(list(increments))).
+         update({Blob.ref_count: Blob.ref_count +
+                 case(increments, value=Blob.sha256)},
+                synchronize_session=False))
+    return [upload.sha256 for upload in uploads]
+
+
+def release(sha256):
+    '''
+    Drop a reference to a blob.
+    When it was the last one, the row is deleted and the file is
+    scheduled for removal once the session commits.
+    Reports that pointed at the blob must be changed before this call.
+    '''
+    release_many([sha256])
+
+
+def release_many(sha256s):
+    '''
+    Drop one reference per digest, repeats included, with one UPDATE for
+    the whole batch. Blobs left without references are deleted, and
+    their files and image derivatives removed together once the session
+    commits.
+    '''
+    counts = Counter(sha256 for sha256 in sha256s if sha256 is not None)
+    if not counts:
+        return
+    # write the report changes first so the blob rows are no longer
+    # referenced when they get deleted
+    db_session.flush()
+    (db_session.query(Blob).
+     filter(Blob.sha256.in_(list(counts))).
+     update({Blob.ref_count: Blob.ref_count -
+             case(counts, value=Blob.sha256)},
+            synchronize_session=False))
+    emptied = dict(db_session.query(Blob.sha256, Blob.mime_type).
+                   filter(Blob.sha256.in_(list(counts)),
+                          Blob.ref_count <= 0))
+    if emptied:
+        (db_session.query(Blob).
+         filter(Blob.sha256.in_(list(emptied))).
+         delete(synchronize_session=False))
+        for sha256, mime_type in emptied.items():
+            delete_after_commit(blob_name(sha256))
+            for name in derivatives.derivative_names(blob_name(sha256),
+                                                     mime_type):
+                delete_after_commit(name)
+
+
+def unlink_after_commit(path):
+    '''
+    Schedule a local file to be removed once the current transaction
+    commits. Nothing is removed if it rolls back.
+    '''
+    db_session.info.setdefault('unlink', set()).add(path)
+
+
+def delete_after_commit(name):
+    '''
+    Schedule a file of the storage backend to be deleted once the
+    current transaction commits. Nothing is deleted if it rolls back.
+    '''
+    db_session.info.setdefault('delete', set()).add(name)
+
+
+@event.listens_for(db_session, 'after_commit')
+def _unlink_files(session):
+    for path in session.info.pop('unlink', ()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    names = session.info.pop('delete', ())
+    if names:
+        storage = current_app.extensions['storage']
+        for name in names:
+            storage.delete(name)
+            hot.evict(name)
+
+
+@event.listens_for(db_session, 'after_rollback')
+def _keep_files(session):
+    session.info.pop('unlink', None)
+    session.info.pop('delete', None)
@@ -0,0 +1,299 @@
+'''
+This file takes care of compressing stored files.
+
+With STORAGE_CODEC set, report files are compressed while the upload
+streams in, unless their type is already compressed (see
+INCOMPRESSIBLE_EXTENSIONS). The codec names are HTTP content-codings,
+so a stored file can be sent as it is with `Content-Encoding: <codec>`
+to clients that accept it:
+    - 'gzip': zlib from the standard library
+    - 'zstd': needs the optional zstandard package
+The digest, size and MIME type of a blob always describe the original
+content; Blob.encoding and Blob.stored_size describe the file on disk.
+
+Every FRAME_SIZE bytes of content are compressed into an independent
+frame (a gzip member or a zstd frame), and the file ends with a seek
+table of the stored and original size of each frame. A stored file is
+still a valid stream of its codec, but seek() only decompresses from the
+frame that holds the position, so a range request of a large file does
+not decompress it from the start. The layout of the table is that of
+the zstd seekable format:
+    entries (stored size, original size: 4 bytes each) of every frame,
+    the number of frames (4 bytes), a descriptor byte (0), SEEKABLE_MAGIC
+in a skippable frame for zstd, and in the extra field of an empty last
+member for gzip. Files without a table, e.g. stored by older versions,
+are decompressed from the start to seek.
+'''
+import io
+import os
+import gzip
+import zlib
+import struct
+from bisect import bisect_right
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Codecs that files can be stored with.
+CODECS = ('gzip', 'zstd')
+
+# Compression level of each codec; the defaults of the libraries.
+CODEC_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# File types that are compressed already and are always stored as is.
+INCOMPRESSIBLE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Bytes of content compressed into each frame, the seek granularity.
+FRAME_SIZE = 1024 * 1024
+
+# Magic number that ends the seek table, and the table footer.
+SEEKABLE_MAGIC = 0x8F92EAB1
+TABLE_FOOTER = struct.Struct('<IBI')
+TABLE_ENTRY = struct.Struct('<II')
+
+# Skippable frame of zstd that holds the seek table.
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+
+# Header of the last gzip member, with the table as its extra field
+# (FEXTRA); its subfield is 'ST'. The member has no content.
+GZIP_TABLE_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'
+GZIP_TABLE_SUBFIELD = b'ST'
+# Empty deflate block, CRC32 and size of the empty content.
+GZIP_TABLE_END = b'\x03\x00' + bytes(8)
+# Frames that fit in the 64 KiB extra field of a gzip member.
+GZIP_MAX_FRAMES = (0xFFFF - 4 - TABLE_FOOTER.size) // TABLE_ENTRY.size
+
+
+def codec_for(codec, filename):
+    '''
+    Return the codec to store a file with, or None to store it as is.
+    input:
+        codec = the configured STORAGE_CODEC, '' for none
+        filename = name of the uploaded file
+    '''
+    if not codec:
+        return None
+    if codec not in CODECS:
+        raise ValueError(f'Unknown STORAGE_CODEC {codec!r}.')
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return None
+    return codec
+
+
+def _zstandard():
+    if zstandard is None:
+        raise RuntimeError('STORAGE_CODEC=zstd needs the zstandard package.')
+    return zstandard
+
+
+def _frame_compressor(codec):
+    if codec == 'gzip':
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(CODEC_LEVELS['gzip'], zlib.DEFLATED, 31)
+    return _zstandard().ZstdCompressor(
+        level=CODEC_LEVELS['zstd']).compressobj()
+
+
+def seek_table(codec, frames):
+    '''
+    Return the end of a stored file: the seek table of its frames, given
+    as (stored size, original size) pairs.
+    '''
+    data = b''.join(TABLE_ENTRY.pack(*frame) for frame in frames)
+    data += TABLE_FOOTER.pack(len(frames), 0, SEEKABLE_MAGIC)
+    if codec == 'gzip':
+        subfield = (GZIP_TABLE_SUBFIELD + struct.pack('<H', len(data)) +
+                    data)
+        return (GZIP_TABLE_HEADER + struct.pack('<H', len(subfield)) +
+                subfield + GZIP_TABLE_END)
+    return struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(data)) + data
+
+
+class FrameCompressor():
+    '''
+    Compresses a file into independent frames of FRAME_SIZE bytes of
+    content, followed by their seek table.
+    '''
+
+    def __init__(self, codec, frame_size=None):
+        self.codec = codec
+        self.frame_size = frame_size or FRAME_SIZE
+        self.frames = []
+        self._frame = None
+        self._stored = 0
+        self._original = 0
+
+    def compress(self, data):
+        '''
+        Return the compressed bytes of the next chunk of the content.
+        '''
+        output = []
+        view = memoryview(data)
+        while view:
+            if self._frame is None:
+                self._frame = _frame_compressor(self.codec)
+            part = view[:self.frame_size - self._original]
+            view = view[len(part):]
+            output.append(self._frame.compress(part))
+            self._stored += len(output[-1])
+            self._original += len(part)
+            if self._original == self.frame_size:
+                output.append(self._end_frame())
+        return b''.join(output)
+
+    def flush(self):
+        '''
+        Return the end of the last frame and the seek table.
+        '''
+        end = self._end_frame() if self._frame is not None else b''
+        if self.codec == 'gzip' and len(self.frames) > GZIP_MAX_FRAMES:
+            # too many frames for one gzip member: seek() decompresses
+            # from the start
+            return end
+        return end + seek_table(self.codec, self.frames)
+
+    def _end_frame(self):
+        end = self._frame.flush()
+        self.frames.append((self._stored + len(end), self._original))
+        self._frame, self._stored, self._original = None, 0, 0
+        return end
+
+
+def compressor(codec):
+    '''
+    Return an object whose compress(data) and flush() methods return
+    the compressed stream of a file.
+    '''
+    return FrameCompressor(codec)
+
+
+def read_seek_table(file, codec):
+    '''
+    Return the (stored offset, original offset, stored size, original
+    size) of each frame of a stored file, or None when it has no seek
+    table. The file must be seekable.
+    '''
+    end = file.seek(0, io.SEEK_END)
+    suffix = GZIP_TABLE_END if codec == 'gzip' else b''
+    tail_size = TABLE_FOOTER.size + len(suffix)
+    if end < tail_size:
+        return None
+    file.seek(end - tail_size)
+    tail = _read_exactly(file, tail_size)
+    count, _, magic = TABLE_FOOTER.unpack_from(tail)
+    if magic != SEEKABLE_MAGIC or not tail.endswith(suffix):
+        return None
+    size = count * TABLE_ENTRY.size
+    if size > end - tail_size:
+        return None
+    file.seek(end - tail_size - size)
+    data = _read_exactly(file, size)
+    frames, stored, original = [], 0, 0
+    for stored_size, original_size in TABLE_ENTRY.iter_unpack(data):
+        frames.append((stored, original, stored_size, original_size))
+        stored += stored_size
+        original += original_size
+    return frames
+
+
+def _read_exactly(file, size):
+    chunks = []
+    while size > 0:
+        chunk = file.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class FrameReader(io.RawIOBase):
+    '''
+    Readable and seekable content of a stored file with a seek table;
+    only the frame that holds the position is decompressed.
+    '''
+
+    def __init__(self, file, codec, frames):
+        super().__init__()
+        self.file = file
+        self.codec = codec
+        self.frames = frames
+        self.size = (frames[-1][1] + frames[-1][3]) if frames else 0
+        self._starts = [frame[1] for frame in frames]
+        self._position = 0
+        self._index = None
+        self._data = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('Negative seek position.')
+        self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        index = bisect_right(self._starts, self._position) - 1
+        if index != self._index:
+            self._data = self._decompress(self.frames[index])
+            self._index = index
+        start = self._position - self.frames[index][1]
+        data = self._data[start:start + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _decompress(self, frame):
+        stored_offset, _, stored_size, original_size = frame
+        self.file.seek(stored_offset)
+        data = _read_exactly(self.file, stored_size)
+        if self.codec == 'gzip':
+            return zlib.decompress(data, 31)
+        return _zstandard().ZstdDecompressor().decompress(
+            data, max_output_size=original_size)
+
+
+@contextmanager
+def open_stored(file, codec=None):
+    '''
+    Open a stored file for reading its original content, given its path
+    or a binary file object, which is closed afterwards.
+    seek() is supported in every codec; with a seek table it only
+    decompresses the frame of the new position.
+    '''
+    if isinstance(file, (str, os.PathLike)):
+        file = open(file, 'rb')  # pylint: disable=consider-using-with
+    stream = file
+    try:
+        frames = None
+        if codec is not None and file.seekable():
+            frames = read_seek_table(file, codec)
+            file.seek(0)
+        if frames is not None:
+            stream = io.BufferedReader(FrameReader(file, codec, frames))
+        elif codec == 'gzip':
+            stream = gzip.GzipFile(fileobj=file, mode='rb')
+        elif codec is not None:
+            stream = _zstandard().open(file, 'rb')
+        yield stream
+    finally:
+        if stream is not file:
+            stream.close()
+        file.close()
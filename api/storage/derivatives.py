@@ -0,0 +1,232 @@
+'''
+This file takes care of resized copies of image reports.
+
+Dashboards only need a preview of an image report, not the full file.
+GET /api/v1/report/derivative/<report_id>/<size> sends a copy of a PNG,
+JPEG or GIF report that fits in a square of one of DERIVATIVE_SIZES,
+e.g. 'thumbnail:128,preview:512'. The aspect ratio is kept, images are
+never enlarged, and a GIF becomes a PNG of its first frame.
+
+Derivatives are files of the storage backend, next to the blobs:
+
+    .derivatives/9f/86/9f86d081884c7d659a2feaa0c55ad015...-128.png
+
+so they are keyed by the content of their source and by their size, and
+are generated once for every report sharing the blob. They are made on
+the first request, or, with DERIVATIVE_PREGENERATE, in the background
+once an upload commits. The blob store deletes them with their blob.
+
+Generation needs the optional Pillow package, and at most
+DERIVATIVE_MAX_CONCURRENCY images are resized at a time, so a burst of
+requests cannot take every CPU. A request that waits DERIVATIVE_WAIT
+seconds for a free slot gets 503 and can retry.
+'''
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import event
+from api.conf.database import db_session
+from api.storage.codec import open_stored
+from api.storage.stream import UploadStream
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+# Directory of the storage backend that holds the derivatives.
+DERIVATIVE_FOLDER = '.derivatives'
+
+# Pillow format, file extension and MIME type of the derivatives of each
+# image type.
+DERIVATIVE_FORMATS = {
+    'image/png': ('PNG', 'png', 'image/png'),
+    'image/jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'image/gif': ('PNG', 'png', 'image/png'),
+}
+
+# Quality of JPEG derivatives.
+JPEG_QUALITY = 85
+
+
+def parse_sizes(value):
+    '''
+    Parse DERIVATIVE_SIZES, e.g. 'thumbnail:128,preview:512', into
+    {'thumbnail': 128, 'preview': 512}.
+    '''
+    sizes = {}
+    for item in value.split(','):
+        if item.strip():
+            name, edge = item.split(':')
+            sizes[name.strip()] = int(edge)
+    return sizes
+
+
+def derivative_name(blob, edge, extension):
+    '''
+    Name of the derivative of a blob, given by its name, that fits in a
+    square of edge pixels.
+    '''
+    return os.path.join(DERIVATIVE_FOLDER, f'{blob}-{edge}.{extension}')
+
+
+def derivative_names(blob, mime_type):
+    '''
+    Names of the derivatives of every configured size of a blob.
+    '''
+    if mime_type not in DERIVATIVE_FORMATS:
+        return []
+    extension = DERIVATIVE_FORMATS[mime_type][1]
+    return [derivative_name(blob, edge, extension) for edge in
+            parse_sizes(current_app.config['DERIVATIVE_SIZES']).values()]
+
+
+def source_name(name):
+    '''
+    Name of the blob that a derivative was made from, or None if name is
+    not a derivative.
+    '''
+    prefix = DERIVATIVE_FOLDER + os.sep
+    if not name.startswith(prefix) or '-' not in name:
+        return None
+    return name[len(prefix):].rsplit('-', 1)[0]
+
+
+def render(data, edge, image_format):
+    '''
+    Return the bytes of an image resized to fit in a square of edge
+    pixels, in image_format.
+    '''
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG decoders can scale down while decoding
+        image.draft('RGB', (edge, edge))
+        image.thumbnail((edge, edge))
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        if image_format == 'JPEG':
+            image.save(output, image_format, quality=JPEG_QUALITY,
+                       optimize=True)
+        else:
+            image.save(output, image_format, optimize=True)
+    return output.getvalue()
+
+
+class DerivativeGenerator():
+    '''
+    Makes derivatives, at most max_concurrency at a time, in requests
+    and in a background pool of as many threads.
+    '''
+
+    def __init__(self, scratch, max_concurrency=2, wait=10.0):
+        self.scratch = scratch
+        self.wait = wait
+        self.generated = 0
+        self.rejected = 0
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_concurrency,
+                                        thread_name_prefix='derivative')
+
+    def ensure(self, storage, blob, encoding, mime_type, edge, timeout=None):
+        '''
+        Make the derivative of a blob unless it exists, and return its
+        name. Returns None if no slot got free within timeout seconds;
+        None waits as long as it takes.
+        '''
+        image_format, extension, _ = DERIVATIVE_FORMATS[mime_type]
+        name = derivative_name(blob, edge, extension)
+        if storage.exists(name):
+            return name
+        if not self._slots.acquire(timeout=timeout):
+            self.rejected += 1
+            return None
+        try:
+            if storage.exists(name):
+                # made by another request meanwhile
+                return name
+            with open_stored(storage.open(blob), encoding) as file:
+                data = render(file.read(), edge, image_format)
+            upload = UploadStream(self.scratch)
+            try:
+                upload.write(data)
+                storage.put(name, upload)
+            except Exception:
+                upload.close()
+                raise
+            self.generated += 1
+            return name
+        finally:
+            self._slots.release()
+
+    def pregenerate(self, storage, blob, encoding, mime_type, edges):
+        '''
+        Make the derivatives of every edge in the background.
+        '''
+        self._pool.submit(self._pregenerate, storage, blob, encoding,
+                          mime_type, edges)
+
+    def stats(self):
+        '''
+        Number of derivatives made, requests turned away and failures.
+        '''
+        return {'generated': self.generated,
+                'rejected': self.rejected,
+                'failed': self.failed}
+
+    def shutdown(self):
+        '''
+        Wait for the derivatives being made in the background.
+        '''
+        self._pool.shutdown()
+
+    def _pregenerate(self, storage, blob, encoding, mime_type, edges):
+        for edge in edges:
+            try:
+                self.ensure(storage, blob, encoding, mime_type, edge)
+            except Exception:  # pylint: disable=broad-except
+                # e.g. a corrupt image, made again on request
+                self.failed += 1
+
+
+def pregenerate(blob, encoding, mime_type):
+    '''
+    Make the derivatives of a blob in the background once the current
+    transaction commits, if DERIVATIVE_PREGENERATE is set and the blob
+    is an image.
+    '''
+    if (mime_type in DERIVATIVE_FORMATS and Image is not None and
+            current_app.config['DERIVATIVE_PREGENERATE']):
+        db_session.info.setdefault('derivatives', {})[blob] = (encoding,
+                                                               mime_type)
+
+
+@event.listens_for(db_session, 'after_commit')
+def _pregenerate_derivatives(session):
+    blobs = session.info.pop('derivatives', None)
+    if blobs:
+        generator = current_app.extensions['derivatives']
+        storage = current_app.extensions['storage']
+        edges = parse_sizes(current_app.config['DERIVATIVE_SIZES']).values()
+        for blob, (encoding, mime_type) in blobs.items():
+            generator.pregenerate(storage, blob, encoding, mime_type,
+                                  list(edges))
+
+
+@event.listens_for(db_session, 'after_rollback')
+def _drop_derivatives(session):
+    session.info.pop('derivatives', None)
+
+
+def init_app(app):
+    '''
+    Create the derivative generator of the app from its DERIVATIVE_*
+    settings.
+    '''
+    generator = DerivativeGenerator(app.config['UPLOAD_FOLDER'],
+                                    app.config['DERIVATIVE_MAX_CONCURRENCY'],
+                                    app.config['DERIVATIVE_WAIT'])
+    app.extensions['derivatives'] = generator
+    return generator
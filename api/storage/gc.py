@@ -0,0 +1,238 @@
+'''
+This file takes care of collecting orphaned files in UPLOAD_FOLDER.
+
+Files are unlinked after the commit that drops their last reference
+(see blobstore.py), but some are still left behind: a worker that dies
+between the commit and the unlink, an upload interrupted before its
+temporary file was closed, partial files of resumable uploads whose
+session is gone, derivatives of images whose blob is gone, and files of
+reports from before the blob store.
+
+collect() removes them in two passes:
+    1. the names still referenced are read from the database through
+       server-side cursors: the blobs, the files of reports from
+       before the blob store, and the partial files of live sessions
+    2. UPLOAD_FOLDER is walked with os.scandir, one worker per top level
+       directory, and every file that is not referenced and has not
+       been modified for the grace period is removed; directories left
+       empty are removed too
+With a remote storage backend (see backends.py), its objects are swept
+too: those that are not referenced and are older than the grace period
+are deleted.
+The references are read before the walk, so a file added meanwhile is
+new, and the grace period keeps it. Dot files other than the temporary
+files of uploads, e.g. .gitkeep, are never touched.
+
+Run it from the command line, once or every N seconds:
+    flask gc-files --dry-run
+    flask gc-files --every 3600
+'''
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import click
+from sqlalchemy.orm import Session
+from api.models import Blob, Report, UploadSession
+from api.storage.blobstore import blob_name
+from api.storage.resumable import PARTIAL_FOLDER
+from api.storage.derivatives import DERIVATIVE_FOLDER, source_name
+
+# Number of rows fetched at a time from the server-side cursors.
+GC_FETCH_BATCH = 10000
+
+# Prefix of the temporary files of uploads, see stream.py.
+TEMPORARY_PREFIX = '.upload-'
+
+
+def referenced_names(engine):
+    '''
+    Return the set of paths, relative to UPLOAD_FOLDER, that are still
+    referenced by the database.
+    '''
+    names = set()
+    with Session(engine) as session:
+        for (sha256,) in (session.query(Blob.sha256).
+                          yield_per(GC_FETCH_BATCH)):
+            names.add(blob_name(sha256))
+        for sha256, file_name in (session.query(Report.blob_sha256,
+                                                Report.file_name).
+                                  yield_per(GC_FETCH_BATCH)):
+            # reports from before the blob store point at their file
+            names.add(file_name if sha256 is None else blob_name(sha256))
+        for (upload_id,) in (session.query(UploadSession.id).
+                             yield_per(GC_FETCH_BATCH)):
+            names.add(os.path.join(PARTIAL_FOLDER, upload_id))
+    return names
+
+
+def collectable(name):
+    '''
+    Whether a top level entry of UPLOAD_FOLDER is managed by the app.
+    '''
+    return (not name.startswith('.') or
+            name in (PARTIAL_FOLDER, DERIVATIVE_FOLDER) or
+            name.startswith(TEMPORARY_PREFIX))
+
+
+def is_referenced(name, referenced):
+    '''
+    Whether a file is referenced, or is a derivative of a referenced
+    blob.
+    '''
+    return name in referenced or source_name(name) in referenced
+
+
+def remove_orphan(stats, orphans, name, path, status, dry_run):
+    '''
+    Count an orphaned file, and remove it unless in a dry run.
+    '''
+    stats['orphans'] += 1
+    stats['orphan_bytes'] += status.st_size
+    orphans.append((name, status.st_size))
+    if dry_run:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    except OSError:
+        stats['errors'] += 1
+        return
+    stats['removed'] += 1
+    stats['removed_bytes'] += status.st_size
+
+
+def sweep(folder, top, referenced, before, dry_run):
+    '''
+    Remove the orphans of a top level entry of folder, a file or a
+    directory tree, given as a DirEntry. Returns the statistics and the
+    list of (name, size) of the orphans.
+    '''
+    stats, orphans = Counter(), []
+    if top.is_dir(follow_symlinks=False):
+        files, directories, pending = [], [], [top.name]
+    else:
+        files = [(top.name, top.path, top.stat(follow_symlinks=False))]
+        directories, pending = [], []
+    while pending:
+        directory = pending.pop()
+        directories.append(os.path.join(folder, directory))
+        with os.scandir(os.path.join(folder, directory)) as scan:
+            for entry in scan:
+                name = os.path.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((name, entry.path,
+                                  entry.stat(follow_symlinks=False)))
+    for name, file_path, status in files:
+        stats['scanned'] += 1
+        stats['scanned_bytes'] += status.st_size
+        if not is_referenced(name, referenced) and status.st_mtime < before:
+            remove_orphan(stats, orphans, name, file_path, status, dry_run)
+    if not dry_run:
+        # deepest first, so emptied parents go too
+        for directory in reversed(directories):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                continue
+            stats['removed_directories'] += 1
+    return stats, orphans
+
+
+def sweep_objects(storage, referenced, before, dry_run):
+    '''
+    Delete the objects of a remote storage backend that are not
+    referenced and older than before. Returns the statistics and the
+    list of (name, size) of the orphans.
+    '''
+    stats, orphans = Counter(), []
+    for name, size, mtime in storage.iter_objects():
+        stats['scanned'] += 1
+        stats['scanned_bytes'] += size
+        if is_referenced(name, referenced) or mtime >= before:
+            continue
+        stats['orphans'] += 1
+        stats['orphan_bytes'] += size
+        orphans.append((name, size))
+        if dry_run:
+            continue
+        try:
+            storage.delete(name)
+        except Exception:  # pylint: disable=broad-except
+            stats['errors'] += 1
+            continue
+        stats['removed'] += 1
+        stats['removed_bytes'] += size
+    return stats, orphans
+
+
+def collect(engine, folder, grace_period, workers, dry_run=False,
+            storage=None):
+    '''
+    Remove the files of folder, and the objects of a remote storage
+    backend, that are not referenced and are older than grace_period
+    seconds, and return the statistics and the list of (name, size) of
+    the orphans. Nothing is removed in a dry run.
+    '''
+    started = time.monotonic()
+    before = time.time() - grace_period
+    referenced = referenced_names(engine)
+    with os.scandir(folder) as scan:
+        # symbolic links are left alone
+        tops = [entry for entry in scan if collectable(entry.name) and
+                (entry.is_dir(follow_symlinks=False) or
+                 entry.is_file(follow_symlinks=False))]
+    stats, orphans = Counter(), []
+    with ThreadPoolExecutor(workers) as pool:
+        for top_stats, top_orphans in pool.map(
+                lambda top: sweep(folder, top, referenced, before, dry_run),
+                tops):
+            stats.update(top_stats)
+            orphans += top_orphans
+    if storage is not None and not storage.local:
+        storage_stats, storage_orphans = sweep_objects(
+            storage, referenced, before, dry_run)
+        stats.update(storage_stats)
+        orphans += storage_orphans
+    stats['referenced'] = len(referenced)
+    seconds = time.monotonic() - started
+    stats = dict(stats, seconds=round(seconds, 3),
+                 files_per_second=round(stats['scanned'] / seconds, 1)
+                 if seconds else 0.0)
+    return stats, sorted(orphans)
+
+
+def init_app(app, engine):
+    '''
+    Register the gc-files command of the app.
+    '''
+    @app.cli.command('gc-files')
+    @click.option('--dry-run', is_flag=True,
+                  help='List the orphans without removing them.')
+    @click.option('--every', type=float, default=0,
+                  help='Run again every this many seconds.')
+    @click.option('--grace-period', type=float,
+                  default=lambda: app.config['GC_GRACE_PERIOD'],
+                  help='Keep files modified this many seconds ago.')
+    @click.option('--workers', type=int,
+                  default=lambda: app.config['GC_WORKERS'],
+                  help='Number of parallel workers.')
+    def gc_files(dry_run, every, grace_period, workers):
+        '''
+        Remove the stored files that no report uses.
+        '''
+        while True:
+            stats, orphans = collect(engine, app.config['UPLOAD_FOLDER'],
+                                     grace_period, workers, dry_run,
+                                     app.extensions['storage'])
+            if dry_run:
+                for name, size in orphans:
+                    click.echo(f'would remove {name} ({size} bytes)')
+            click.echo(' '.join(f'{key}={value}'
+                                for key, value in sorted(stats.items())))
+            if not every:
+                return
+            time.sleep(every)
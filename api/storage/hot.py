@@ -0,0 +1,138 @@
+'''
+This file takes care of the in-process cache of frequently downloaded
+files.
+
+A few reports, e.g. monthly summaries, get most of the downloads, and
+every download re-reads their file from the storage backend, which is
+slow on a network filesystem or S3. With HOT_CACHE_MAX_BYTES set, the
+stored bytes of downloaded files up to HOT_CACHE_MAX_FILE_SIZE are kept
+in memory, evicting by HOT_CACHE_POLICY once the total exceeds
+HOT_CACHE_MAX_BYTES:
+    - 'lru': the least recently downloaded file
+    - 'lfu': the least downloaded file, the least recent among equals
+Files are keyed by their blob name, i.e. by the hash of their content,
+so a cached file never goes stale: a report whose file is replaced
+points at another blob. The blob store evicts a file once its blob is
+deleted, after the UpdateFile or Delete that dropped its last reference
+commits.
+
+A whole file is sent as the cached bytes object itself, and a byte
+range as one copy of a memoryview slice, as WSGI servers only accept
+bytes. stats() returns the hits, misses and bytes of the worker.
+'''
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+# Eviction policies that HOT_CACHE_POLICY can choose from.
+HOT_CACHE_POLICIES = ('lru', 'lfu')
+
+
+class HotFileCache():
+    '''
+    Stored bytes of files by name, bounded by their total size.
+    '''
+
+    def __init__(self, max_bytes, max_file_size, policy='lru'):
+        if policy not in HOT_CACHE_POLICIES:
+            raise ValueError(f'Unknown HOT_CACHE_POLICY {policy!r}.')
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.policy = policy
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self.bytes_loaded = 0
+        # name: [data, downloads], least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def fetch(self, storage, name, size):
+        '''
+        Return the stored bytes of a file, read from storage on a miss,
+        or None if the file is larger than HOT_CACHE_MAX_FILE_SIZE.
+        size is the size of the stored file.
+        '''
+        if size > self.max_file_size or size > self.max_bytes:
+            return None
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry[1] += 1
+                self._entries.move_to_end(name)
+                self.hits += 1
+                self.bytes_served += len(entry[0])
+                return entry[0]
+            self.misses += 1
+        # read outside the lock; a concurrent miss reads the file again
+        with storage.open(name) as file:
+            data = file.read()
+        with self._lock:
+            self.bytes_loaded += len(data)
+            if name not in self._entries:
+                self._entries[name] = [data, 1]
+                self.bytes += len(data)
+                self._evict()
+        return data
+
+    def evict(self, name):
+        '''
+        Drop a file from the cache.
+        '''
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.bytes -= len(entry[0])
+
+    def stats(self):
+        '''
+        Hit and miss counts and byte metrics of this worker.
+        '''
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'bytes_served': self.bytes_served,
+                'bytes_loaded': self.bytes_loaded}
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            if self.policy == 'lru':
+                name = next(iter(self._entries))
+            else:
+                # a few large files fill the cache, so a scan is cheap
+                name = min(self._entries,
+                           key=lambda key: self._entries[key][1])
+            data, _ = self._entries.pop(name)
+            self.bytes -= len(data)
+            self.evictions += 1
+
+
+def evict(name):
+    '''
+    Drop a stored file from the hot file cache of the app, if any.
+    '''
+    cache = current_app.extensions.get('hot_files')
+    if cache is not None:
+        cache.evict(name)
+
+
+def init_app(app):
+    '''
+    Create the hot file cache of the app from its HOT_CACHE_* settings;
+    there is none when HOT_CACHE_MAX_BYTES is 0.
+    '''
+    if not app.config['HOT_CACHE_MAX_BYTES']:
+        app.extensions['hot_files'] = None
+        return None
+    cache = HotFileCache(app.config['HOT_CACHE_MAX_BYTES'],
+                         app.config['HOT_CACHE_MAX_FILE_SIZE'],
+                         app.config['HOT_CACHE_POLICY'])
+    app.extensions['hot_files'] = cache
+    return cache
@@ -0,0 +1,123 @@
+'''
+This file takes care of resumable uploads.
+
+A large file can be sent in any number of requests, following the core
+of the tus protocol (https://tus.io/protocols/resumable-upload):
+    1. POST creates an UploadSession with the name, the description, the
+       file name and the length of the file
+    2. PATCH appends a chunk at Upload-Offset, which must be the number
+       of bytes received so far; HEAD returns that number, so a client
+       that lost its connection asks for it and carries on from there
+    3. POST .../finalize turns the complete file into a report
+
+The bytes are appended to a partial file in the PARTIAL_FOLDER of
+UPLOAD_FOLDER, named after the session, and its size is the committed
+offset: a chunk cut short by a dropped connection still counts for the
+bytes that made it to disk. Writers take an exclusive lock on the file,
+so two requests never append at the same time.
+
+Sessions that stay idle for UPLOAD_SESSION_TTL seconds expire. Expired
+sessions and their partial files are removed by collect_expired(), which
+runs whenever a session is created.
+'''
+import os
+import fcntl
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.exceptions import Conflict, RequestEntityTooLarge
+from api.conf.database import db_session
+from api.models import UploadSession
+from api.storage.blobstore import unlink_after_commit
+
+# Directory below UPLOAD_FOLDER that holds the partial files.
+PARTIAL_FOLDER = '.partial'
+
+# Most expired sessions removed at a time.
+COLLECT_BATCH = 100
+
+
+def partial_path(upload_id):
+    '''
+    Absolute path of the partial file of a session.
+    '''
+    return os.path.join(current_app.config['UPLOAD_FOLDER'],
+                        PARTIAL_FOLDER, upload_id)
+
+
+def expiry():
+    '''
+    Expiry time of a session that is used now.
+    '''
+    return datetime.now() + timedelta(
+        seconds=current_app.config['UPLOAD_SESSION_TTL'])
+
+
+def create_partial(upload_id):
+    '''
+    Create the empty partial file of a new session.
+    '''
+    path = partial_path(upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'xb'):
+        pass
+
+
+def committed_offset(upload_id):
+    '''
+    Number of bytes of a session that have been written to disk.
+    '''
+    try:
+        return os.stat(partial_path(upload_id)).st_size
+    except FileNotFoundError:
+        return 0
+
+
+def append(upload_id, offset, stream, length):
+    '''
+    Append the bytes of a stream to the partial file of a session and
+    return the new offset.
+    Raises Conflict if offset is not the committed offset or another
+    request is writing, and RequestEntityTooLarge once the file would
+    grow past length. The bytes written before an error are kept.
+    '''
+    chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
+    with open(partial_path(upload_id), 'r+b') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as error:
+            raise Conflict('Another request is writing.') from error
+        try:
+            if file.seek(0, os.SEEK_END) != offset:
+                raise Conflict('Offset mismatch.')
+            remaining = length - offset
+            chunk = stream.read(min(chunk_size, remaining + 1))
+            while chunk:
+                if len(chunk) > remaining:
+                    file.write(chunk[:remaining])
+                    raise RequestEntityTooLarge()
+                file.write(chunk)
+                remaining -= len(chunk)
+                chunk = stream.read(min(chunk_size, remaining + 1))
+            return file.tell()
+        finally:
+            # the offset reported to the client must survive a crash
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def collect_expired(now=None):
+    '''
+    Remove up to COLLECT_BATCH expired sessions from the current
+    transaction; their partial files are removed after commit.
+    '''
+    expired = [upload_id for (upload_id,) in
+               db_session.query(UploadSession.id).
+               filter(UploadSession.expires_at < (now or datetime.now())).
+               limit(COLLECT_BATCH)]
+    if not expired:
+        return
+    (db_session.query(UploadSession).
+     filter(UploadSession.id.in_(expired)).
+     delete(synchronize_session=False))
+    for upload_id in expired:
+        unlink_after_commit(partial_path(upload_id))
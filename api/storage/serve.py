@@ -0,0 +1,283 @@
+'''
+This file takes care of serving stored files over HTTP.
+
+send_stored_file() builds the download response of a stored file with:
+    - a strong ETag, derived from the content hash of the blob
+    - Last-Modified, and 304 answers to If-None-Match/If-Modified-Since
+    - byte ranges: 206 for one range, multipart/byteranges for several,
+      416 when none of them can be satisfied, If-Range honoured
+    - the Cache-Control policy of the report
+    - compressed files (see codec.py) sent as they are with
+      Content-Encoding to clients that accept the codec, and decompressed
+      on the fly for the others. Each representation has its own ETag.
+The body is streamed from the storage backend in UPLOAD_CHUNK_SIZE
+blocks, or sent from memory when the file is in the hot file cache (see
+hot.py), or, when DOWNLOAD_OFFLOAD is set and the file is on local disk,
+left to the front web server:
+    - 'x-sendfile': Apache (mod_xsendfile) and lighttpd read the file
+      named by the X-Sendfile header
+    - 'x-accel-redirect': nginx serves DOWNLOAD_ACCEL_PREFIX + the path
+      below UPLOAD_FOLDER from an internal location
+In both modes the worker only checks the report and answers 304s; the
+web server sends the bytes and handles byte ranges. Compressed files are
+offloaded only as they are and only with 'x-sendfile', as nginx drops
+the Content-Encoding header of an X-Accel-Redirect response.
+'''
+import io
+import os
+import secrets
+from urllib.parse import quote
+from datetime import timezone
+from flask import request, current_app
+from werkzeug.datastructures import Headers
+from werkzeug.http import (http_date,
+                           quote_etag,
+                           is_resource_modified,
+                           parse_if_range_header)
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+from api.storage.codec import open_stored
+
+# Cache-Control policies that a report can choose from.
+# Downloads are private to their owner, so a shared cache may only
+# store them keyed by the credentials, see CACHE_VARY.
+CACHE_POLICIES = {
+    'no-store': 'no-store',
+    'private': 'private, no-cache',
+    'public': 'public, max-age={max_age}',
+}
+CACHE_VARY = 'Authentication-Token, Cookie'
+
+# A request with more ranges than this gets the whole file instead.
+MAX_RANGES = 16
+
+# Response header that hands the file to the web server, per offload mode.
+OFFLOAD_HEADERS = {
+    'x-sendfile': 'X-Sendfile',
+    'x-accel-redirect': 'X-Accel-Redirect',
+}
+
+
+def cache_control(policy):
+    '''
+    Cache-Control header value of a policy in CACHE_POLICIES.
+    '''
+    return CACHE_POLICIES[policy].format(
+        max_age=current_app.config['DOWNLOAD_MAX_AGE'])
+
+
+def http_datetime(value):
+    '''
+    Convert a naive local datetime, as stored in the database, to UTC
+    without microseconds, as it round-trips through an HTTP date.
+    '''
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def requested_ranges(size, etag, last_modified):
+    '''
+    Return the satisfiable byte ranges of the request as a sorted list
+    of merged (start, stop) tuples, stop being exclusive.
+    None means the whole file should be sent, an empty list that no
+    range can be satisfied.
+    '''
+    rng = request.range
+    if rng is None or rng.units != 'bytes':
+        return None
+    if_range = parse_if_range_header(request.headers.get('If-Range'))
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and (last_modified is None or
+                                      last_modified > if_range.date):
+        return None
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def iter_file(storage, name, ranges, chunk_size, encoding=None, data=None):
+    '''
+    Yield the bytes of the given ranges of a stored file in chunks,
+    decompressed when an encoding is given. The ranges must be in
+    ascending order. data is the stored file from the hot file cache.
+    '''
+    if data is not None and encoding is None:
+        view = memoryview(data)
+        for start, stop in ranges:
+            yield view[start:stop].tobytes()
+        return
+    source = storage.open(name) if data is None else io.BytesIO(data)
+    with open_stored(source, encoding) as file:
+        for start, stop in ranges:
+            file.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = file.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def offload_target(mode, path):
+    '''
+    Value of the offload header that makes the web server send a file.
+    '''
+    if mode == 'x-accel-redirect':
+        name = os.path.relpath(path, current_app.config['UPLOAD_FOLDER'])
+        return (current_app.config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') +
+                '/' + quote(name.replace(os.sep, '/')))
+    return path
+
+
+def byteranges_delimiters(ranges, size, mimetype, boundary):
+    '''
+    Return the part headers and the closing delimiter of a
+    multipart/byteranges body.
+    '''
+    heads = [(f'\r\n--{boundary}\r\n'
+              f'Content-Type: {mimetype}\r\n'
+              f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n'
+              f'\r\n').encode('ascii')
+             for start, stop in ranges]
+    return heads, f'\r\n--{boundary}--\r\n'.encode('ascii')
+
+
+def iter_byteranges(storage, name, ranges, heads, tail, chunk_size,
+                    encoding=None, data=None):
+    '''
+    Yield a multipart/byteranges body.
+    '''
+    for head, (start, stop) in zip(heads, ranges):
+        yield head
+        yield from iter_file(storage, name, [(start, stop)], chunk_size,
+                             encoding, data)
+    yield tail
+
+
+def send_stored_file(storage, name, etag, download_name, mimetype,
+                     last_modified=None, policy='private',
+                     encoding=None, size=None, stored_size=None):
+    '''
+    Build the response that sends a stored file as an attachment.
+    input:
+        storage, name = storage backend and name of the file
+        etag = strong validator of the content, e.g. its sha256
+        download_name = file name offered to the client
+        mimetype = Content-Type of the file
+        last_modified = naive local datetime of the last change
+        policy = key of CACHE_POLICIES
+        encoding = codec the file is compressed with, if any
+        size = size of the decompressed content, needed with encoding
+        stored_size = size of the stored file, looked up if not given
+    '''
+    chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
+    passthrough = (encoding is not None and
+                   request.accept_encodings[encoding] > 0)
+    if encoding is None or passthrough:
+        # the stored bytes are the bytes sent
+        if stored_size is None:
+            stored_size = storage.size(name)
+        size, decode = stored_size, None
+    else:
+        decode = encoding
+    if passthrough:
+        etag = f'{etag}-{encoding}'
+    if last_modified is not None:
+        last_modified = http_datetime(last_modified)
+
+    headers = Headers()
+    headers['ETag'] = quote_etag(etag)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Cache-Control'] = cache_control(policy)
+    vary = [CACHE_VARY] if policy == 'public' else []
+    if encoding is not None:
+        vary.append('Accept-Encoding')
+    if vary:
+        headers['Vary'] = ', '.join(vary)
+    if passthrough:
+        headers['Content-Encoding'] = encoding
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    headers.set('Content-Disposition', 'attachment', filename=download_name)
+
+    if not is_resource_modified(request.environ,
+                                etag=etag,
+                                last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    offload = current_app.config['DOWNLOAD_OFFLOAD']
+    path = storage.local_path(name)
+    if offload and path is not None and (
+            encoding is None or (passthrough and offload == 'x-sendfile')):
+        headers[OFFLOAD_HEADERS[offload]] = offload_target(offload, path)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    hot = current_app.extensions.get('hot_files')
+    data = None
+    if hot is not None:
+        if stored_size is None:
+            stored_size = storage.size(name)
+        data = hot.fetch(storage, name, stored_size)
+
+    ranges = requested_ranges(size, etag, last_modified)
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        if decode is not None:
+            body = iter_file(storage, name, [(0, size)], chunk_size, decode,
+                             data)
+        elif data is not None:
+            body = [data]
+        else:
+            # the WSGI server closes the file once the body is sent
+            body = wrap_file(request.environ, storage.open(name), chunk_size)
+        return Response(body, 200, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(iter_file(storage, name, ranges, chunk_size, decode,
+                                  data),
+                        206, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+
+    boundary = secrets.token_hex(16)
+    heads, tail = byteranges_delimiters(ranges, size, mimetype, boundary)
+    headers['Content-Length'] = str(
+        sum(len(head) for head in heads) + len(tail)
+        + sum(stop - start for start, stop in ranges))
+    return Response(iter_byteranges(storage, name, ranges, heads, tail,
+                                    chunk_size, decode, data),
+                    206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
+
+
+def init_app(app):
+    '''
+    Check the DOWNLOAD_OFFLOAD mode of the app.
+    '''
+    offload = app.config['DOWNLOAD_OFFLOAD']
+    if offload and offload not in OFFLOAD_HEADERS:
+        raise ValueError(f'Unknown DOWNLOAD_OFFLOAD {offload!r}.')
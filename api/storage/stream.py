@@ -0,0 +1,196 @@
+'''
+This file takes care of the streaming upload pipeline.
+
+Werkzeug normally spools each uploaded file into a temporary file (or
+memory) and the handler then copies it again with `file.save()`.
+Here the multipart parser writes every chunk of the body straight into
+the upload folder instead, and in the same pass:
+    - computes the SHA-256 digest of the file
+    - counts the bytes, aborting with 413 once UPLOAD_MAX_SIZE is crossed
+    - keeps the first bytes to sniff the MIME type from
+    - compresses the data when STORAGE_CODEC is set, see codec.py
+
+The finished file is then only renamed into place, see blobstore.py.
+'''
+import os
+import hashlib
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from api.storage.codec import codec_for, compressor
+
+# Number of leading bytes kept for MIME type sniffing.
+SNIFF_LENGTH = 512
+
+# Permission bits of stored files. Temporary files are created 0600.
+FILE_MODE = 0o644
+
+# Signatures of the binary file types that can be uploaded.
+MAGIC_NUMBERS = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def sniff_mime(head):
+    '''
+    Guess the MIME type from the leading bytes of a file.
+    Falls back to text/plain for NUL-free UTF-8 data, and to
+    application/octet-stream for anything else.
+    '''
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if b'\x00' in head:
+        return 'application/octet-stream'
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # the head may end in the middle of a multi-byte character
+        if error.end != len(head) or len(head) < SNIFF_LENGTH:
+            return 'application/octet-stream'
+    return 'text/plain'
+
+
+class UploadStream():
+    '''
+    Writable file object that the multipart parser streams one uploaded
+    file into. The data goes to a hidden temporary file inside the
+    upload folder, so committing it is a rename on the same filesystem.
+
+    The temporary file is removed when the stream is closed without
+    being committed, e.g. when the upload turns out to be invalid.
+    Flask closes every uploaded file at the end of the request.
+
+    With a codec the file is written compressed; size, sha256 and
+    mime_type still describe the uploaded bytes.
+    '''
+
+    def __init__(self, directory, max_size=None, encoding=None):
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=directory,
+                                                 prefix='.upload-',
+                                                 delete=False)
+        self.name = self._file.name
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self.committed = False
+        self.encoding = encoding
+        self._hash = hashlib.sha256()
+        self._compressor = compressor(encoding) if encoding else None
+
+    def __getattr__(self, name):
+        # read(), readline(), seek() and tell() of the temporary file
+        return getattr(self._file, name)
+
+    def write(self, data):
+        '''
+        Write a chunk, updating the digest, the size and the sniff buffer.
+        '''
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            # the parser drops the stream, so nobody else will close it
+            self.close()
+            raise RequestEntityTooLarge()
+        if len(self.head) < SNIFF_LENGTH:
+            self.head += data[:SNIFF_LENGTH - len(self.head)]
+        self._hash.update(data)
+        if self._compressor is not None:
+            self._file.write(self._compressor.compress(data))
+            return len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        '''
+        Hex digest of the bytes written so far.
+        '''
+        return self._hash.hexdigest()
+
+    @property
+    def mime_type(self):
+        '''
+        MIME type sniffed from the leading bytes.
+        '''
+        return sniff_mime(self.head)
+
+    @property
+    def stored_size(self):
+        '''
+        Size of the file on disk, known once it has been finished.
+        '''
+        return os.stat(self.name).st_size
+
+    def finish(self):
+        '''
+        Write the end of the compressed stream, if any.
+        '''
+        if self._compressor is not None:
+            # the parser rewinds the file after the last chunk
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+        self._file.flush()
+
+    def commit(self, path):
+        '''
+        Move the finished file to its final path.
+        '''
+        self.finish()
+        self._file.close()
+        os.chmod(self.name, FILE_MODE)
+        os.replace(self.name, path)
+        self.committed = True
+
+    def close(self):
+        '''
+        Close the file and remove it unless it has been committed.
+        '''
+        self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+
+class StreamingRequest(Request):
+    '''
+    Request class that parses uploaded files into UploadStream objects.
+    '''
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return UploadStream(current_app.config['UPLOAD_FOLDER'],
+                            current_app.config['UPLOAD_MAX_SIZE'],
+                            codec_for(current_app.config['STORAGE_CODEC'],
+                                      filename))
+
+
+def upload_stream(file):
+    '''
+    Return the UploadStream of an uploaded FileStorage, which holds the
+    sha256, size and mime_type of the file.
+    Files that were not parsed by StreamingRequest are copied through
+    an UploadStream chunk by chunk, so the same checks apply to them.
+    '''
+    if isinstance(file.stream, UploadStream):
+        return file.stream
+    stream = UploadStream(current_app.config['UPLOAD_FOLDER'],
+                          current_app.config['UPLOAD_MAX_SIZE'],
+                          codec_for(current_app.config['STORAGE_CODEC'],
+                                    file.filename))
+    chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
+    try:
+        chunk = file.stream.read(chunk_size)
+        while chunk:
+            stream.write(chunk)
+            chunk = file.stream.read(chunk_size)
+    except Exception:
+        stream.close()
+        raise
+    return stream
@@ -0,0 +1,197 @@
+'''
+This file takes care of the storage usage and quota of users.
+
+The number of reports and the bytes of each user are kept in the
+user_usage table, so reading them or enforcing a quota never scans
+the report table. Handlers call charge() in the transaction of every
+change, before the change is flushed:
+    - a new report:        charge(user_id, 1, size)
+    - a replaced file:     charge(user_id, 0, new_size - old_size)
+    - deleted reports:     charge(user_id, -count, -total_size)
+An increase is one conditional UPDATE that only matches while the user
+stays within USAGE_MAX_REPORTS and USAGE_MAX_BYTES, so two concurrent
+uploads can never take a user past the quota together.
+
+The row of a user is created by their first change, from their existing
+reports. rebuild() recomputes every row from the report table, e.g.
+after the column was added or after a manual change of the data:
+    flask rebuild-usage --workers 8
+'''
+import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from api.conf.database import db_session
+from api.models import User, Report, Blob, UserUsage
+
+# Number of users recomputed by one worker at a time.
+REBUILD_BATCH = 1000
+
+
+class QuotaExceeded(Exception):
+    '''
+    Raised when a change would take a user past their quota.
+    '''
+
+
+def totals(session, user_ids):
+    '''
+    Return {user_id: (report_count, bytes)} computed from the reports.
+    '''
+    return {user_id: (count, int(size)) for user_id, count, size in
+            session.query(Report.user_id,
+                          func.count(Report.id),
+                          func.coalesce(func.sum(Report.size), 0)).
+            filter(Report.user_id.in_(list(user_ids))).
+            group_by(Report.user_id)}
+
+
+def within_quota(report_count, size):
+    '''
+    Whether a user with this many reports and bytes is within the quota.
+    '''
+    max_reports = current_app.config['USAGE_MAX_REPORTS']
+    max_bytes = current_app.config['USAGE_MAX_BYTES']
+    return ((not max_reports or report_count <= max_reports) and
+            (not max_bytes or size <= max_bytes))
+
+
+def charge(user_id, reports, size):
+    '''
+    Add reports and bytes, negative to remove them, to the usage of a
+    user in the current transaction.
+    Raises QuotaExceeded if an increase would take the user past the
+    quota; nothing is changed then.
+    '''
+    if not reports and not size:
+        return
+    criteria = [UserUsage.user_id == user_id]
+    max_reports = current_app.config['USAGE_MAX_REPORTS']
+    max_bytes = current_app.config['USAGE_MAX_BYTES']
+    if reports > 0 and max_reports:
+        criteria.append(UserUsage.report_count + reports <= max_reports)
+    if size > 0 and max_bytes:
+        criteria.append(UserUsage.bytes + size <= max_bytes)
+    updated = (db_session.query(UserUsage).
+               filter(*criteria).
+               update({UserUsage.report_count:
+                       UserUsage.report_count + reports,
+                       UserUsage.bytes: UserUsage.bytes + size},
+                      synchronize_session=False))
+    if updated:
+        return
+    if db_session.get(UserUsage, user_id) is not None:
+        raise QuotaExceeded()
+    # first change of the user, start from their existing reports
+    count, used = totals(db_session, [user_id]).get(user_id, (0, 0))
+    if (reports > 0 or size > 0) and not within_quota(count + reports,
+                                                      used + size):
+        raise QuotaExceeded()
+    try:
+        with db_session.begin_nested():
+            db_session.add(UserUsage(user_id=user_id,
+                                     report_count=count + reports,
+                                     bytes=used + size))
+    except IntegrityError:
+        # a concurrent request created the row first
+        charge(user_id, reports, size)
+
+
+def usage(user_id):
+    '''
+    Return (report_count, bytes) of a user.
+    '''
+    row = db_session.get(UserUsage, user_id)
+    if row is None:
+        return totals(db_session, [user_id]).get(user_id, (0, 0))
+    return row.report_count, row.bytes
+
+
+def rebuild_range(engine, upload_folder, bounds):
+    '''
+    Recompute the usage of the users whose id is within bounds, in one
+    transaction, and return their number.
+    The usage rows are locked first, so changes committed meanwhile
+    wait and are applied on top of the new totals. Rows that are wrong
+    are updated in place and missing ones are inserted.
+    '''
+    first, last = bounds
+    with Session(engine) as session:
+        in_range = Report.user_id.between(first, last)
+        # sizes of reports stored before the column existed
+        (session.query(Report).
+         filter(in_range, Report.size.is_(None),
+                Report.blob_sha256.isnot(None)).
+         update({Report.size: select(Blob.size).
+                 where(Blob.sha256 == Report.blob_sha256).
+                 scalar_subquery()},
+                synchronize_session=False))
+        for report_id, file_name in (session.query(Report.id,
+                                                   Report.file_name).
+                                     filter(in_range,
+                                            Report.size.is_(None))):
+            # reports uploaded before the blob store
+            path = os.path.join(upload_folder, file_name)
+            size = os.path.getsize(path) if os.path.isfile(path) else 0
+            (session.query(Report).
+             filter_by(id=report_id).
+             update({Report.size: size}, synchronize_session=False))
+        current = {user_id: (count, size) for user_id, count, size in
+                   session.query(UserUsage.user_id,
+                                 UserUsage.report_count,
+                                 UserUsage.bytes).
+                   filter(UserUsage.user_id.between(first, last)).
+                   with_for_update()}
+        user_ids = [user_id for (user_id,) in
+                    session.query(User.id).
+                    filter(User.id.between(first, last))]
+        computed = totals(session, user_ids)
+        rows = [{'user_id': user_id,
+                 'report_count': computed.get(user_id, (0, 0))[0],
+                 'bytes': computed.get(user_id, (0, 0))[1]}
+                for user_id in user_ids]
+        # only the rows that are wrong are written
+        session.bulk_update_mappings(UserUsage, [
+            row for row in rows if row['user_id'] in current and
+            current[row['user_id']] != (row['report_count'], row['bytes'])])
+        session.bulk_insert_mappings(UserUsage, [
+            row for row in rows if row['user_id'] not in current])
+        session.commit()
+        return len(user_ids)
+
+
+def rebuild(engine, upload_folder, workers, batch=REBUILD_BATCH):
+    '''
+    Recompute the usage of every user from the report table, batch
+    users at a time in parallel workers. Returns the number of users.
+    '''
+    with Session(engine) as session:
+        first, last = session.query(func.min(User.id),
+                                    func.max(User.id)).one()
+    if first is None:
+        return 0
+    ranges = [(start, min(start + batch - 1, last))
+              for start in range(first, last + 1, batch)]
+    with ThreadPoolExecutor(workers) as pool:
+        return sum(pool.map(partial(rebuild_range, engine, upload_folder),
+                            ranges))
+
+
+def init_app(app, engine):
+    '''
+    Register the rebuild-usage command of the app.
+    '''
+    @app.cli.command('rebuild-usage')
+    @click.option('--workers', type=int,
+                  default=lambda: app.config['USAGE_REBUILD_WORKERS'],
+                  help='Number of parallel workers.')
+    def rebuild_usage(workers):
+        '''
+        Recompute the storage usage of every user from their reports.
+        '''
+        count = rebuild(engine, app.config['UPLOAD_FOLDER'], workers)
+        click.echo(f'Rebuilt the usage of {count} users.')
@@ -2,23 +2,28 @@
 utility functions that support the following:
     1. formatting the response accordance with the flask-security convention.
     2. checking password strength.
+    3. encoding and decoding opaque pagination cursors.
+    4. streaming large json and ndjson responses.
 For more detail, please see each function.
 '''
-from flask import jsonify
+from itertools import islice
+from flask import jsonify, current_app, json, stream_with_context
+from itsdangerous import URLSafeSerializer, BadSignature
 from flask_security import password_length_validator, \
                             password_complexity_validator, \
                             password_breached_validator, \
                             pwned
 
 
-def render_json(payload, code):
+def render_json(payload, code, **meta):
     '''
     Render json as per flask-security convention.
     input:
         payload = json payload
         code = http status code
+        meta = additional members of meta, e.g. next=cursor
     '''
-    response = jsonify(meta={'code': code}, response=payload)
+    response = jsonify(meta={'code': code, **meta}, response=payload)
     return response
 
 
@@ -39,3 +44,72 @@ def is_password_safe(email, password):
     pbv = password_breached_validator(password=password) is None
     pwn = pwned(password=password) == 0
     return plv and pcv and pbv and pwn
+
+
+def encode_cursor(position):
+    '''
+    Encode a keyset position (e.g. the last id of a page) into an opaque,
+    signed cursor string that the client sends back for the next page.
+    '''
+    serializer = URLSafeSerializer(current_app.secret_key, salt='cursor')
+    return serializer.dumps(position)
+
+
+def decode_cursor(cursor):
+    '''
+    Decode a cursor made by encode_cursor.
+    Raises ValueError if it has been tampered with.
+    '''
+    serializer = URLSafeSerializer(current_app.secret_key, salt='cursor')
+    try:
+        return serializer.loads(cursor)
+    except BadSignature as error:
+        raise ValueError('Invalid cursor.') from error
+
+
+def iter_batches(items, size):
+    '''
+    Yield lists of up to size items.
+    '''
+    items = iter(items)
+    batch = list(islice(items, size))
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
+def render_json_stream(payload, code, batch_size=500):
+    '''
+    Stream json in the same envelope as render_json, one batch of
+    items at a time, so the whole response is never held in memory.
+    input:
+        payload = iterable of the items of the response array
+        code = http status code
+        batch_size = number of items encoded per chunk
+    '''
+    def generate():
+        yield '{"meta":' + json.dumps({'code': code}) + ',"response":['
+        separator = ''
+        for batch in iter_batches(payload, batch_size):
+            yield separator + ','.join(json.dumps(item) for item in batch)
+            separator = ','
+        yield ']}\n'
+    return current_app.response_class(stream_with_context(generate()),
+                                      status=code,
+                                      mimetype='application/json')
+
+
+def render_ndjson_stream(payload, code, batch_size=500):
+    '''
+    Stream newline delimited json, one line per item.
+    input:
+        payload = iterable of the items
+        code = http status code
+        batch_size = number of items encoded per chunk
+    '''
+    def generate():
+        for batch in iter_batches(payload, batch_size):
+            yield ''.join(json.dumps(item) + '\n' for item in batch)
+    return current_app.response_class(stream_with_context(generate()),
+                                      status=code,
+                                      mimetype='application/x-ndjson')
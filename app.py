@@ -16,9 +16,19 @@ def create_app(test_config=None):
     # pylint: disable=import-outside-toplevel
     # create and configure the app
     app = Flask(__name__, instance_relative_config=True)
+    # Uploaded files are streamed straight into the upload folder.
+    from api.storage.stream import StreamingRequest
+    app.request_class = StreamingRequest
 
     with app.app_context():
         app.config.from_object("api.conf.security.BaseConfig")
+        app.config.from_object("api.conf.storage.StorageConfig")
+        app.config.from_object("api.conf.jobs.JobConfig")
+        app.config.from_object("api.conf.search.SearchConfig")
+        app.config.from_object("api.conf.cache.CacheConfig")
+        app.config.from_object("api.conf.usage.UsageConfig")
+        app.config.from_object("api.conf.derivatives.DerivativeConfig")
+        app.config.from_object("api.conf.metrics.MetricsConfig")
 
         if test_config is None or test_config == "prod":
             app.config.from_object("api.conf.security.ProductionConfig")
@@ -35,18 +45,38 @@ def create_app(test_config=None):
     app.app_context().push()
 
     from api.conf.routes import generate_routes
-    from flask_security import Security, SQLAlchemySessionUserDatastore
-    from api.conf.database import db_session, init_db
+    from flask_security import Security
+    from api.conf.database import db_session, init_db, engine, replicas
     from api.models import User, Role
+    from api import routing
 
     generate_routes(app)
 
-    # Setup Flask-Security
-    user_datastore = SQLAlchemySessionUserDatastore(db_session, User, Role)
+    # Setup Flask-Security, users are looked up on a replica if any
+    user_datastore = routing.RoutingUserDatastore(db_session, User, Role)
     Security(app, user_datastore)
+    routing.init_app(app, db_session)
 
     init_db()
 
+    # Background jobs run in a pool of workers, see api/jobs/queue.py.
+    from api.jobs import queue
+    from api import search, cache, usage, schema, queries
+    from api.storage import gc, backends, hot, derivatives, serve
+    backends.init_app(app)
+    serve.init_app(app)
+    hot.init_app(app)
+    derivatives.init_app(app)
+    jobs = queue.init_app(app)
+    search.init_app(app, engine)
+    cache.init_app(app)
+    usage.init_app(app, engine)
+    gc.init_app(app, engine)
+    schema.init_app(app)
+    queries.init_app(app, engine, *replicas.engines())
+    # jobs left queued need the result handlers registered above
+    jobs.resume()
+
     @app.after_request
     def add_header(response):
         '''
@@ -0,0 +1,139 @@
+'''
+This file benchmarks the report endpoints on each database backend,
+MySQL and the embedded SQLite (see api/sqlite.py).
+
+Each backend runs in its own process, as the engine is made when
+api.conf.database is imported, and resets its testing database like the
+test suite does, so it needs the same env variables; MySQL needs its
+server too. Run from the project root:
+    python3 -m benchmarks.database
+    python3 -m benchmarks.database sqlite mysql
+'''
+import io
+import os
+import sys
+import time
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime
+
+BACKENDS = ('sqlite', 'mysql')
+REPORTS = 10000
+REQUESTS = 200
+EMAIL = 'bench@example.com'
+PASSWORD = 'dsafldakjhgdagfd21231gadsgas!DAFa'
+
+
+def timings(function, count=REQUESTS):
+    '''
+    Mean and 95th percentile of count calls, in milliseconds.
+    '''
+    samples = []
+    for number in range(count):
+        started = time.perf_counter()
+        function(number)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return sum(samples) / count, samples[int(count * 0.95) - 1]
+
+
+def time_endpoints(client, ids):
+    '''
+    Time each report endpoint, logged in through client; ids are the
+    reports to read and update.
+    '''
+    # pylint: disable=import-outside-toplevel
+    from api.models import Report
+
+    def upload(number):
+        client.post('/api/v1/report/upload', data={
+            'name': f'upload-{number}', 'description': 'benchmark',
+            'file': (io.BytesIO(f'content {number}'.encode()),
+                     'report.txt')})
+    results = {'POST /report/upload': timings(upload)}
+    uploaded = Report.query.filter_by(name='upload-0').one().id
+    results.update({
+        'GET /report/list': timings(
+            lambda number: client.get('/api/v1/report/list?limit=100')),
+        'GET /report/read': timings(
+            lambda number: client.get(
+                f'/api/v1/report/read/{ids[number % len(ids)]}')),
+        'GET /report/download': timings(
+            lambda number: client.get(
+                f'/api/v1/report/download/{uploaded}').close()),
+        'PUT /report/update_data': timings(
+            lambda number: client.put(
+                f'/api/v1/report/update_data/{ids[number % len(ids)]}',
+                json={'name': f'report-{number % len(ids)}',
+                      'description': f'updated {number}'})),
+    })
+    return results
+
+
+def run(backend, reports=REPORTS):
+    '''
+    Time the report endpoints on the database of this process.
+    '''
+    # pylint: disable=import-outside-toplevel
+    started = time.perf_counter()
+    from app import create_app
+    app = create_app('test')
+    from api.conf.database import db_session, drop_db, init_db
+    from api.models import Report, User
+    drop_db()
+    init_db()
+    startup = (time.perf_counter() - started) * 1000
+
+    client = app.test_client()
+    client.post('/api/v1/auth/register',
+                json={'email': EMAIL, 'password': PASSWORD})
+    client.post('/api/v1/auth/login',
+                json={'email': EMAIL, 'password': PASSWORD})
+    user = User.query.filter_by(email=EMAIL).one()
+    now = datetime.now()
+    db_session.bulk_insert_mappings(Report, [
+        {'name': f'report-{number}', 'description': 'benchmark',
+         'file_name': 'report.pdf', 'url': '/path/to/report.pdf',
+         'user_id': user.id, 'created_at': now, 'updated_at': now}
+        for number in range(reports)])
+    db_session.commit()
+    ids = [report_id for (report_id,) in
+           db_session.query(Report.id).filter_by(user_id=user.id).
+           order_by(Report.id)]
+
+    # the output of the handlers is dropped, only the timings are printed
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            redirect_stdout(devnull):
+        results = time_endpoints(client, ids)
+    jobs = app.extensions['jobs']
+    jobs.wait(30)
+    jobs.shutdown()
+    drop_db()
+
+    print(f'{backend}: {reports} reports, {REQUESTS} requests each, '
+          f'startup {startup:.0f} ms')
+    for name, (mean, p95) in results.items():
+        print(f'  {name:26} mean {mean:7.2f} ms   p95 {p95:7.2f} ms')
+
+
+def main(backends=BACKENDS):
+    '''
+    Run the benchmark of every backend in a process of its own.
+    '''
+    for backend in backends:
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.database', '--run', backend],
+            env=dict(os.environ, DATABASE_BACKEND=backend), check=False,
+            capture_output=True, text=True)
+        if result.returncode:
+            error = (result.stderr.strip().splitlines() or ['failed'])[-1]
+            print(f'{backend}: {error}')
+        else:
+            print(result.stdout, end='')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2])
+    else:
+        main(sys.argv[1:] or BACKENDS)
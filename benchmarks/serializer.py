@@ -0,0 +1,75 @@
+'''
+This file benchmarks the precompiled report serializer against
+ReportSchema on 10k reports.
+
+It resets the testing database, like the test suite does, so it needs
+the same env variables. Run from the project root:
+    python3 -m benchmarks.serializer
+'''
+import sys
+import timeit
+from datetime import datetime
+from app import create_app
+
+ROWS = 10000
+REPEAT = 5
+
+
+def best_of(function):
+    '''
+    Best wall time of REPEAT runs, in milliseconds.
+    '''
+    return min(timeit.repeat(function, number=1, repeat=REPEAT)) * 1000
+
+
+def main(rows=ROWS):
+    '''
+    Insert the reports, then time both serializers.
+    '''
+    # pylint: disable=import-outside-toplevel
+    create_app('test')
+    from api.conf.database import db_session, drop_db, init_db
+    from api.models import Report, ReportSchema, User
+    from api.serializers import report_serializer
+
+    drop_db()
+    init_db()
+    user = User(email='bench@example.com', password='x',
+                fs_uniquifier='bench', active=True)
+    db_session.add(user)
+    db_session.commit()
+    now = datetime.now()
+    db_session.bulk_insert_mappings(Report, [
+        {'name': f'report {number}', 'description': 'benchmark',
+         'file_name': 'report.pdf', 'url': '/path/to/report.pdf',
+         'user_id': user.id, 'created_at': now, 'updated_at': now}
+        for number in range(rows)])
+    db_session.commit()
+
+    reports = Report.query.filter_by(user_id=user.id).all()
+    serialize = report_serializer()
+    columns = [getattr(Report, attribute)
+               for attribute in serialize.attributes]
+    schema = ReportSchema(many=True)
+    assert schema.dump(reports) == [serialize(report) for report in reports]
+
+    marshmallow = best_of(lambda: schema.dump(reports))
+    compiled = best_of(lambda: [serialize(report) for report in reports])
+    query_and_marshmallow = best_of(lambda: schema.dump(
+        Report.query.filter_by(user_id=user.id).all()))
+    rows_and_compiled = best_of(lambda: [
+        serialize(row) for row in
+        db_session.query(*columns).filter_by(user_id=user.id).all()])
+    drop_db()
+
+    print(f'{rows} reports, best of {REPEAT}')
+    print(f'ReportSchema.dump               {marshmallow:8.1f} ms')
+    print(f'report_serializer               {compiled:8.1f} ms'
+          f'  x{marshmallow / compiled:.1f}')
+    print(f'ORM query + ReportSchema.dump   {query_and_marshmallow:8.1f} ms')
+    print(f'Row query + report_serializer   {rows_and_compiled:8.1f} ms'
+          f'  x{query_and_marshmallow / rows_and_compiled:.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,74 @@
+'''
+Alembic environment of the database of the app, see api/schema.py.
+
+The engine and the metadata are those of api/conf/database.py. A
+connection given in config.attributes['connection'], e.g. by the tests,
+is migrated instead.
+'''
+import logging
+from logging.config import fileConfig
+from alembic import context
+from api.conf.database import engine, Base
+import api.models  # noqa: F401 pylint: disable=unused-import
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+logger = logging.getLogger('alembic.env')
+
+target_metadata = Base.metadata
+# ALTER TABLE of SQLite is limited, tables are copied instead
+CONFIGURE_ARGS = {'compare_type': True, 'render_as_batch': True}
+
+
+def run_migrations_offline():
+    '''
+    Print the SQL of the migrations instead of running it.
+    '''
+    context.configure(url=engine.url, target_metadata=target_metadata,
+                      literal_binds=True, **CONFIGURE_ARGS)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def process_revision_directives(migration_context, revision, directives):
+    '''
+    Write no revision when autogenerate finds no change.
+    '''
+    del migration_context, revision
+    if getattr(config.cmd_opts, 'autogenerate', False):
+        if directives[0].upgrade_ops.is_empty():
+            directives[:] = []
+            logger.info('No changes in schema detected.')
+
+
+def run_migrations(connection):
+    '''
+    Run the migrations on a connection.
+    '''
+    foreign_keys = None
+    if connection.dialect.name == 'sqlite':
+        # a table copied by batch mode is dropped, which would cascade to
+        # the rows that reference it
+        foreign_keys = connection.exec_driver_sql(
+            'PRAGMA foreign_keys').scalar()
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+    context.configure(connection=connection,
+                      target_metadata=target_metadata,
+                      process_revision_directives=process_revision_directives,
+                      **CONFIGURE_ARGS)
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if foreign_keys is not None:
+            connection.exec_driver_sql(f'PRAGMA foreign_keys={foreign_keys}')
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif config.attributes.get('connection') is not None:
+    run_migrations(config.attributes['connection'])
+else:
+    with engine.connect() as connection:
+        run_migrations(connection)
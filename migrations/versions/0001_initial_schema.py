@@ -0,0 +1,82 @@
+'''
+initial schema
+
+The users, roles and reports of the app before its storage features.
+Databases that init_db() made before migrations have no revision; they
+are stamped with this one by api/schema.py, so that `flask db upgrade`
+runs the later ones.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 15:17:46.315662
+'''
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    '''
+    Apply this revision.
+    '''
+    op.create_table(
+        'role',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=True),
+        sa.Column('description', sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=255), nullable=False),
+        sa.Column('username', sa.String(length=255), nullable=True),
+        sa.Column('password', sa.String(length=255), nullable=False),
+        sa.Column('last_login_at', sa.DateTime(), nullable=True),
+        sa.Column('current_login_at', sa.DateTime(), nullable=True),
+        sa.Column('last_login_ip', sa.String(length=100), nullable=True),
+        sa.Column('current_login_ip', sa.String(length=100), nullable=True),
+        sa.Column('login_count', sa.Integer(), nullable=True),
+        sa.Column('active', sa.Boolean(), nullable=True),
+        sa.Column('fs_uniquifier', sa.String(length=255), nullable=False),
+        sa.Column('confirmed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('fs_uniquifier'),
+        sa.UniqueConstraint('username'))
+    op.create_table(
+        'report',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('description', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('url', sa.String(length=255), nullable=True),
+        sa.Column('file_name', sa.String(length=255), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_table(
+        'roles_users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('role_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['role_id'], ['role.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    '''
+    Revert this revision.
+    '''
+    op.drop_table('roles_users')
+    op.drop_table('report')
+    op.drop_table('user')
+    op.drop_table('role')
@@ -0,0 +1,206 @@
+'''
+report storage
+
+The tables and report columns of the storage features: the blob store,
+background jobs, resumable uploads, the usage of each user and the
+search index, with the cache policy and size of each report.
+
+init_db() of older versions created some of these tables already, and
+creates the missing ones when the app starts on a database that has not
+been upgraded yet, so only what is missing is created.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:12:31.204518
+'''
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Columns that this revision adds to the report table.
+REPORT_COLUMNS = ('blob_sha256', 'cache_policy', 'size')
+
+
+def existing_schema():
+    '''
+    Return the tables of the database, and the columns and indexes of
+    report; none when the SQL is printed instead of run.
+    '''
+    if context.is_offline_mode():
+        return set(), set(), set()
+    inspector = sa.inspect(op.get_bind())
+    return (set(inspector.get_table_names()),
+            {column['name'] for column in inspector.get_columns('report')},
+            {index['name'] for index in inspector.get_indexes('report')})
+
+
+def create_tables():
+    '''
+    Return the functions that create each table of this revision, in
+    the order of their foreign keys.
+    '''
+    def blob():
+        op.create_table(
+            'blob',
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('mime_type', sa.String(length=255), nullable=True),
+            sa.Column('ref_count', sa.Integer(), nullable=False),
+            sa.Column('encoding', sa.String(length=20), nullable=True),
+            sa.Column('stored_size', sa.BigInteger(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('sha256'))
+
+    def upload_session():
+        op.create_table(
+            'upload_session',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('name', sa.String(length=255), nullable=False),
+            sa.Column('description', sa.String(length=255),
+                      nullable=False),
+            sa.Column('file_name', sa.String(length=255), nullable=False),
+            sa.Column('length', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'))
+        op.create_index('ix_upload_session_expires_at', 'upload_session',
+                        ['expires_at'])
+
+    def user_usage():
+        op.create_table(
+            'user_usage',
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('report_count', sa.Integer(), nullable=False),
+            sa.Column('bytes', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('user_id'))
+
+    def job():
+        op.create_table(
+            'job',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('report_id', sa.Integer(), nullable=True),
+            sa.Column('task', sa.String(length=64), nullable=False),
+            sa.Column('args', sa.JSON(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('result', sa.JSON(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['report_id'], ['report.id'],
+                                    ondelete='SET NULL'),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'))
+
+    def report_text():
+        op.create_table(
+            'report_text',
+            sa.Column('report_id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('content',
+                      sa.Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'),
+                      nullable=True),
+            sa.ForeignKeyConstraint(['report_id'], ['report.id'],
+                                    ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('report_id'))
+        if op.get_context().dialect.name == 'mysql':
+            # FULLTEXT index of the MySQL search backend, see
+            # api/search.py
+            op.execute('ALTER TABLE report_text '
+                       'ADD FULLTEXT INDEX ft_report_text (content)')
+
+    def search_posting():
+        op.create_table(
+            'search_posting',
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('term', sa.String(length=64), nullable=False),
+            sa.Column('report_id', sa.Integer(), nullable=False),
+            sa.Column('field', sa.String(length=16), nullable=False),
+            sa.Column('tf', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['report_id'], ['report.id'],
+                                    ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('user_id', 'term', 'report_id',
+                                    'field'))
+        op.create_index('ix_search_posting_report_id', 'search_posting',
+                        ['report_id'])
+
+    return {'blob': blob,
+            'upload_session': upload_session,
+            'user_usage': user_usage,
+            'job': job,
+            'report_text': report_text,
+            'search_posting': search_posting}
+
+
+def upgrade():
+    '''
+    Apply this revision.
+    '''
+    tables, report_columns, report_indexes = existing_schema()
+    creates = create_tables()
+    create_blob = creates.pop('blob')
+    if 'blob' not in tables:
+        create_blob()
+    missing = [name for name in REPORT_COLUMNS if name not in report_columns]
+    if missing:
+        with op.batch_alter_table('report') as batch_op:
+            if 'blob_sha256' in missing:
+                batch_op.add_column(sa.Column('blob_sha256',
+                                              sa.String(length=64),
+                                              nullable=True))
+                batch_op.create_foreign_key('fk_report_blob_sha256_blob',
+                                            'blob', ['blob_sha256'],
+                                            ['sha256'])
+            if 'cache_policy' in missing:
+                batch_op.add_column(sa.Column('cache_policy',
+                                              sa.String(length=20),
+                                              nullable=True))
+            if 'size' in missing:
+                batch_op.add_column(sa.Column('size', sa.BigInteger(),
+                                              nullable=True))
+    if (op.get_context().dialect.name == 'mysql' and
+            'ft_report' not in report_indexes):
+        # FULLTEXT index of the MySQL search backend, see api/search.py
+        op.execute('ALTER TABLE report '
+                   'ADD FULLTEXT INDEX ft_report (name, description)')
+    for name, create in creates.items():
+        if name not in tables:
+            create()
+
+
+def downgrade():
+    '''
+    Revert this revision.
+    '''
+    if op.get_context().dialect.name == 'mysql':
+        op.execute('ALTER TABLE report DROP INDEX ft_report')
+    with op.batch_alter_table('report') as batch_op:
+        batch_op.drop_constraint('fk_report_blob_sha256_blob',
+                                 type_='foreignkey')
+        batch_op.drop_column('size')
+        batch_op.drop_column('cache_policy')
+        batch_op.drop_column('blob_sha256')
+    op.drop_index('ix_search_posting_report_id', 'search_posting')
+    op.drop_table('search_posting')
+    op.drop_table('report_text')
+    op.drop_table('job')
+    op.drop_table('user_usage')
+    op.drop_index('ix_upload_session_expires_at', 'upload_session')
+    op.drop_table('upload_session')
+    op.drop_table('blob')
@@ -0,0 +1,37 @@
+'''
+report owner indexes
+
+Every report lookup filters on user_id: (user_id, id) serves reading a
+report and the keyset pages of the report list, (user_id, updated_at)
+the updated_before/after filters of bulk changes. The user of an auth
+token is found by the unique index of user.fs_uniquifier, which exists
+already.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 15:17:59.661808
+'''
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    '''
+    Apply this revision.
+    '''
+    op.create_index('ix_report_user_id_id', 'report', ['user_id', 'id'])
+    op.create_index('ix_report_user_id_updated_at', 'report',
+                    ['user_id', 'updated_at'])
+
+
+def downgrade():
+    '''
+    Revert this revision.
+    '''
+    op.drop_index('ix_report_user_id_updated_at', 'report')
+    op.drop_index('ix_report_user_id_id', 'report')
@@ -4,7 +4,9 @@ This file takes care of basic configuration of testing scripts.
 
 import io
 import base64
-from unittest import TestCase
+import shutil
+import tempfile
+from unittest import TestCase, mock
 from werkzeug.datastructures import FileStorage
 from app import create_app
 from .utils import json_format, post_api
@@ -16,7 +18,12 @@ class BaseTest(TestCase):
     '''
 
     def setUp(self):
-        self.app = create_app('test').test_client()
+        # the files of each test are kept apart and removed after it
+        upload_folder = tempfile.mkdtemp(prefix='u6-uploads-')
+        self.addCleanup(shutil.rmtree, upload_folder, True)
+        with mock.patch('api.conf.storage.StorageConfig.UPLOAD_FOLDER',
+                        upload_folder):
+            self.app = create_app('test').test_client()
         from api.conf.database import drop_db, init_db, db_session
         db_session.commit()
         drop_db()
@@ -90,3 +97,10 @@ class ReportTest(TestCase):
             'file': self.traversal_file_with_ext,
             'name': self.path_traversal,
             'description': self.path_traversal}
+
+    def tearDown(self):
+        # let the background jobs of the test finish before the next
+        # test drops the tables
+        jobs = self.app.application.extensions['jobs']
+        jobs.wait(10)
+        jobs.shutdown()
@@ -1,12 +1,41 @@
 '''
 This file takes care of testing scripts of the report API.
 '''
+import io
+import os
+import re
+import json
+import gzip
+import struct
+import hashlib
+import zipfile
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+from werkzeug.datastructures import FileStorage
 from .base import ReportTest
 from .utils import (get_api,
                     post_api,
                     post_api_with_form,
+                    put_api,
                     delete_api,
-                    json_format)
+                    json_format,
+                    format_response,
+                    resolve_offload,
+                    FakeRedis,
+                    FakeS3)
+
+try:
+    import boto3
+    import moto
+except ImportError:  # pragma: no cover - optional dependencies
+    boto3 = moto = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
 
 
 class TestUpload(ReportTest):
@@ -86,6 +115,39 @@ class TestUpload(ReportTest):
         self.assertEqual(res['meta']['code'], 422)
         self.assertEqual(res['response']['error'], 'Invalid input.')
 
+    def test_upload_returns_digest_size_and_mime_type(self):
+        '''
+        This function is to test the upload case
+        "when the file is streamed, its digest, size and type are returned"
+        '''
+        content = b'%PDF-1.4 streamed report'
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(content),
+                                     filename='file.pdf'))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['size'], len(content))
+        self.assertEqual(res['response']['sha256'],
+                         hashlib.sha256(content).hexdigest())
+        self.assertEqual(res['response']['mime_type'], 'application/pdf')
+
+    def test_upload_larger_than_max_size(self):
+        '''
+        This function is to test the upload case
+        "when the file is larger than UPLOAD_MAX_SIZE"
+        '''
+        config = self.app.application.config
+        config['UPLOAD_MAX_SIZE'] = 8
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(b'0123456789'),
+                                     filename='large.txt'))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        self.assertEqual(res['meta']['code'], 413)
+        self.assertEqual(res['response']['error'], 'File too large.')
+        leftovers = [name for name in os.listdir(config['UPLOAD_FOLDER'])
+                     if name.startswith('.upload-')]
+        self.assertEqual(leftovers, [])
+
 
 class TestRead(ReportTest):
     '''
@@ -147,3 +209,2242 @@ class TestRead(ReportTest):
         self.assertEqual(res['meta']['code'], 404)
         self.assertEqual(
             res['response']['error'], 'Report not found or invalid.')
+
+
+class TestBlobStore(ReportTest):
+    '''
+    This class method is to test the content-addressed blob store.
+    '''
+    def upload(self, name, content):
+        '''
+        Upload a text report with the given name and content.
+        '''
+        data = dict(self.upload_data,
+                    name=name,
+                    file=FileStorage(stream=io.BytesIO(content),
+                                     filename='file.txt'))
+        return post_api_with_form(self, '/api/v1/report/upload', data=data)
+
+    def test_identical_uploads_share_one_blob(self):
+        '''
+        This function is to test the blob store case
+        "when the same content is uploaded twice"
+        '''
+        from api.models import Blob, Report
+        from api.storage.blobstore import blob_name
+        self.upload('first', b'quarterly report')
+        self.upload('second', b'quarterly report')
+        sha256 = hashlib.sha256(b'quarterly report').hexdigest()
+        blob = Blob.query.filter_by(sha256=sha256).one()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(
+            {report.blob_sha256 for report in Report.query.all()}, {sha256})
+        folder = self.app.application.config['UPLOAD_FOLDER']
+        self.assertTrue(os.path.isfile(os.path.join(folder,
+                                                    blob_name(sha256))))
+
+    def test_concurrent_first_uploads_share_one_blob(self):
+        '''
+        This function is to test the blob store case
+        "when another upload of the same content creates the blob first"
+        '''
+        from api.models import Blob
+        from api.storage import blobstore
+        self.upload('first', b'raced content')
+        add_reference = blobstore.add_reference
+        calls = []
+
+        def missed_first(sha256):
+            # the second upload does not see the blob before its INSERT
+            calls.append(sha256)
+            return add_reference(sha256) if len(calls) > 1 else 0
+        with mock.patch.object(blobstore, 'add_reference', missed_first):
+            res = self.upload('second', b'raced content')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(res['meta']['code'], 200)
+        sha256 = hashlib.sha256(b'raced content').hexdigest()
+        self.assertEqual(Blob.query.filter_by(sha256=sha256).one().ref_count,
+                         2)
+
+    def test_blob_is_removed_with_its_last_report(self):
+        '''
+        This function is to test the blob store case
+        "when every report that points at a blob is deleted"
+        '''
+        from api.storage.blobstore import blob_path
+        self.upload('first', b'monthly summary')
+        self.upload('second', b'monthly summary')
+        sha256 = hashlib.sha256(b'monthly summary').hexdigest()
+        with self.app.application.app_context():
+            path = blob_path(sha256)
+        delete_api(self, '/api/v1/report/delete/1')
+        self.assertTrue(os.path.isfile(path))
+        delete_api(self, '/api/v1/report/delete/2')
+        self.assertFalse(os.path.exists(path))
+
+    def test_download_uses_the_report_file_name(self):
+        '''
+        This function is to test the blob store case
+        "when a report is downloaded from the blob store"
+        '''
+        self.upload('first', b'downloadable')
+        response = self.app.get('/api/v1/report/download/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'downloadable')
+        self.assertIn('filename=file.txt',
+                      response.headers['Content-Disposition'])
+
+
+class TestBulkUpload(ReportTest):
+    '''
+    This class method is to test the bulk upload API.
+    '''
+    def bulk_upload(self, *items):
+        '''
+        Upload (name, filename, content) items in one request.
+        '''
+        data = {'name': [name for name, _, _ in items],
+                'description': ['description'] * len(items),
+                'file': [FileStorage(stream=io.BytesIO(content),
+                                     filename=filename)
+                         for _, filename, content in items]}
+        return post_api_with_form(self, '/api/v1/report/bulk_upload',
+                                  data=data)
+
+    def test_bulk_upload_successfully(self):
+        '''
+        This function is to test the bulk upload case
+        "when uploading several valid files"
+        '''
+        from api.models import Blob
+        res = self.bulk_upload(('first', 'first.txt', b'shared'),
+                               ('second', 'second.txt', b'shared'),
+                               ('third', 'third.txt', b'other'))
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['uploaded'], 3)
+        results = res['response']['results']
+        self.assertEqual([result['reportname'] for result in results],
+                         ['first', 'second', 'third'])
+        self.assertEqual(len({result['id'] for result in results}), 3)
+        sha256 = hashlib.sha256(b'shared').hexdigest()
+        self.assertEqual(results[1]['sha256'], sha256)
+        self.assertEqual(Blob.query.filter_by(sha256=sha256).one().ref_count,
+                         2)
+        response = self.app.get(
+            f"/api/v1/report/download/{results[2]['id']}")
+        self.assertEqual(response.data, b'other')
+
+    def test_bulk_upload_reports_invalid_items(self):
+        '''
+        This function is to test the bulk upload case
+        "when some of the items are invalid"
+        '''
+        TestBlobStore.upload(self, 'existing', b'existing')
+        res = self.bulk_upload(('valid', 'valid.txt', b'valid'),
+                               ('binary', 'binary.exe', b'binary'),
+                               ('existing', 'existing.txt', b'existing'),
+                               ('valid', 'twice.txt', b'twice'))
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['uploaded'], 1)
+        self.assertEqual(res['response']['failed'], 3)
+        self.assertEqual(
+            [result.get('error') for result in res['response']['results']],
+            [None, 'Invalid file.', 'Already exists.', 'Already exists.'])
+        folder = self.app.application.config['UPLOAD_FOLDER']
+        self.assertFalse([name for name in os.listdir(folder)
+                          if name.startswith('.upload-')])
+
+    def test_bulk_upload_with_mismatched_fields(self):
+        '''
+        This function is to test the bulk upload case
+        "when the names and the files do not match up"
+        '''
+        data = {'name': ['first', 'second'],
+                'description': ['description'],
+                'file': self.file}
+        res = post_api_with_form(self, '/api/v1/report/bulk_upload',
+                                 data=data)
+        self.assertEqual(res['meta']['code'], 422)
+        self.assertEqual(res['response']['error'], 'Invalid input.')
+
+
+class TestBulkChange(ReportTest):
+    '''
+    This class method is to test the bulk update and bulk delete APIs.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.upload('first', b'shared')
+        self.upload('second', b'shared')
+        self.upload('third', b'single')
+
+    def test_bulk_update_by_ids(self):
+        '''
+        This function is to test the bulk update case
+        "when updating a list of ids that includes an unknown one"
+        '''
+        from api.models import Report
+        res = put_api(self, '/api/v1/report/bulk_update',
+                      data=json_format(ids=[1, 3, 99],
+                                       cache_policy='public'))
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['updated'], 2)
+        self.assertEqual(
+            res['response']['results'],
+            [{'id': 1, 'status': 'updated'},
+             {'id': 3, 'status': 'updated'},
+             {'id': 99, 'error': 'Report not found or invalid.'}])
+        self.assertEqual(
+            {report.id: report.cache_policy for report in Report.query},
+            {1: 'public', 2: None, 3: 'public'})
+
+    def test_bulk_update_with_invalid_input(self):
+        '''
+        This function is to test the bulk update case
+        "when the selection or the values are invalid"
+        '''
+        for data in ({'ids': [1], 'filter': {'file_name': 'file.txt'}},
+                     {'ids': ['1'], 'description': 'new'},
+                     {'ids': [True], 'description': 'new'},
+                     {'filter': {'user_id': 2}, 'description': 'new'},
+                     {'ids': [1], 'cache_policy': 'forever'},
+                     {'ids': [1]}):
+            res = put_api(self, '/api/v1/report/bulk_update',
+                          data=json.dumps(data))
+            self.assertEqual(res['meta']['code'], 422)
+
+    def test_bulk_delete_by_filter(self):
+        '''
+        This function is to test the bulk delete case
+        "when deleting every report that matches a filter"
+        '''
+        from api.models import Blob, Report
+        from api.storage.blobstore import blob_path
+        with self.app.application.app_context():
+            paths = [blob_path(hashlib.sha256(content).hexdigest())
+                     for content in (b'shared', b'single')]
+        res = delete_api(self, '/api/v1/report/bulk_delete',
+                         token=json_format(filter={'file_name': 'file.txt'}))
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['deleted'], 3)
+        self.assertEqual(Report.query.count(), 0)
+        self.assertEqual(Blob.query.count(), 0)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_bulk_delete_keeps_shared_blobs(self):
+        '''
+        This function is to test the bulk delete case
+        "when a deleted report shares its file with a remaining one"
+        '''
+        from api.models import Blob
+        res = delete_api(self, '/api/v1/report/bulk_delete',
+                         token=json_format(ids=[1, 3]))
+        self.assertEqual(res['response']['deleted'], 2)
+        sha256 = hashlib.sha256(b'shared').hexdigest()
+        self.assertEqual([(blob.sha256, blob.ref_count)
+                          for blob in Blob.query], [(sha256, 1)])
+        response = self.app.get('/api/v1/report/download/2')
+        self.assertEqual(response.data, b'shared')
+
+
+class TestJobs(ReportTest):
+    '''
+    This class method is to test the background jobs and the job API.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.jobs = self.app.application.extensions['jobs']
+
+    def job(self, job_id):
+        '''
+        Wait for the queue and return the job through the API.
+        '''
+        self.assertTrue(self.jobs.wait(10))
+        return get_api(self, f'/api/v1/report/jobs/{job_id}')
+
+    def test_upload_inspects_file_in_background(self):
+        '''
+        This function is to test the job case
+        "when a pdf is uploaded"
+        '''
+        content = b'%PDF-1.4\n/Type /Pages\n/Type /Page\n/Type/Page\n'
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(content),
+                                     filename='file.pdf'))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        res = self.job(res['response']['jobs'][0])
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['status'], 'succeeded')
+        self.assertEqual(res['response']['report'], 1)
+        self.assertEqual(res['response']['result'],
+                         {'mime_type': 'application/pdf',
+                          'matches_extension': True,
+                          'pages': 2})
+
+    def test_image_size_is_extracted(self):
+        '''
+        This function is to test the job case
+        "when a png with a wrong extension is uploaded"
+        '''
+        content = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' +
+                   struct.pack('>II', 640, 480))
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(content),
+                                     filename='file.gif'))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        res = self.job(res['response']['jobs'][0])
+        self.assertEqual(res['response']['result'],
+                         {'mime_type': 'image/png',
+                          'matches_extension': False,
+                          'width': 640,
+                          'height': 480})
+
+    def test_failed_job_is_retried(self):
+        '''
+        This function is to test the job case
+        "when a task fails before it succeeds"
+        '''
+        calls = []
+
+        def flaky(**args):
+            calls.append(args)
+            if len(calls) < 2:
+                raise OSError('disk not ready')
+            return {'done': True}
+
+        self.jobs.retry_delay = 0.01
+        with mock.patch.dict('api.jobs.tasks.TASKS', inspect_file=flaky):
+            res = self.upload('first', b'retried')
+            res = self.job(res['response']['jobs'][0])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(res['response']['status'], 'succeeded')
+        self.assertEqual(res['response']['attempts'], 2)
+        self.assertEqual(res['response']['result'], {'done': True})
+
+    def test_job_fails_after_max_attempts(self):
+        '''
+        This function is to test the job case
+        "when a task keeps failing"
+        '''
+        def broken(**_):
+            raise OSError('disk not ready')
+
+        self.jobs.retry_delay = 0.01
+        with mock.patch.dict('api.jobs.tasks.TASKS', inspect_file=broken):
+            res = self.upload('first', b'failed')
+            res = self.job(res['response']['jobs'][0])
+        self.assertEqual(res['response']['status'], 'failed')
+        self.assertEqual(res['response']['attempts'],
+                         self.jobs.max_attempts)
+        self.assertEqual(res['response']['error'], 'OSError: disk not ready')
+
+    def test_abandoned_jobs_are_resumed(self):
+        '''
+        This function is to test the job case
+        "when a worker stopped while jobs were running"
+        '''
+        from datetime import timedelta
+        from api.conf.database import db_session
+        from api.jobs.queue import ABANDONED_ERROR
+        from api.models import Job
+        long_ago = datetime.now() - timedelta(hours=1)
+        db_session.add_all([
+            Job(task='inspect_file', user_id=1, args={}, status='running',
+                attempts=1, updated_at=long_ago),
+            Job(task='inspect_file', user_id=1, args={}, status='running',
+                attempts=self.jobs.max_attempts, updated_at=long_ago),
+            Job(task='inspect_file', user_id=1, args={}, status='running',
+                attempts=1)])
+        db_session.commit()
+        with mock.patch.dict('api.jobs.tasks.TASKS',
+                             inspect_file=lambda **_: {'done': True}):
+            self.jobs.resume()
+            resumed, failed, running = (self.job(job_id)['response']
+                                        for job_id in (1, 2, 3))
+        self.assertEqual((resumed['status'], resumed['attempts']),
+                         ('succeeded', 2))
+        self.assertEqual((failed['status'], failed['error']),
+                         ('failed', ABANDONED_ERROR))
+        # it may still be running in another worker
+        self.assertEqual(running['status'], 'running')
+        # pylint: disable=protected-access
+        self.assertIsNotNone(self.jobs._recovery)
+
+    def test_job_of_other_user(self):
+        '''
+        This function is to test the job case
+        "when polling a job that does not exist or is not owned"
+        '''
+        res = self.job(99)
+        self.assertEqual(res['meta']['code'], 404)
+        self.assertEqual(res['response']['error'], 'Job not found or invalid.')
+
+
+class TestCompression(ReportTest):
+    '''
+    This class method is to test the compression of stored files.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.app.application.config['STORAGE_CODEC'] = 'gzip'
+        self.jobs = self.app.application.extensions['jobs']
+        self.content = b'quarterly figures, ' * 100
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.res = self.upload('first', self.content)
+
+    def test_file_is_stored_compressed(self):
+        '''
+        This function is to test the compression case
+        "when a text file is uploaded"
+        '''
+        from api.models import Blob
+        from api.storage.blobstore import blob_path
+        self.assertEqual(self.res['response']['sha256'], self.sha256)
+        self.assertEqual(self.res['response']['size'], len(self.content))
+        blob = Blob.query.one()
+        self.assertEqual(blob.encoding, 'gzip')
+        with self.app.application.app_context():
+            path = blob_path(self.sha256)
+        with open(path, 'rb') as file:
+            stored = file.read()
+        self.assertEqual(blob.stored_size, len(stored))
+        self.assertLess(len(stored), len(self.content))
+        self.assertEqual(gzip.decompress(stored), self.content)
+        # background jobs read the original content
+        res = TestJobs.job(self, self.res['response']['jobs'][0])
+        self.assertEqual(res['response']['result']['mime_type'],
+                         'text/plain')
+
+    def test_download_passes_compressed_file_through(self):
+        '''
+        This function is to test the compression case
+        "when the client accepts the codec of the file"
+        '''
+        response = TestDownload.download(self, **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}-gzip"')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), self.content)
+
+    def test_download_decompresses_on_the_fly(self):
+        '''
+        This function is to test the compression case
+        "when the client does not accept the codec of the file"
+        '''
+        response = TestDownload.download(self)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}"')
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(self.content))
+        self.assertEqual(response.data, self.content)
+        response = TestDownload.download(self, Range='bytes=19-36')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.content[19:37])
+
+    def test_range_decompresses_only_its_frame(self):
+        '''
+        This function is to test the compression case
+        "when a range of a file of several frames is downloaded"
+        '''
+        from api.storage import codec
+        with mock.patch.object(codec, 'FRAME_SIZE', 256):
+            self.upload('second', self.content * 2)
+        # the jobs of the upload read the whole file
+        self.assertTrue(self.jobs.wait(10))
+        content = self.content * 2
+        decompress = codec.FrameReader._decompress
+        with mock.patch.object(codec.FrameReader, '_decompress',
+                               autospec=True,
+                               side_effect=decompress) as frames:
+            response = self.app.get('/api/v1/report/download/2',
+                                    headers={'Range': 'bytes=3000-3099'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, content[3000:3100])
+        # the frames of 256 bytes that hold the range, not those before
+        self.assertEqual([call.args[1][1] for call in frames.call_args_list],
+                         [2816, 3072])
+
+    def test_images_are_stored_as_is(self):
+        '''
+        This function is to test the compression case
+        "when an already compressed image is uploaded"
+        '''
+        from api.models import Blob
+        data = dict(self.upload_data,
+                    name='image',
+                    file=FileStorage(stream=io.BytesIO(b'\x89PNG\r\n\x1a\n'),
+                                     filename='file.png'))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        blob = Blob.query.filter_by(sha256=res['response']['sha256']).one()
+        self.assertIsNone(blob.encoding)
+
+
+class TestResumableUpload(ReportTest):
+    '''
+    This class method is to test the resumable upload API.
+    '''
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.content = b'0123456789' * 1000
+        res = post_api(self, '/api/v1/report/uploads', data=json_format(
+            name='large report', description='in chunks',
+            file_name='large.txt', length=len(self.content)))
+        self.url = f"/api/v1/report/uploads/{res['response']['upload_id']}"
+
+    def send(self, offset, chunk):
+        '''
+        Send a chunk of the upload at the given offset.
+        '''
+        return format_response(self.app.patch(
+            self.url, data=chunk,
+            content_type='application/offset+octet-stream',
+            headers={'Upload-Offset': str(offset)}))
+
+    def test_upload_in_chunks(self):
+        '''
+        This function is to test the resumable upload case
+        "when the file is sent in chunks and finalized"
+        '''
+        res = self.send(0, self.content[:4000])
+        self.assertEqual(res['response']['offset'], 4000)
+        response = self.app.head(self.url)
+        self.assertEqual(response.headers['Upload-Offset'], '4000')
+        self.assertEqual(response.headers['Upload-Length'],
+                         str(len(self.content)))
+        res = post_api(self, self.url + '/finalize')
+        self.assertEqual(res['meta']['code'], 409)
+        self.assertEqual(res['response']['error'], 'Upload incomplete.')
+        res = self.send(4000, self.content[4000:])
+        self.assertEqual(res['response']['offset'], len(self.content))
+        res = post_api(self, self.url + '/finalize')
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['reportname'], 'large_report')
+        self.assertEqual(res['response']['size'], len(self.content))
+        self.assertEqual(res['response']['sha256'],
+                         hashlib.sha256(self.content).hexdigest())
+        response = self.app.get('/api/v1/report/download/1')
+        self.assertEqual(response.data, self.content)
+        # the session is gone with its partial file
+        res = post_api(self, self.url + '/finalize')
+        self.assertEqual(res['meta']['code'], 404)
+        folder = self.app.application.config['UPLOAD_FOLDER']
+        self.assertFalse(os.path.exists(
+            os.path.join(folder, '.partial', self.url.rsplit('/', 1)[1])))
+
+    def test_upload_with_wrong_offset(self):
+        '''
+        This function is to test the resumable upload case
+        "when a chunk does not start at the received offset"
+        '''
+        self.send(0, self.content[:10])
+        res = self.send(5, self.content[5:20])
+        self.assertEqual(res['meta']['code'], 409)
+        self.assertEqual(res['response']['error'], 'Offset mismatch.')
+        response = self.app.head(self.url)
+        self.assertEqual(response.headers['Upload-Offset'], '10')
+
+    def test_upload_with_content_range(self):
+        '''
+        This function is to test the resumable upload case
+        "when a chunk gives its offset in Content-Range"
+        '''
+        length = len(self.content)
+        self.send(0, self.content[:10])
+        res = format_response(self.app.patch(
+            self.url, data=self.content[10:30],
+            content_type='application/offset+octet-stream',
+            headers={'Content-Range': f'bytes 10-29/{length}'}))
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(res['response']['offset'], 30)
+        for headers in ({}, {'Content-Range': f'bytes */{length}'}):
+            res = format_response(self.app.patch(
+                self.url, data=self.content[30:40],
+                content_type='application/offset+octet-stream',
+                headers=headers))
+            self.assertEqual(res['meta']['code'], 422)
+        response = self.app.head(self.url)
+        self.assertEqual(response.headers['Upload-Offset'], '30')
+
+    def test_upload_past_declared_length(self):
+        '''
+        This function is to test the resumable upload case
+        "when more bytes are sent than declared"
+        '''
+        res = self.send(0, self.content + b'x')
+        self.assertEqual(res['meta']['code'], 413)
+        response = self.app.head(self.url)
+        self.assertEqual(response.headers['Upload-Offset'],
+                         str(len(self.content)))
+
+    def test_upload_aborted_and_expired(self):
+        '''
+        This function is to test the resumable upload case
+        "when an upload is aborted or left idle"
+        '''
+        res = delete_api(self, self.url)
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual(self.app.head(self.url).status_code, 404)
+        self.app.application.config['UPLOAD_SESSION_TTL'] = -1
+        res = post_api(self, '/api/v1/report/uploads', data=json_format(
+            name='idle', description='idle', file_name='idle.txt', length=1))
+        self.url = f"/api/v1/report/uploads/{res['response']['upload_id']}"
+        res = self.send(0, b'x')
+        self.assertEqual(res['meta']['code'], 404)
+        post_api(self, '/api/v1/report/uploads', data=json_format(
+            name='next', description='next', file_name='next.txt', length=1))
+        from api.models import UploadSession
+        self.assertEqual([s.name for s in UploadSession.query], ['next'])
+
+    def test_create_upload_with_invalid_input(self):
+        '''
+        This function is to test the resumable upload case
+        "when the upload is started with invalid input"
+        '''
+        for data, code in (
+                (dict(name='a', description='b', file_name='a.exe',
+                      length=1), 422),
+                (dict(name='a', description='b', file_name='a.txt',
+                      length='1'), 422),
+                (dict(name='a', description='b', file_name='a.txt',
+                      length=10 ** 12), 413)):
+            res = post_api(self, '/api/v1/report/uploads',
+                           data=json_format(**data))
+            self.assertEqual(res['meta']['code'], code)
+
+
+class TestSearch(ReportTest):
+    '''
+    This class method is to test the search API.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.upload('quarterly_revenue', b'numbers for the board')
+        self.upload('meeting_notes', b'the quarterly revenue grew')
+        self.upload('holiday_plan', b'beach and mountains')
+        self.assertTrue(self.app.application.extensions['jobs'].wait(10))
+
+    def search(self, query, **params):
+        '''
+        Search and return the json response.
+        '''
+        params = ''.join(f'&{key}={value}' for key, value in params.items())
+        return get_api(self, f'/api/v1/report/search?q={query}{params}')
+
+    def test_search_ranks_name_above_text(self):
+        '''
+        This function is to test the search case
+        "when the words are in the name of one report and the file text
+        of another"
+        '''
+        res = self.search('quarterly revenue')
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertEqual([hit['name'] for hit in res['response']],
+                         ['quarterly_revenue', 'meeting_notes'])
+        self.assertGreater(res['response'][0]['score'],
+                           res['response'][1]['score'])
+        self.assertEqual(
+            [hit['name'] for hit in self.search('MOUNTAINS')['response']],
+            ['holiday_plan'])
+        self.assertEqual(self.search('unrelated')['response'], [])
+
+    def test_search_with_cursor_pagination(self):
+        '''
+        This function is to test the search case
+        "when the hits do not fit in one page"
+        '''
+        res = self.search('quarterly', limit=1)
+        self.assertEqual(len(res['response']), 1)
+        res = self.search('quarterly', limit=1, cursor=res['meta']['next'])
+        self.assertEqual([hit['name'] for hit in res['response']],
+                         ['meeting_notes'])
+        self.assertIsNone(res['meta']['next'])
+        self.assertEqual(self.search('quarterly', cursor='x')['meta']['code'],
+                         422)
+        self.assertEqual(self.search('')['meta']['code'], 422)
+
+    def test_search_follows_updates_and_deletes(self):
+        '''
+        This function is to test the search case
+        "when reports are updated and deleted"
+        '''
+        self.app.put('/api/v1/report/update_data/3',
+                     data=json_format(name='holiday_plan',
+                                      description='quarterly offsite'),
+                     content_type='application/json')
+        self.assertEqual(len(self.search('offsite')['response']), 1)
+        delete_api(self, '/api/v1/report/delete/1')
+        delete_api(self, '/api/v1/report/bulk_delete',
+                   token=json_format(ids=[2]))
+        self.assertEqual([hit['name'] for hit in
+                          self.search('quarterly revenue')['response']],
+                         ['holiday_plan'])
+
+    def test_search_is_scoped_to_the_owner(self):
+        '''
+        This function is to test the search case
+        "when another user searches for the same words"
+        '''
+        data = json_format(email='valid@example.com',
+                           password=self.strong_password)
+        post_api(self, '/api/v1/auth/register', data=data)
+        post_api(self, '/api/v1/auth/login', data=data)
+        self.assertEqual(self.search('quarterly')['response'], [])
+
+
+class TestDownload(ReportTest):
+    '''
+    This class method is to test the download API.
+    '''
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.content = b'0123456789abcdef'
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(self.content),
+                                     filename='file.txt'))
+        post_api_with_form(self, '/api/v1/report/upload', data=data)
+
+    def download(self, **headers):
+        '''
+        Download the uploaded report with the given request headers.
+        '''
+        return self.app.get('/api/v1/report/download/1', headers=headers)
+
+    def test_download_report_not_exist(self):
+        '''
+        This function is to test the download case
+        "when GET a report that does not exist"
+        '''
+        res = get_api(self, '/api/v1/report/download/150')
+        self.assertEqual(res['meta']['code'], 404)
+        self.assertEqual(
+            res['response']['error'], 'Report not found or invalid.')
+
+    def test_download_with_strong_etag(self):
+        '''
+        This function is to test the download case
+        "when the ETag is derived from the content hash"
+        '''
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}"')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Cache-Control'],
+                         'private, no-cache')
+        self.assertEqual(response.data, self.content)
+
+    def test_download_not_modified(self):
+        '''
+        This function is to test the download case
+        "when the client already has the current content"
+        '''
+        response = self.download(**{'If-None-Match': f'"{self.sha256}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        last_modified = self.download().headers['Last-Modified']
+        response = self.download(**{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_download_single_range(self):
+        '''
+        This function is to test the download case
+        "when a single byte range is requested"
+        '''
+        response = self.download(Range='bytes=4-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'4567')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 4-7/16')
+        response = self.download(Range='bytes=-3')
+        self.assertEqual(response.data, b'def')
+
+    def test_download_multiple_ranges(self):
+        '''
+        This function is to test the download case
+        "when several byte ranges are requested"
+        '''
+        response = self.download(Range='bytes=0-1,10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.content_type.startswith(
+            'multipart/byteranges; boundary='))
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.data))
+        self.assertIn(b'Content-Range: bytes 0-1/16\r\n\r\n01\r\n',
+                      response.data)
+        self.assertIn(b'Content-Range: bytes 10-15/16\r\n\r\nabcdef\r\n',
+                      response.data)
+
+    def test_download_unsatisfiable_range(self):
+        '''
+        This function is to test the download case
+        "when the requested range is outside of the file"
+        '''
+        response = self.download(Range='bytes=100-200')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */16')
+
+    def test_download_range_with_stale_if_range(self):
+        '''
+        This function is to test the download case
+        "when If-Range does not match the current content"
+        '''
+        response = self.download(**{'Range': 'bytes=4-7',
+                                    'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.content)
+
+    def test_download_with_public_cache_policy(self):
+        '''
+        This function is to test the download case
+        "when the report has the public cache policy"
+        '''
+        data = json_format(name='test_report', description='test report',
+                           cache_policy='public')
+        self.app.put('/api/v1/report/update_data/1', data=data,
+                     content_type='application/json')
+        response = self.download()
+        self.assertEqual(response.headers['Cache-Control'],
+                         'public, max-age=86400')
+        self.assertEqual(response.headers['Vary'],
+                         'Authentication-Token, Cookie')
+
+
+class TestDownloadOffload(ReportTest):
+    '''
+    This class method is to test the download API when the file is
+    sent by the front web server.
+    '''
+    download = TestDownload.download
+
+    def setUp(self):
+        TestDownload.setUp(self)
+        self.config = self.app.application.config
+
+    def test_download_with_x_sendfile(self):
+        '''
+        This function is to test the download case
+        "when the file is offloaded with X-Sendfile"
+        '''
+        self.config['DOWNLOAD_OFFLOAD'] = 'x-sendfile'
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'')
+        self.assertTrue(os.path.isabs(response.headers['X-Sendfile']))
+        self.assertEqual(response.headers['ETag'], f'"{self.sha256}"')
+        self.assertIn('filename=file.txt',
+                      response.headers['Content-Disposition'])
+        self.assertEqual(
+            resolve_offload(response, self.config['UPLOAD_FOLDER'],
+                            self.config['DOWNLOAD_ACCEL_PREFIX']),
+            self.content)
+
+    def test_download_with_x_accel_redirect(self):
+        '''
+        This function is to test the download case
+        "when the file is offloaded with X-Accel-Redirect"
+        '''
+        self.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers['X-Accel-Redirect'],
+            '/protected-uploads/{}/{}/{}'.format(
+                self.sha256[:2], self.sha256[2:4], self.sha256))
+        self.assertEqual(
+            resolve_offload(response, self.config['UPLOAD_FOLDER'],
+                            self.config['DOWNLOAD_ACCEL_PREFIX']),
+            self.content)
+
+    def test_offloaded_download_not_modified(self):
+        '''
+        This function is to test the download case
+        "when an offloaded download is already up to date"
+        '''
+        self.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+        response = self.download(**{'If-None-Match': f'"{self.sha256}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_offloaded_download_of_other_users_report(self):
+        '''
+        This function is to test the download case
+        "when an offloaded download is requested by another user"
+        '''
+        self.config['DOWNLOAD_OFFLOAD'] = 'x-sendfile'
+        data = json_format(
+            email='valid@example.com', password='valid_password_example')
+        post_api(self, '/api/v1/auth/register', data=data)
+        post_api(self, '/api/v1/auth/login', data=data)
+        response = self.download()
+        self.assertEqual(format_response(response)['meta']['code'], 404)
+        self.assertNotIn('X-Sendfile', response.headers)
+
+    def test_unknown_offload_mode(self):
+        '''
+        This function is to test the download case
+        "when DOWNLOAD_OFFLOAD is not a known mode"
+        '''
+        from api.storage import serve
+        self.config['DOWNLOAD_OFFLOAD'] = 'nginx'
+        with self.assertRaisesRegex(ValueError, "'nginx'"):
+            serve.init_app(self.app.application)
+
+
+@unittest.skipIf(Image is None, 'needs pillow')
+class TestDerivative(ReportTest):
+    '''
+    This class method is to test the image derivative API.
+    '''
+    upload = TestBlobStore.upload
+
+    def upload_image(self, image_format, filename, size=(200, 100)):
+        '''
+        Upload an image report of random pixels, of the given format and
+        size, so its blob is new.
+        '''
+        output = io.BytesIO()
+        Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3)).save(
+            output, image_format)
+        data = dict(self.upload_data,
+                    file=FileStorage(stream=io.BytesIO(output.getvalue()),
+                                     filename=filename))
+        res = post_api_with_form(self, '/api/v1/report/upload', data=data)
+        return res['response']['sha256']
+
+    def test_thumbnail(self):
+        '''
+        This function is to test the derivative case
+        "when the thumbnail of a png report is downloaded"
+        '''
+        from api.conf.database import engine
+        from api.storage.gc import collect
+        sha256 = self.upload_image('PNG', 'chart.png')
+        url = '/api/v1/report/derivative/1/thumbnail'
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['ETag'], f'"{sha256}-128"')
+        self.assertIn('chart-thumbnail.png',
+                      response.headers['Content-Disposition'])
+        with Image.open(io.BytesIO(response.data)) as image:
+            self.assertEqual(image.size, (128, 64))
+        response = self.app.get(url,
+                                headers={'If-None-Match': f'"{sha256}-128"'})
+        self.assertEqual(response.status_code, 304)
+        generator = self.app.application.extensions['derivatives']
+        self.app.get(url)
+        self.assertEqual(generator.stats()['generated'], 1)
+        # the derivatives of a live blob are not orphans
+        _, orphans = collect(engine,
+                             self.app.application.config['UPLOAD_FOLDER'],
+                             -60, 2, dry_run=True)
+        self.assertFalse([name for name, _ in orphans if sha256 in name])
+
+    def test_derivative_errors(self):
+        '''
+        This function is to test the derivative case
+        "when the report or the size is not valid"
+        '''
+        self.upload('text', b'not an image')
+        res = get_api(self, '/api/v1/report/derivative/1/thumbnail')
+        self.assertEqual(res['meta']['code'], 422)
+        res = get_api(self, '/api/v1/report/derivative/1/huge')
+        self.assertEqual(res['meta']['code'], 404)
+        res = get_api(self, '/api/v1/report/derivative/9/thumbnail')
+        self.assertEqual(res['meta']['code'], 404)
+
+    def test_concurrency_cap(self):
+        '''
+        This function is to test the derivative case
+        "when every slot is busy resizing other images"
+        '''
+        # pylint: disable=protected-access
+        self.upload_image('PNG', 'chart.png')
+        generator = self.app.application.extensions['derivatives']
+        generator.wait = 0.01
+        slots = self.app.application.config['DERIVATIVE_MAX_CONCURRENCY']
+        for _ in range(slots):
+            generator._slots.acquire()
+        response = self.app.get('/api/v1/report/derivative/1/thumbnail')
+        self.assertEqual(format_response(response)['meta']['code'], 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        for _ in range(slots):
+            generator._slots.release()
+        response = self.app.get('/api/v1/report/derivative/1/thumbnail')
+        self.assertEqual(response.status_code, 200)
+
+    def test_pregenerate_and_delete(self):
+        '''
+        This function is to test the derivative case
+        "when derivatives are made at upload and the report is deleted"
+        '''
+        from api.storage.blobstore import blob_name
+        from api.storage.derivatives import derivative_name
+        self.app.application.config['DERIVATIVE_PREGENERATE'] = 1
+        sha256 = self.upload_image('JPEG', 'photo.jpg', (1024, 768))
+        generator = self.app.application.extensions['derivatives']
+        generator.shutdown()
+        storage = self.app.application.extensions['storage']
+        names = [derivative_name(blob_name(sha256), edge, 'jpg')
+                 for edge in (128, 512)]
+        self.assertTrue(all(storage.exists(name) for name in names))
+        self.assertEqual(generator.stats()['generated'], 2)
+        response = self.app.get('/api/v1/report/derivative/1/preview')
+        with Image.open(io.BytesIO(response.data)) as image:
+            self.assertEqual(image.size, (512, 384))
+        delete_api(self, '/api/v1/report/delete/1')
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+
+class TestArchive(ReportTest):
+    '''
+    This class method is to test the archive download API.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.app.application.config['STORAGE_CODEC'] = 'gzip'
+        self.upload('first', b'first report, ' * 100)
+        self.upload('second', b'second report')
+        data = dict(self.upload_data,
+                    name='image',
+                    file=FileStorage(stream=io.BytesIO(b'\x89PNG\r\n\x1a\n'),
+                                     filename='file.png'))
+        post_api_with_form(self, '/api/v1/report/upload', data=data)
+
+    def archive(self, **body):
+        '''
+        Download the archive of the selected reports.
+        '''
+        return self.app.post('/api/v1/report/archive',
+                             data=json_format(**body),
+                             content_type='application/json')
+
+    def test_archive_by_ids(self):
+        '''
+        This function is to test the archive case
+        "when downloading a list of reports"
+        '''
+        response = self.archive(ids=[3, 1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertIn('reports.zip', response.headers['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['first.txt', 'image.png'])
+        # stored compressed at rest, deflated in the archive
+        self.assertEqual(archive.read('first.txt'), b'first report, ' * 100)
+        self.assertEqual(archive.getinfo('first.txt').compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('image.png').compress_type,
+                         zipfile.ZIP_STORED)
+
+    def test_archive_by_filter(self):
+        '''
+        This function is to test the archive case
+        "when downloading the reports selected by a filter"
+        '''
+        response = self.archive(filter={'file_name': 'file.txt'})
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        self.assertEqual(archive.namelist(), ['first.txt', 'second.txt'])
+        self.assertEqual(archive.read('second.txt'), b'second report')
+
+    def test_archive_with_clashing_names(self):
+        '''
+        This function is to test the archive case
+        "when two reports get the same name in the archive"
+        '''
+        from api.conf.database import db_session
+        from api.models import Report
+        db_session.get(Report, 2).name = 'first.txt'
+        db_session.commit()
+        archive = zipfile.ZipFile(io.BytesIO(self.archive(ids=[1, 2]).data))
+        self.assertEqual(archive.namelist(), ['first.txt', 'first (2).txt'])
+        self.assertEqual(archive.read('first (2).txt'), b'second report')
+
+    def test_archive_with_path_names(self):
+        '''
+        This function is to test the archive case
+        "when report names are paths"
+        '''
+        from api.conf.database import db_session
+        from api.models import Report
+        for report_id, name in ((1, '../../etc/evil'), (2, '/tmp/..'),
+                                (3, 'C:\\images\\..\\b.png')):
+            db_session.get(Report, report_id).name = name
+        db_session.commit()
+        archive = zipfile.ZipFile(
+            io.BytesIO(self.archive(ids=[1, 2, 3]).data))
+        # only the last component is kept, never a path out of the folder
+        self.assertEqual(archive.namelist(),
+                         ['evil.txt', 'report.txt', 'b.png'])
+        self.assertEqual(archive.read('report.txt'), b'second report')
+
+    def test_archive_of_missing_or_other_users_reports(self):
+        '''
+        This function is to test the archive case
+        "when a report does not exist or is not owned"
+        '''
+        res = format_response(self.archive(ids=[1, 99]))
+        self.assertEqual(res['meta']['code'], 404)
+        self.assertEqual(res['response']['missing'], [99])
+        data = json_format(email='valid@example.com',
+                           password=self.strong_password)
+        post_api(self, '/api/v1/auth/register', data=data)
+        post_api(self, '/api/v1/auth/login', data=data)
+        res = format_response(self.archive(ids=[1]))
+        self.assertEqual(res['meta']['code'], 404)
+        res = format_response(self.archive(ids='1'))
+        self.assertEqual(res['meta']['code'], 422)
+
+
+class TestQueries(ReportTest):
+    '''
+    This class method is to test the SQL instrumentation of requests.
+    '''
+    upload = TestBlobStore.upload
+
+    def statements(self, url):
+        '''
+        Number of statements of a GET request, from its Server-Timing.
+        '''
+        response = self.app.get(url, content_type='application/json')
+        match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries"',
+                             response.headers['Server-Timing'])
+        return int(match.group(1))
+
+    def test_statements_do_not_grow_with_rows(self):
+        '''
+        This function is to test the instrumentation case
+        "when more reports are listed and read"
+        '''
+        from api.conf.database import db_session
+        from api.models import Report
+        self.upload('first', b'first')
+        listed = self.statements('/api/v1/report/list')
+        read = self.statements('/api/v1/report/read/1')
+        now = datetime.now()
+        db_session.bulk_insert_mappings(Report, [
+            {'name': f'report {number}', 'description': 'queries',
+             'file_name': 'report.pdf', 'user_id': 1,
+             'created_at': now, 'updated_at': now}
+            for number in range(30)])
+        db_session.commit()
+        self.assertEqual(self.statements('/api/v1/report/list'), listed)
+        self.assertEqual(self.statements('/api/v1/report/read/1'), read)
+        self.assertLessEqual(
+            listed, self.app.application.config['QUERY_BUDGET'])
+        self.app.application.extensions['queries'].server_timing = False
+        response = self.app.get('/api/v1/report/list')
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_repeated_statements_are_logged(self):
+        '''
+        This function is to test the instrumentation case
+        "when a handler loads rows one by one"
+        '''
+        from flask import Response
+        from api.conf.database import db_session
+        from api.models import Report
+        app = self.app.application
+        monitor = app.extensions['queries']
+        monitor.budget = 4
+        with app.test_request_context('/api/v1/report/list'):
+            for report_id in range(1, 7):
+                db_session.query(Report).filter_by(id=report_id).first()
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                response = monitor.finish(Response())
+        self.assertIn('desc="6 queries"', response.headers['Server-Timing'])
+        budget, repeated = logs.output
+        self.assertIn('ran 6 statements', budget)
+        self.assertIn('Repeated query (N+1): GET /api/v1/report/list '
+                      '(api.handlers.report.List.get) ran 6 times', repeated)
+        self.assertIn('WHERE report.id = ?', repeated)
+        self.assertEqual(monitor.stats()['repeated'], 1)
+
+    def test_statement_shapes(self):
+        '''
+        This function is to test the instrumentation case
+        "when statements differ only by their values"
+        '''
+        from api.queries import shape_of
+        self.assertEqual(
+            shape_of("SELECT * FROM report\n WHERE id IN (1, 2, 3) "
+                     "AND name = 'it''s'"),
+            shape_of("SELECT * FROM report WHERE id IN (%s, %s) "
+                     "AND name = %s"))
+        self.assertNotEqual(shape_of('SELECT id FROM report'),
+                            shape_of('SELECT id FROM user'))
+
+
+class TestList(ReportTest):
+    '''
+    This class method is to test the list API.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        for number in range(3):
+            self.upload(f'report{number}', f'content {number}'.encode())
+
+    def test_list_all_reports(self):
+        '''
+        This function is to test the list case
+        "when every report fits in one page"
+        '''
+        res = get_api(self, '/api/v1/report/list')
+        self.assertEqual(res['meta']['code'], 200)
+        self.assertIsNone(res['meta']['next'])
+        self.assertEqual([report['name'] for report in res['response']],
+                         ['report0', 'report1', 'report2'])
+
+    def test_list_with_cursor_pagination(self):
+        '''
+        This function is to test the list case
+        "when the reports are fetched page by page with the cursor"
+        '''
+        res = get_api(self, '/api/v1/report/list?limit=2')
+        self.assertEqual([report['id'] for report in res['response']], [1, 2])
+        res = get_api(
+            self, f"/api/v1/report/list?limit=2&cursor={res['meta']['next']}")
+        self.assertEqual([report['id'] for report in res['response']], [3])
+        self.assertIsNone(res['meta']['next'])
+
+    def test_list_with_sparse_fieldset(self):
+        '''
+        This function is to test the list case
+        "when only some fields are requested"
+        '''
+        res = get_api(self, '/api/v1/report/list?fields=id,name,user')
+        self.assertEqual(res['response'][0],
+                         {'id': 1, 'name': 'report0', 'user': 1})
+
+    def test_list_with_invalid_parameters(self):
+        '''
+        This function is to test the list case
+        "when the cursor, the limit or the fields are invalid"
+        '''
+        for query in ('cursor=tampered', 'limit=0', 'limit=many',
+                      'fields=id,password'):
+            res = get_api(self, f'/api/v1/report/list?{query}')
+            self.assertEqual(res['meta']['code'], 422)
+            self.assertEqual(res['response']['error'], 'Invalid input.')
+
+    def test_list_streamed_as_ndjson(self):
+        '''
+        This function is to test the list case
+        "when every report is streamed as ndjson"
+        '''
+        response = self.app.get('/api/v1/report/list?limit=1&fields=id,name',
+                                headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'id': 1, 'name': 'report0'},
+                          {'id': 2, 'name': 'report1'},
+                          {'id': 3, 'name': 'report2'}])
+
+    def test_list_streamed_as_json(self):
+        '''
+        This function is to test the list case
+        "when every report is streamed as a json array"
+        '''
+        response = self.app.get('/api/v1/report/list?stream=json')
+        self.assertTrue(response.is_streamed)
+        res = format_response(response)
+        self.assertEqual(res['meta'], {'code': 200})
+        self.assertEqual(res['response'],
+                         get_api(self, '/api/v1/report/list')['response'])
+
+
+class TestResponseCache(ReportTest):
+    '''
+    This class method is to test the response cache of list and read.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        from api.cache import ResponseCache, LRUBackend
+        self.cache = ResponseCache(LRUBackend(1024 * 1024), 60)
+        self.app.application.extensions['cache'] = self.cache
+        self.upload('first', b'first')
+
+    def list(self):
+        '''
+        List the reports and return the response.
+        '''
+        return self.app.get('/api/v1/report/list')
+
+    def test_list_and_read_are_cached(self):
+        '''
+        This function is to test the response cache case
+        "when the same list and report are read again"
+        '''
+        first = self.list()
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        second = self.list()
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.app.get('/api/v1/report/list?limit=1').
+                         headers['X-Cache'], 'MISS')
+        self.app.get('/api/v1/report/read/1')
+        response = self.app.get('/api/v1/report/read/1')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(format_response(response)['response']['name'],
+                         'first')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+        self.assertEqual(stats['entries'], 3)
+
+    def test_writes_invalidate_the_users_cache(self):
+        '''
+        This function is to test the response cache case
+        "when the reports change after they have been cached"
+        '''
+        self.list()
+        self.upload('second', b'second')
+        response = self.list()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(format_response(response)['response']), 2)
+        self.app.get('/api/v1/report/read/2')
+        put_api(self, '/api/v1/report/update_data/2',
+                data=json_format(name='second', description='changed'))
+        res = format_response(self.app.get('/api/v1/report/read/2'))
+        self.assertEqual(res['response']['description'], 'changed')
+        delete_api(self, '/api/v1/report/delete/1')
+        res = format_response(self.list())
+        self.assertEqual([report['id'] for report in res['response']], [2])
+        # another user never sees the cached reports
+        data = json_format(email='valid@example.com',
+                           password=self.strong_password)
+        post_api(self, '/api/v1/auth/register', data=data)
+        post_api(self, '/api/v1/auth/login', data=data)
+        self.assertEqual(format_response(self.list())['response'], [])
+
+    def test_lru_evicts_by_size(self):
+        '''
+        This function is to test the response cache case
+        "when the cached bodies outgrow the cache"
+        '''
+        from api.cache import LRUBackend
+        backend = LRUBackend(10)
+        backend.set('a', b'aaaa', 60)
+        backend.set('b', b'bbbb', 60)
+        backend.get('a')
+        backend.set('c', b'cccc', 60)
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(backend.get('a'), b'aaaa')
+        self.assertEqual(backend.stats()['bytes'], 8)
+        self.assertEqual(backend.stats()['evictions'], 1)
+        backend.set('d', b'd' * 11, 60)
+        self.assertEqual(backend.get('d'), None)
+
+    def test_shared_cache_between_workers(self):
+        '''
+        This function is to test the response cache case
+        "when two workers share one cache server"
+        '''
+        from api.cache import ResponseCache, RedisBackend
+        server = FakeRedis()
+        worker_a = ResponseCache(RedisBackend(server), 60)
+        worker_b = ResponseCache(RedisBackend(server), 60)
+        self.app.application.extensions['cache'] = worker_a
+        self.list()
+        self.app.application.extensions['cache'] = worker_b
+        self.assertEqual(self.list().headers['X-Cache'], 'HIT')
+        self.upload('second', b'second')
+        self.app.application.extensions['cache'] = worker_a
+        response = self.list()
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(format_response(response)['response']), 2)
+
+
+class TestUsage(ReportTest):
+    '''
+    This class method is to test the storage usage and quota.
+    '''
+    upload = TestBlobStore.upload
+    bulk_upload = TestBulkUpload.bulk_upload
+
+    def usage(self):
+        '''
+        Return the (reports, bytes) of the usage API.
+        '''
+        res = get_api(self, '/api/v1/report/usage')
+        return res['response']['reports'], res['response']['bytes']
+
+    def update_file(self, report_id, content):
+        '''
+        Replace the file of a report.
+        '''
+        return format_response(self.app.put(
+            f'/api/v1/report/update_file/{report_id}',
+            data={'file': FileStorage(stream=io.BytesIO(content),
+                                      filename='file.txt')},
+            content_type='multipart/form-data'))
+
+    def test_usage_follows_changes(self):
+        '''
+        This function is to test the usage case
+        "when reports are uploaded, replaced and deleted"
+        '''
+        self.assertEqual(self.usage(), (0, 0))
+        self.upload('first', b'12345')
+        self.bulk_upload(('second', 'a.txt', b'123'), ('third', 'b.txt', b'1'))
+        self.assertEqual(self.usage(), (3, 9))
+        self.update_file(1, b'1234567890')
+        self.assertEqual(self.usage(), (3, 14))
+        delete_api(self, '/api/v1/report/delete/2')
+        self.assertEqual(self.usage(), (2, 11))
+        delete_api(self, '/api/v1/report/bulk_delete',
+                   token=json_format(ids=[1, 3]))
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_upload_over_quota(self):
+        '''
+        This function is to test the usage case
+        "when an upload would exceed the quota"
+        '''
+        from api.models import Report
+        config = self.app.application.config
+        config['USAGE_MAX_BYTES'] = 10
+        self.upload('first', b'12345678')
+        res = self.upload('second', b'123')
+        self.assertEqual(res['meta']['code'], 403)
+        self.assertEqual(res['response']['error'], 'Storage quota exceeded.')
+        res = self.update_file(1, b'12345678901')
+        self.assertEqual(res['meta']['code'], 403)
+        res = self.bulk_upload(('third', 'a.txt', b'1'),
+                               ('fourth', 'b.txt', b'123'),
+                               ('fifth', 'c.txt', b'1'))
+        self.assertEqual(
+            [result.get('error') for result in res['response']['results']],
+            [None, 'Storage quota exceeded.', None])
+        self.assertEqual(self.usage(), (3, 10))
+        self.assertEqual(sorted(report.name for report in Report.query),
+                         ['fifth', 'first', 'third'])
+        config['USAGE_MAX_BYTES'] = 0
+        config['USAGE_MAX_REPORTS'] = 3
+        res = post_api(self, '/api/v1/report/uploads', data=json_format(
+            name='large', description='large', file_name='large.txt',
+            length=1))
+        self.assertEqual(res['meta']['code'], 403)
+
+    def test_rebuild_usage(self):
+        '''
+        This function is to test the usage case
+        "when the usage is rebuilt from the reports"
+        '''
+        from api.conf.database import db_session, engine
+        from api.models import Report, UserUsage
+        from sqlalchemy.orm import Session
+        from api.usage import rebuild
+        self.upload('first', b'12345')
+        self.upload('second', b'123')
+        # a wrong count, and a report from before the size column
+        db_session.query(UserUsage).update({UserUsage.bytes: 99})
+        db_session.query(Report).filter_by(id=2).update({Report.size: None})
+        db_session.commit()
+        # a user without reports has no usage row yet
+        post_api(self, '/api/v1/auth/register', data=json_format(
+            email='valid@example.com', password=self.strong_password))
+        folder = self.app.application.config['UPLOAD_FOLDER']
+        with mock.patch.object(Session, 'bulk_update_mappings',
+                               autospec=True,
+                               side_effect=Session.bulk_update_mappings) \
+                as update:
+            self.assertEqual(rebuild(engine, folder, workers=2, batch=1), 2)
+        # the wrong row is updated in place, the missing one inserted
+        self.assertEqual([call.args[2] for call in update.call_args_list
+                          if call.args[2]],
+                         [[{'user_id': 1, 'report_count': 2, 'bytes': 8}]])
+        db_session.expire_all()
+        self.assertEqual(self.usage(), (2, 8))
+        self.assertEqual((db_session.get(UserUsage, 2).report_count,
+                          db_session.get(UserUsage, 2).bytes), (0, 0))
+        self.assertEqual(db_session.get(Report, 2).size, 3)
+        result = self.app.application.test_cli_runner().invoke(
+            args=['rebuild-usage', '--workers', '2'])
+        self.assertIn('Rebuilt the usage of 2 users.', result.output)
+
+
+class TestHotFileCache(ReportTest):
+    '''
+    This class method is to test the hot file cache of downloads.
+    '''
+    def setUp(self):
+        TestDownload.setUp(self)
+        from api.storage.hot import HotFileCache
+        self.hot = HotFileCache(64, 32)
+        self.app.application.extensions['hot_files'] = self.hot
+
+    def test_download_from_hot_cache(self):
+        '''
+        This function is to test the hot file cache case
+        "when a report is downloaded again"
+        '''
+        self.assertEqual(self.app.get('/api/v1/report/download/1').data,
+                         self.content)
+        storage = self.app.application.extensions['storage']
+        with mock.patch.object(storage, 'open',
+                               side_effect=AssertionError('read again')):
+            response = self.app.get('/api/v1/report/download/1')
+            self.assertEqual(response.data, self.content)
+            response = self.app.get('/api/v1/report/download/1',
+                                    headers={'Range': 'bytes=4-7,10-'})
+            self.assertEqual(response.status_code, 206)
+            self.assertIn(b'\r\n\r\n4567\r\n', response.data)
+            self.assertIn(b'\r\n\r\nabcdef\r\n', response.data)
+        stats = self.hot.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertEqual(stats['bytes'], 16)
+        self.assertEqual(stats['bytes_loaded'], 16)
+        self.assertEqual(stats['bytes_served'], 32)
+
+    def test_update_and_delete_evict(self):
+        '''
+        This function is to test the hot file cache case
+        "when the file of a cached report is replaced or deleted"
+        '''
+        self.app.get('/api/v1/report/download/1')
+        TestUsage.update_file(self, 1, b'replaced')
+        self.assertEqual(self.hot.stats()['entries'], 0)
+        self.assertEqual(self.app.get('/api/v1/report/download/1').data,
+                         b'replaced')
+        self.assertEqual(self.hot.stats()['entries'], 1)
+        delete_api(self, '/api/v1/report/delete/1')
+        self.assertEqual(self.hot.stats()['entries'], 0)
+
+    def test_eviction_policies(self):
+        '''
+        This function is to test the hot file cache case
+        "when the cache is full"
+        '''
+        # pylint: disable=protected-access
+        from api.storage.backends import MemoryStorage
+        from api.storage.hot import HotFileCache
+        storage = MemoryStorage()
+        storage._objects.update(
+            {name: (name.encode() * 10, 0) for name in 'abcd'})
+        for policy, kept in (('lru', {'c', 'd'}), ('lfu', {'a', 'd'})):
+            cache = HotFileCache(25, 10, policy)
+            for name in 'aabcd':
+                self.assertEqual(cache.fetch(storage, name, 10),
+                                 name.encode() * 10)
+            self.assertEqual(set(cache._entries), kept)
+            self.assertEqual(cache.stats()['evictions'], 2)
+        self.assertIsNone(cache.fetch(storage, 'a', 11))
+
+
+class TestGarbageCollector(ReportTest):
+    '''
+    This class method is to test the orphaned file collector.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.folder = self.app.application.config['UPLOAD_FOLDER']
+        self.res = self.upload('first', b'kept')
+
+    def make_file(self, name, age=7200):
+        '''
+        Create a file below the upload folder, modified age seconds ago.
+        '''
+        path = os.path.join(self.folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'orphan')
+        when = os.path.getmtime(path) - age
+        os.utime(path, (when, when))
+        return path
+
+    def test_collect_orphans(self):
+        '''
+        This function is to test the collector case
+        "when files are left behind that no report uses"
+        '''
+        from api.conf.database import engine
+        from api.storage.blobstore import blob_name
+        from api.storage.gc import collect
+        kept = os.path.join(self.folder,
+                            blob_name(self.res['response']['sha256']))
+        os.utime(kept, (0, 0))
+        orphans = [self.make_file(os.path.join('ee', 'ee', 'e' * 64)),
+                   self.make_file('.upload-interrupted'),
+                   self.make_file(os.path.join('.partial', 'gone')),
+                   self.make_file('legacy.txt')]
+        fresh = self.make_file(os.path.join('ff', 'ff', 'f' * 64), age=0)
+        gitkeep = self.make_file('.gitkeep')
+        stats, listed = collect(engine, self.folder, 3600, 2, dry_run=True)
+        self.assertEqual(stats['orphans'], 4)
+        self.assertEqual(stats['orphan_bytes'], 4 * len(b'orphan'))
+        self.assertIn(('.upload-interrupted', 6), listed)
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+        stats, _ = collect(engine, self.folder, 3600, 2)
+        self.assertEqual(stats['removed'], 4)
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'ee')))
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(gitkeep))
+
+    def test_gc_files_command(self):
+        '''
+        This function is to test the collector case
+        "when it is run from the command line"
+        '''
+        path = self.make_file(os.path.join('ee', 'ee', 'e' * 64))
+        result = self.app.application.test_cli_runner().invoke(
+            args=['gc-files', '--dry-run', '--workers', '2'])
+        self.assertIn(f"would remove {os.path.join('ee', 'ee', 'e' * 64)}",
+                      result.output)
+        self.assertIn('orphans=1', result.output)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+    def test_delete_user_removes_files(self):
+        '''
+        This function is to test the collector case
+        "when a user with reports is deleted"
+        '''
+        from api.models import Report, Blob
+        delete_api(self, '/api/v1/auth/delete_user',
+                   token=self.auth_token_data)
+        self.assertEqual(Report.query.count(), 0)
+        self.assertEqual(Blob.query.count(), 0)
+        sha256 = self.res['response']['sha256']
+        self.assertFalse(os.path.exists(
+            os.path.join(self.folder, sha256[:2], sha256[2:4], sha256)))
+
+
+class TestStorageBackend(ReportTest):
+    '''
+    This class method is to test the storage backends.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.content = b'%PDF-1.4\n/Type /Page\n'
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def use_storage(self, storage):
+        '''
+        Make the app and its job queue store files in storage.
+        '''
+        self.app.application.extensions['storage'] = storage
+        self.app.application.extensions['jobs'].storage = storage
+
+    def check_round_trip(self, storage):
+        '''
+        Upload, inspect, download and delete a report through storage.
+        '''
+        from api.storage.blobstore import blob_name, blob_path
+        self.use_storage(storage)
+        res = self.upload('report', self.content)
+        self.assertTrue(storage.exists(blob_name(self.sha256)))
+        self.assertFalse(os.path.exists(blob_path(self.sha256)))
+        jobs = self.app.application.extensions['jobs']
+        self.assertTrue(jobs.wait(10))
+        job_id = res['response']['jobs'][0]
+        job = get_api(self, f'/api/v1/report/jobs/{job_id}')
+        self.assertEqual(job['response']['result']['pages'], 1)
+        response = self.app.get('/api/v1/report/download/1')
+        self.assertEqual(response.data, self.content)
+        response = self.app.get('/api/v1/report/download/1',
+                                headers={'Range': 'bytes=4-7'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.content[4:8])
+        response = self.app.post('/api/v1/report/archive', json={'ids': [1]})
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertEqual(archive.read('report.txt'), self.content)
+        delete_api(self, '/api/v1/report/delete/1')
+        self.assertFalse(storage.exists(blob_name(self.sha256)))
+
+    def test_memory_backend(self):
+        '''
+        This function is to test the storage case
+        "when files are kept in memory"
+        '''
+        from api.storage.backends import MemoryStorage
+        self.check_round_trip(MemoryStorage())
+
+    def test_s3_backend(self):
+        '''
+        This function is to test the storage case
+        "when files are kept in an S3 bucket"
+        '''
+        from api.storage.backends import S3Storage
+        client = FakeS3()
+        self.check_round_trip(S3Storage(client, 'reports', 'tenant/'))
+        key = 'tenant/' + '/'.join((self.sha256[:2], self.sha256[2:4],
+                                    self.sha256))
+        self.assertIn(('upload_file', key, None), client.calls)
+        # the range is read from the object with a ranged GET
+        self.assertIn(('get_object', key, 'bytes=4-'), client.calls)
+        self.assertIn(('delete_object', key), client.calls)
+
+    def test_s3_object(self):
+        '''
+        This function is to test the storage case
+        "when an S3 object is read and sought"
+        '''
+        from api.storage.backends import S3Storage
+        storage = S3Storage(FakeS3(), 'reports')
+        storage.client.objects[('reports', 'name')] = (b'0123456789', None)
+        self.assertEqual(storage.size('name'), 10)
+        with storage.open('name') as file:
+            self.assertEqual(file.read(3), b'012')
+            self.assertEqual(file.seek(-2, io.SEEK_END), 8)
+            self.assertEqual(file.read(), b'89')
+            file.seek(10)
+            self.assertEqual(file.read(), b'')
+        self.assertFalse(storage.exists('missing'))
+        with self.assertRaises(FileNotFoundError):
+            with storage.open('missing') as file:
+                file.read()
+
+    def test_s3_backend_lists_pages(self):
+        '''
+        This function is to test the storage case
+        "when the objects of a bucket span several pages"
+        '''
+        from api.storage import backends
+        storage = backends.S3Storage(FakeS3(), 'reports', 'tenant/')
+        for index in range(5):
+            storage.client.objects[('reports', f'tenant/{index}')] = (
+                b'x' * index, datetime.now(timezone.utc))
+        storage.client.objects[('reports', 'other/0')] = (b'', None)
+        with mock.patch.object(backends, 'S3_LIST_BATCH', 2):
+            objects = list(storage.iter_objects())
+        self.assertEqual([(name, size) for name, size, _ in objects],
+                         [(str(index), index) for index in range(5)])
+
+    def test_collect_remote_orphans(self):
+        '''
+        This function is to test the storage case
+        "when a remote backend holds files that no report uses"
+        '''
+        from api.conf.database import engine
+        from api.storage.backends import MemoryStorage
+        from api.storage.blobstore import blob_name
+        from api.storage.gc import collect
+        from api.storage.stream import UploadStream
+        storage = MemoryStorage()
+        self.use_storage(storage)
+        self.upload('report', self.content)
+        orphan = UploadStream(self.app.application.config['UPLOAD_FOLDER'])
+        orphan.write(b'orphan')
+        storage.put(os.path.join('ee', 'ee', 'e' * 64), orphan)
+        folder = self.app.application.config['UPLOAD_FOLDER']
+        stats, listed = collect(engine, folder, -60, 2, dry_run=True,
+                                storage=storage)
+        self.assertIn((os.path.join('ee', 'ee', 'e' * 64), 6), listed)
+        self.assertNotIn(blob_name(self.sha256), [name for name, _ in listed])
+        collect(engine, folder, 3600, 2, storage=storage)
+        self.assertTrue(storage.exists(os.path.join('ee', 'ee', 'e' * 64)))
+        stats, _ = collect(engine, folder, -60, 2, storage=storage)
+        self.assertGreaterEqual(stats['removed'], 1)
+        self.assertFalse(storage.exists(os.path.join('ee', 'ee', 'e' * 64)))
+        self.assertTrue(storage.exists(blob_name(self.sha256)))
+
+    @unittest.skipIf(moto is None or boto3 is None, 'needs moto and boto3')
+    def test_s3_backend_with_moto(self):
+        '''
+        This function is to test the storage case
+        "when a large file is uploaded in parts to a local S3 stand-in"
+        '''
+        from api.storage.backends import S3Storage
+        from api.storage.stream import UploadStream
+        config = dict(self.app.application.config,
+                      S3_BUCKET='reports', S3_PREFIX='', S3_ENDPOINT_URL='',
+                      S3_REGION='us-east-1',
+                      S3_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+                      S3_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024)
+        content = os.urandom(6 * 1024 * 1024)
+        credentials = {'AWS_ACCESS_KEY_ID': 'testing',
+                       'AWS_SECRET_ACCESS_KEY': 'testing'}
+        mock_s3 = getattr(moto, 'mock_aws', None) or moto.mock_s3
+        with mock.patch.dict(os.environ, credentials), mock_s3():
+            storage = S3Storage.from_config(config)
+            storage.client.create_bucket(Bucket='reports')
+            upload = UploadStream(config['UPLOAD_FOLDER'])
+            upload.write(content)
+            storage.put('large', upload)
+            # multipart uploads have an ETag that counts their parts
+            etag = storage.client.head_object(Bucket='reports',
+                                              Key='large')['ETag']
+            self.assertTrue(etag.endswith('-2"'))
+            with storage.open('large') as file:
+                file.seek(len(content) - 10)
+                self.assertEqual(file.read(), content[-10:])
+            storage.delete('large')
+            self.assertFalse(storage.exists('large'))
+
+
+class TestMetrics(ReportTest):
+    '''
+    This class method is to test the worker metrics.
+    '''
+
+    def test_metrics_token(self):
+        '''
+        This function is to test the metrics case
+        "when the metrics are read with and without the token"
+        '''
+        response = self.app.get('/api/v1/metrics')
+        self.assertEqual(format_response(response)['meta']['code'], 404)
+        self.app.application.config['METRICS_TOKEN'] = 'secret'
+        response = self.app.get('/api/v1/metrics',
+                                headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(format_response(response)['meta']['code'], 401)
+        response = self.app.get('/api/v1/metrics',
+                                headers={'Authorization': 'Bearer secret'})
+        response = format_response(response)
+        self.assertEqual(response['meta']['code'], 200)
+        pool = response['response']['database_pool']
+        self.assertGreater(pool['checkouts'], 0)
+        self.assertEqual(pool['wait_seconds']['count'], pool['checkouts'])
+        self.assertIsNone(response['response']['hot_files'])
+        self.assertIn('generated', response['response']['derivatives'])
+        self.assertGreater(
+            response['response']['database_queries']['statements'], 0)
+
+    def test_pool_metrics(self):
+        '''
+        This function is to test the metrics case
+        "when connections of a queue pool are used up"
+        '''
+        from sqlalchemy import create_engine
+        from sqlalchemy.exc import TimeoutError as PoolTimeout
+        from api.pool import PoolMetrics
+        metrics = PoolMetrics()
+        with tempfile.TemporaryDirectory() as folder:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(folder, 'pool.db'),
+                **metrics.engine_options('queue', 1, 1, 0.01, 3600, False))
+            metrics.watch(engine)
+            first, second = engine.connect(), engine.connect()
+            stats = metrics.stats(engine.pool)
+            self.assertEqual(stats['pool'], 'QueuePool')
+            self.assertEqual((stats['checked_out'], stats['overflow']),
+                             (2, 1))
+            with self.assertRaises(PoolTimeout):
+                engine.connect()
+            second.invalidate()
+            second.close()
+            first.close()
+            stats = metrics.stats(engine.pool)
+            engine.dispose()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual((stats['checkouts'], stats['created']), (2, 2))
+        self.assertEqual((stats['invalidated'], stats['timeouts']), (1, 1))
+        self.assertEqual(stats['wait_seconds']['count'], 3)
+        self.assertEqual(stats['wait_seconds']['buckets']['+Inf'], 3)
+        self.assertGreaterEqual(stats['wait_seconds']['max'], 0.01)
+
+
+class TestReplicaRouting(ReportTest):
+    '''
+    This class method is to test the routing of reads to replicas.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ReportTest.tearDown(self)
+        self.folder.cleanup()
+
+    def replica(self, replicas, name, source=None):
+        '''
+        Add a replica database with a copy of the tables of source.
+        '''
+        from api.conf.database import Base
+        engine = replicas.add(
+            'sqlite:///' + os.path.join(self.folder.name, name + '.db'),
+            'null', 0, 0, 0, -1, False)
+        Base.metadata.create_all(bind=engine)
+        if source is not None:
+            with source.connect() as reader, engine.begin() as writer:
+                for table in Base.metadata.sorted_tables:
+                    rows = reader.execute(table.select()).mappings().all()
+                    if rows:
+                        writer.execute(table.insert(), [dict(row)
+                                                        for row in rows])
+        return engine
+
+    def test_reads_go_to_replica(self):
+        '''
+        This function is to test the replica case
+        "when reports are read while the replica lags"
+        '''
+        from api.conf.database import db_session, engine
+        from api.routing import ReplicaSet
+        self.upload('replicated', b'replicated')
+        replicas = ReplicaSet()
+        self.replica(replicas, 'replica', engine)
+        with mock.patch.object(db_session(), 'replicas', replicas):
+            # written to the primary only, as if the replica lagged
+            self.upload('lagging', b'lagging')
+            response = get_api(self, '/api/v1/report/list')
+            self.assertEqual([report['name'] for report in
+                              response['response']], ['replicated'])
+            # missing on the replica, found on the primary
+            response = get_api(self, '/api/v1/report/read/2')
+            self.assertEqual(response['response']['name'], 'lagging')
+            response = self.app.get('/api/v1/report/download/2')
+            self.assertEqual(response.data, b'lagging')
+            # a user that the replica does not have yet
+            post_api(self, '/api/v1/auth/register', data=self.strong_data)
+            post_api(self, '/api/v1/auth/login', data=self.strong_data)
+            response = get_api(self, '/api/v1/report/list')
+            self.assertEqual(response['meta']['code'], 200)
+            self.assertEqual(response['response'], [])
+        self.assertGreater(replicas.stats()[0]['requests'], 0)
+        self.assertEqual(replicas.stats()[0]['checked_out'], 0)
+
+    def test_download_of_replaced_file(self):
+        '''
+        This function is to test the replica case
+        "when the replica still has the blob of a replaced file"
+        '''
+        from api.conf.database import db_session, engine
+        from api.routing import ReplicaSet
+        self.upload('replaced', b'old content')
+        replicas = ReplicaSet()
+        self.replica(replicas, 'replica', engine)
+        with mock.patch.object(db_session(), 'replicas', replicas):
+            # the old file is removed, the replica does not know yet
+            res = TestUsage.update_file(self, 1, b'new content')
+            self.assertEqual(res['meta']['code'], 200)
+            response = self.app.get('/api/v1/report/download/1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b'new content')
+
+    def test_cache_reads_primary_after_change(self):
+        '''
+        This function is to test the replica case
+        "when a list is cached right after a change of the user"
+        '''
+        from api.cache import ResponseCache, LRUBackend
+        from api.conf.database import db_session, engine
+        from api.routing import ReplicaSet
+        self.app.application.extensions['cache'] = ResponseCache(
+            LRUBackend(1024 * 1024), 60, 60)
+        self.upload('replicated', b'replicated')
+        replicas = ReplicaSet()
+        self.replica(replicas, 'replica', engine)
+        with mock.patch.object(db_session(), 'replicas', replicas):
+            # written to the primary only, as if the replica lagged
+            self.upload('lagging', b'lagging')
+            for cache in ('MISS', 'HIT'):
+                response = self.app.get('/api/v1/report/list')
+                self.assertEqual(response.headers['X-Cache'], cache)
+                self.assertEqual([report['name'] for report in
+                                  format_response(response)['response']],
+                                 ['replicated', 'lagging'])
+
+    def test_writes_stick_to_primary(self):
+        '''
+        This function is to test the replica case
+        "when a request reads after it wrote"
+        '''
+        from sqlalchemy import create_engine, func, select
+        from api.conf.database import Base
+        from api.models import Role
+        from api.routing import (ReplicaSet, RoutingSession, replica_reads,
+                                 end_request, first)
+        primary = create_engine(
+            'sqlite:///' + os.path.join(self.folder.name, 'primary.db'))
+        Base.metadata.create_all(bind=primary)
+        replicas = ReplicaSet()
+        self.replica(replicas, 'replica')
+        session = RoutingSession(replicas=replicas, bind=primary)
+        count = select(func.count(Role.id))
+        session.add(Role(name='admin'))
+        session.commit()
+        end_request(session)
+        with replica_reads(session):
+            self.assertEqual(session.execute(count).scalar(), 0)
+            role = first(session, session.query(Role).filter_by(name='admin'))
+            self.assertEqual(role.name, 'admin')
+            # the replica has no role, the primary is used from now on
+            self.assertEqual(session.execute(count).scalar(), 1)
+        end_request(session)
+        with replica_reads(session):
+            self.assertEqual(session.execute(count).scalar(), 0)
+            session.add(Role(name='user'))
+            session.flush()
+            self.assertEqual(session.execute(count).scalar(), 2)
+        end_request(session)
+        session.close()
+        primary.dispose()
+
+    def test_replica_policies(self):
+        '''
+        This function is to test the replica case
+        "when a replica is chosen"
+        '''
+        from api.routing import ReplicaSet
+        replicas = ReplicaSet('round_robin')
+        first = self.replica(replicas, 'first')
+        second = self.replica(replicas, 'second')
+        self.assertEqual([replicas.pick() for _ in range(4)],
+                         [first, second, first, second])
+        replicas = ReplicaSet('least_loaded')
+        first = self.replica(replicas, 'first')
+        second = self.replica(replicas, 'second')
+        with first.connect():
+            self.assertEqual([replicas.pick() for _ in range(3)],
+                             [second] * 3)
+        self.assertEqual([replicas.pick() for _ in range(2)],
+                         [second, first])
+        self.assertEqual([item['requests'] for item in replicas.stats()],
+                         [1, 4])
+        with self.assertRaises(ValueError):
+            ReplicaSet('random')
+
+
+class TestSQLite(ReportTest):
+    '''
+    This class method is to test the embedded SQLite backend.
+    '''
+
+    def test_wal_connections(self):
+        '''
+        This function is to test the SQLite case
+        "when a connection reads while another one writes"
+        '''
+        from sqlalchemy import create_engine
+        from api import sqlite
+        from api.conf.database import SQLITE_PRAGMAS
+        from api.pool import PoolMetrics
+        with tempfile.TemporaryDirectory() as folder:
+            engine = create_engine(
+                sqlite.sqlite_uri(os.path.join(folder, 'u6.db')),
+                **PoolMetrics().engine_options('queue', 2, 0, 1, -1, False),
+                **sqlite.engine_options(100))
+            sqlite.watch(engine, dict(SQLITE_PRAGMAS, busy_timeout=100))
+            with engine.begin() as connection:
+                pragmas = sqlite.pragmas_of(connection)
+                connection.exec_driver_sql('CREATE TABLE item (id INTEGER)')
+            self.assertEqual(pragmas['journal_mode'], 'wal')
+            self.assertEqual(pragmas['synchronous'], 1)
+            self.assertEqual(pragmas['busy_timeout'], 100)
+            self.assertEqual(pragmas['foreign_keys'], 1)
+            with engine.connect() as writer, engine.connect() as reader:
+                transaction = writer.begin()
+                writer.exec_driver_sql('INSERT INTO item VALUES (1)')
+                # not blocked by the writer, and sees the last commit
+                self.assertEqual(reader.exec_driver_sql(
+                    'SELECT COUNT(*) FROM item').scalar(), 0)
+                transaction.commit()
+                self.assertEqual(reader.exec_driver_sql(
+                    'SELECT COUNT(*) FROM item').scalar(), 1)
+            engine.dispose()
+
+
+class TestSchema(ReportTest):
+    '''
+    This class method is to test the migrations and indexes of the schema.
+    '''
+
+    @staticmethod
+    def indexes_used(query):
+        '''
+        Names of the indexes in the plan of a query, by EXPLAIN.
+        '''
+        from api.conf.database import engine
+        compiled = query.statement.compile(dialect=engine.dialect)
+        params = tuple(compiled.params[name]
+                       for name in compiled.positiontup)
+        with engine.connect() as connection:
+            if engine.dialect.name == 'sqlite':
+                return set(re.findall(
+                    r'USING (?:COVERING )?INDEX (\w+)',
+                    ' '.join(row[-1] for row in connection.exec_driver_sql(
+                        'EXPLAIN QUERY PLAN ' + compiled.string, params))))
+            return {row['key'] for row in connection.exec_driver_sql(
+                'EXPLAIN ' + compiled.string, params).mappings()
+                if row['key']}
+
+    def test_hot_queries_use_indexes(self):
+        '''
+        This function is to test the schema case
+        "when the owner-scoped queries are planned"
+        '''
+        from api.conf.database import db_session
+        from api.models import Report, User
+        now = datetime.now()
+        db_session.bulk_insert_mappings(Report, [
+            {'name': f'report {number}', 'description': 'explain',
+             'file_name': 'report.pdf', 'user_id': 1,
+             'created_at': now, 'updated_at': now}
+            for number in range(200)])
+        db_session.commit()
+        # a page of List.get
+        self.assertIn('ix_report_user_id_id', self.indexes_used(
+            db_session.query(Report.id, Report.name).
+            filter(Report.user_id == 1, Report.id > 100).
+            order_by(Report.id).limit(101)))
+        # the updated_before filter of the bulk changes
+        self.assertIn('ix_report_user_id_updated_at', self.indexes_used(
+            db_session.query(Report.id).
+            filter(Report.user_id == 1, Report.updated_at < now)))
+        # the user of an auth token
+        self.assertTrue(self.indexes_used(
+            User.query.filter_by(fs_uniquifier='token')))
+
+    @staticmethod
+    def migrate(engine, *revisions):
+        '''
+        Run `flask db upgrade/downgrade` on a database, e.g.
+        migrate(engine, 'head') or migrate(engine, 'head', 'base').
+        '''
+        from alembic import command
+        from alembic.config import Config
+        from alembic.runtime.migration import MigrationContext
+        from api import schema
+        config = Config(os.path.join(schema.MIGRATIONS_FOLDER, 'alembic.ini'))
+        config.set_main_option('script_location', schema.MIGRATIONS_FOLDER)
+        head = schema.scripts().get_current_head()
+        with engine.begin() as connection:
+            config.attributes['connection'] = connection
+            for revision in revisions:
+                current = MigrationContext.configure(
+                    connection).get_current_revision()
+                if current is not None and (
+                        revision == 'base' or
+                        (revision if revision != 'head' else head) < current):
+                    command.downgrade(config, revision)
+                else:
+                    command.upgrade(config, revision)
+
+    @staticmethod
+    def differences(engine):
+        '''
+        Differences between the schema of a database and the models.
+        '''
+        from alembic.autogenerate import compare_metadata
+        from alembic.runtime.migration import MigrationContext
+        from api.conf.database import Base
+        with engine.connect() as connection:
+            return compare_metadata(MigrationContext.configure(connection),
+                                    Base.metadata)
+
+    def test_migrations(self):
+        '''
+        This function is to test the schema case
+        "when an empty database is migrated up and down"
+        '''
+        from sqlalchemy import create_engine, inspect
+        with tempfile.TemporaryDirectory() as folder:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(folder, 'u6.db'))
+            self.migrate(engine, 'head')
+            # the migrations make the schema of the models
+            self.assertEqual(self.differences(engine), [])
+            self.migrate(engine, 'base')
+            self.assertEqual(inspect(engine).get_table_names(),
+                             ['alembic_version'])
+            self.migrate(engine, 'head')
+            self.assertEqual(self.differences(engine), [])
+            engine.dispose()
+
+    def test_baseline_database_is_upgraded(self):
+        '''
+        This function is to test the schema case
+        "when the app starts on a database made before migrations"
+        '''
+        from sqlalchemy import create_engine, inspect
+        from sqlalchemy.orm import Session
+        from api import schema, sqlite
+        from api.conf.database import Base
+        from api.models import Report
+        with tempfile.TemporaryDirectory() as folder:
+            engine = create_engine(
+                'sqlite:///' + os.path.join(folder, 'u6.db'))
+            sqlite.watch(engine, {'foreign_keys': 'ON'})
+            # users, roles and reports, without a revision
+            self.migrate(engine, schema.BASELINE_REVISION)
+            with engine.begin() as connection:
+                connection.exec_driver_sql('DROP TABLE alembic_version')
+                connection.exec_driver_sql(
+                    "INSERT INTO user (id, email, password, fs_uniquifier) "
+                    "VALUES (1, 'old@example.com', 'x', 'old')")
+                connection.exec_driver_sql(
+                    "INSERT INTO report (id, name, description, user_id, "
+                    "file_name) VALUES (1, 'old', 'kept', 1, 'old.txt')")
+            self.assertEqual(len(inspect(engine).get_columns('report')), 8)
+            # what init_db() does when the app starts
+            Base.metadata.create_all(bind=engine)
+            head = schema.scripts().get_current_head()
+            self.assertEqual(schema.stamp(engine, False),
+                             (schema.BASELINE_REVISION, head))
+            self.migrate(engine, 'head')
+            self.assertEqual(schema.stamp(engine, False), (head, head))
+            self.assertEqual(self.differences(engine), [])
+            with Session(engine) as session:
+                report = session.query(Report).one()
+                self.assertEqual((report.name, report.description,
+                                  report.size), ('old', 'kept', None))
+            engine.dispose()
+
+
+class TestSerializer(ReportTest):
+    '''
+    This class method is to test the precompiled report serializer.
+    '''
+    upload = TestBlobStore.upload
+
+    def setUp(self):
+        ReportTest.setUp(self)
+        self.upload('report0', b'content 0')
+        self.upload('report1', b'content 1')
+
+    def test_serializer_matches_report_schema(self):
+        '''
+        This function is to test the serializer case
+        "when ORM objects are serialized"
+        '''
+        from api.models import Report, ReportSchema
+        from api.serializers import report_serializer
+        for report in Report.query.all():
+            self.assertEqual(report_serializer()(report),
+                             ReportSchema().dump(report))
+            only = ('id', 'user', 'created_at')
+            self.assertEqual(report_serializer(only)(report),
+                             ReportSchema(only=only).dump(report))
+
+    def test_serializer_of_rows(self):
+        '''
+        This function is to test the serializer case
+        "when plain rows of the needed columns are serialized"
+        '''
+        from api.conf.database import db_session
+        from api.models import Report, ReportSchema
+        from api.serializers import report_serializer
+        serialize = report_serializer()
+        columns = [getattr(Report, attribute)
+                   for attribute in serialize.attributes]
+        rows = db_session.query(*columns).order_by(Report.id).all()
+        self.assertEqual(
+            [serialize(row) for row in rows],
+            ReportSchema(many=True).dump(
+                Report.query.order_by(Report.id).all()))
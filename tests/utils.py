@@ -3,7 +3,11 @@ This file takes care of utility scripts for testing.
 '''
 
 
+import io
+import os
 import json
+from datetime import datetime, timezone
+from urllib.parse import unquote
 
 
 def json_format(**data):
@@ -53,6 +57,15 @@ def delete_api(self, url, token=None):
     return format_response(response)
 
 
+def put_api(self, url, data=None):
+    '''
+    This function is to send PUT to the API and
+    return the json response.
+    '''
+    response = self.app.put(url, data=data, content_type='application/json')
+    return format_response(response)
+
+
 def post_api_with_form(self, url, data=None):
     '''
     This function is to post form data to the API and
@@ -63,3 +76,129 @@ def post_api_with_form(self, url, data=None):
         data=data,
         content_type='multipart/form-data')
     return format_response(response)
+
+
+def resolve_offload(response, upload_folder, accel_prefix):
+    '''
+    This function is to play the part of the front web server for
+    offloaded downloads and return the bytes it would send.
+    '''
+    if 'X-Sendfile' in response.headers:
+        path = response.headers['X-Sendfile']
+    else:
+        name = unquote(response.headers['X-Accel-Redirect'])
+        path = os.path.join(upload_folder, name[len(accel_prefix):])
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class FakeRedis():
+    '''
+    This class is to stand in for a Redis client in one process, with
+    the commands that the shared response cache uses.
+    '''
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        '''
+        GET, values are returned as bytes.
+        '''
+        value = self.data.get(key)
+        return None if value is None else str(value).encode() \
+            if isinstance(value, int) else value
+
+    def set(self, key, value, ex=None, nx=False):
+        '''
+        SET, the expiry is ignored.
+        '''
+        del ex
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def incr(self, key):
+        '''
+        INCR.
+        '''
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+class FakeS3():
+    '''
+    This class is to stand in for a boto3 S3 client in one process, with
+    the calls that the S3 storage backend makes. Every call is recorded.
+    '''
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    @staticmethod
+    def error(code, operation):
+        '''
+        The ClientError that boto3 raises for an error code.
+        '''
+        from api.storage.backends import ClientError
+        return ClientError({'Error': {'Code': code}}, operation)
+
+    def upload_file(self, Filename, Bucket, Key, Config=None):
+        '''
+        upload_file, in one part.
+        '''
+        # pylint: disable=invalid-name
+        self.calls.append(('upload_file', Key, Config))
+        with open(Filename, 'rb') as file:
+            self.objects[(Bucket, Key)] = (file.read(),
+                                           datetime.now(timezone.utc))
+
+    def head_object(self, Bucket, Key):
+        '''
+        HeadObject.
+        '''
+        # pylint: disable=invalid-name
+        self.calls.append(('head_object', Key))
+        if (Bucket, Key) not in self.objects:
+            raise self.error('404', 'HeadObject')
+        return {'ContentLength': len(self.objects[(Bucket, Key)][0])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        '''
+        GetObject, with an open ended Range.
+        '''
+        # pylint: disable=invalid-name
+        self.calls.append(('get_object', Key, Range))
+        if (Bucket, Key) not in self.objects:
+            raise self.error('NoSuchKey', 'GetObject')
+        data = self.objects[(Bucket, Key)][0]
+        start = int(Range[len('bytes='):-1]) if Range else 0
+        if Range and start >= len(data):
+            raise self.error('InvalidRange', 'GetObject')
+        return {'Body': io.BytesIO(data[start:])}
+
+    def delete_object(self, Bucket, Key):
+        '''
+        DeleteObject.
+        '''
+        # pylint: disable=invalid-name
+        self.calls.append(('delete_object', Key))
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys,
+                        ContinuationToken=None):
+        '''
+        ListObjectsV2, the continuation token is the last key listed.
+        '''
+        # pylint: disable=invalid-name
+        keys = sorted(key for bucket, key in self.objects
+                      if bucket == Bucket and key.startswith(Prefix) and
+                      key > (ContinuationToken or ''))
+        page = {'IsTruncated': len(keys) > MaxKeys,
+                'Contents': [{'Key': key,
+                              'Size': len(self.objects[(Bucket, key)][0]),
+                              'LastModified': self.objects[(Bucket, key)][1]}
+                             for key in keys[:MaxKeys]]}
+        if page['IsTruncated']:
+            page['NextContinuationToken'] = keys[MaxKeys - 1]
+        return page